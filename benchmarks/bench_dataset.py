@@ -0,0 +1,98 @@
+"""
+Compare the former per-element dataset generation of CalculatedQuestion with
+the vectorized count_decimals() and dataset_items() across array sizes.
+
+The database is only needed to import poodle, it is not modified.
+
+Usage:
+    python benchmarks/bench_dataset.py <CONNECTION> <DATABASE>
+"""
+import os
+import sys
+import json
+import re
+import timeit
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+DB_NAME = sys.argv[-1]
+SIZES = [10, 100, 1000, 10000]
+
+# Avoid interactive category prompt of config.apply_config()
+os.makedirs(f'{BASE_PATH}/databases/{DB_NAME}', exist_ok=True)
+if not os.path.isfile(f'{BASE_PATH}/databases/{DB_NAME}/config.json'):
+    with open(f'{BASE_PATH}/databases/{DB_NAME}/config.json', 'w') as wf:
+        json.dump({'NAME': DB_NAME, 'Q_CATEGORIES': ['bench']}, wf)
+
+import context
+from core import CalculatedQuestion
+from lxml import etree as ET
+import numpy as np
+
+
+def legacy_count_decimals(arr):
+    pattern = r'(?<=\.)[0-9e+-]*'
+
+    def get_len(n):
+        if np.int64(n) == n:
+            return 0
+        elif not re.search(r'e', str(n)):
+            return len(re.search(pattern, str(n)).group())
+        elif re.search(r'e\+', str(n)):
+            return 0
+        elif re.search(r'e\-', str(n)):
+            return int(re.search(r'(?<=e\-)[0-9]+', str(n)).group()) - 1
+        else:
+            raise ValueError
+    get_lens = np.vectorize(get_len)
+
+    lens = get_lens(arr)
+    return np.max(lens)
+
+
+def legacy_dataset_items(values, decimals):
+    d_items = ET.Element('dataset_items')
+    for i, n in zip(values, range(len(values))):
+        child = ET.SubElement(d_items, 'dataset_item')
+        subchild = ET.SubElement(child, 'number')
+        subchild.text = str(n+1)
+        subchild = ET.SubElement(child, 'value')
+        if decimals == 0:
+            subchild.text = str(np.int64(i))
+        else:
+            subchild.text = str(i)
+
+    return d_items
+
+
+def legacy(values):
+    return legacy_dataset_items(values, legacy_count_decimals(values))
+
+
+def vectorized(values):
+    return CalculatedQuestion.dataset_items(
+        values, CalculatedQuestion.count_decimals(values)
+    )
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"size":>6} {"kind":>6} {"legacy":>11} {"vectorized":>11} {"speedup":>8}')
+    for size in SIZES:
+        arrays = {
+            'float': np.round(rng.uniform(-100, 100, size), 3),
+            'int': rng.integers(0, 1000, size).astype(float)
+        }
+        for kind, values in arrays.items():
+            # Both implementations must produce the same XML
+            assert (ET.tostring(legacy(values)) == ET.tostring(vectorized(values)))
+            number = max(1, 20000 // size)
+            t_legacy = min(timeit.repeat(lambda: legacy(values),
+                                         number=number, repeat=3)) / number
+            t_vector = min(timeit.repeat(lambda: vectorized(values),
+                                         number=number, repeat=3)) / number
+            print(f'{size:>6} {kind:>6} {t_legacy * 1e3:>9.3f}ms '
+                  f'{t_vector * 1e3:>9.3f}ms {t_legacy / t_vector:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
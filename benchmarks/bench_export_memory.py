@@ -0,0 +1,103 @@
+"""
+Compare peak memory (RSS) of create_xml with and without streaming.
+
+The database given as last argument is filled with synthetic multichoice
+questions that reference large images in question and answer texts. It
+should be a throwaway database, all its questions are deleted afterwards.
+
+Usage:
+    python benchmarks/bench_export_memory.py [N_QUESTIONS] <CONNECTION> <DATABASE>
+"""
+import os
+import sys
+import json
+import shutil
+import resource
+import multiprocessing
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+DB_NAME = sys.argv[-1]
+N_QUESTIONS = int(sys.argv[1]) if len(sys.argv) > 3 else 200
+N_IMAGES = 10
+IMG_SIZE = 256 * 1024
+
+# Avoid interactive category prompt of config.apply_config()
+os.makedirs(f'{BASE_PATH}/databases/{DB_NAME}', exist_ok=True)
+if not os.path.isfile(f'{BASE_PATH}/databases/{DB_NAME}/config.json'):
+    with open(f'{BASE_PATH}/databases/{DB_NAME}/config.json', 'w') as wf:
+        json.dump({'NAME': DB_NAME, 'Q_CATEGORIES': ['bench']}, wf)
+
+import context
+import config
+import core
+
+
+def vm_rss() -> int:
+    with open('/proc/self/status', 'r') as rf:
+        for line in rf:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def setup() -> list:
+    img_path = f'{BASE_PATH}/databases/{DB_NAME}/img/'
+    for i in range(N_IMAGES):
+        with open(img_path + f'bench{i}.png', 'wb') as wf:
+            wf.write(os.urandom(IMG_SIZE))
+    questions = [
+        {
+            'name': f'bench{i:04d}99', 'question': 'Question [[file1]]',
+            'family_type': 'single', 'moodle_type': 'multichoice',
+            'points': 1.0, 'in_exams': {}, 'time_est': 1, 'difficulty': 1,
+            'correct_answers': ['[[file2]]'], 'false_answers': ['[[file1]]'],
+            'single': 1,
+            'img_files': [f'bench{i % N_IMAGES}.png',
+                          f'bench{(i + 1) % N_IMAGES}.png']
+        } for i in range(N_QUESTIONS)
+    ]
+    config.QUESTIONS.delete_many({'name': {'$regex': '^bench'}})
+    config.QUESTIONS.insert_many(questions)
+
+    return [q['name'] for q in questions]
+
+
+def teardown() -> None:
+    config.QUESTIONS.delete_many({'name': {'$regex': '^bench'}})
+    shutil.rmtree(f'{BASE_PATH}/databases/{DB_NAME}/exams/bench', ignore_errors=True)
+    core.FRAGMENT_CACHE.clear()
+    core.evict_lru(core.IMAGE_CACHE.cache_dir or '', 0)
+    for i in range(N_IMAGES):
+        os.remove(f'{BASE_PATH}/databases/{DB_NAME}/img/bench{i}.png')
+
+
+def run(names: list, stream: bool, queue) -> None:
+    # Measure rendering, not fragment reuse
+    core.FRAGMENT_CACHE.clear()
+    baseline = vm_rss()
+    core.create_xml('bench', f'stream-{stream}.xml', mode='gui',
+                    questions=names, stream=stream)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((baseline, peak))
+
+
+if __name__ == '__main__':
+    names = setup()
+    ctx = multiprocessing.get_context('fork')
+    results = {}
+    try:
+        for stream in (False, True):
+            queue = ctx.Queue()
+            p = ctx.Process(target=run, args=(names, stream, queue))
+            p.start()
+            results[stream] = queue.get()
+            p.join()
+        size = os.path.getsize(
+            f'{BASE_PATH}/databases/{DB_NAME}/exams/bench/stream-False.xml'
+        )
+    finally:
+        teardown()
+
+    print(f'\n{N_QUESTIONS} questions, output size: {size / 2**20:.1f} MiB')
+    for stream, (baseline, peak) in results.items():
+        print(f'stream={stream!s:5}  peak RSS: {peak / 1024:8.1f} MiB  '
+              f'(+{(peak - baseline) / 1024:.1f} MiB during export)')
@@ -0,0 +1,153 @@
+"""
+Compare peak memory (RSS) and time of importing a large JSON file of
+questions as formerly done by add_json(), i.e. json.load() followed by
+check_question() and insert_one() per question, and with the streaming
+add_json().
+
+The database given as last argument is filled with synthetic multichoice
+questions named after its question categories. It should be a throwaway
+database: the benchmark refuses to run if any of the generated names exists
+already, and deletes the generated questions and restores the counters
+afterwards. A new database is configured with enough categories for 257400
+questions, each category holds 9900 at most.
+
+Usage:
+    python benchmarks/bench_import_memory.py [N_QUESTIONS] <CONNECTION> <DATABASE>
+"""
+import os
+import sys
+import json
+import time
+import string
+import resource
+import itertools
+import multiprocessing
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+DB_NAME = sys.argv[-1]
+N_QUESTIONS = int(sys.argv[1]) if len(sys.argv) > 3 else 50000
+TEXT_SIZE = 2048
+
+# Avoid interactive category prompt of config.apply_config()
+os.makedirs(f'{BASE_PATH}/databases/{DB_NAME}', exist_ok=True)
+if not os.path.isfile(f'{BASE_PATH}/databases/{DB_NAME}/config.json'):
+    with open(f'{BASE_PATH}/databases/{DB_NAME}/config.json', 'w') as wf:
+        json.dump({'NAME': DB_NAME, 'Q_CATEGORIES': [
+            f'bench{c}' for c in string.ascii_uppercase
+        ]}, wf)
+
+import context
+import config
+import question
+
+JSON_FILE = f'{BASE_PATH}/databases/{DB_NAME}/bench-import.json'
+ERROR_FILE = f'{BASE_PATH}/databases/{DB_NAME}/bench-import-errors.json'
+
+
+def vm_rss() -> int:
+    with open('/proc/self/status', 'r') as rf:
+        for line in rf:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def question_names() -> list:
+    # Names have to pass the naming scheme check of the database, so every
+    # family of every category is filled with a parent and 98 children
+    categories = config.Q_CATEGORIES or [f'bench{c}' for c in string.ascii_uppercase]
+    names = list(itertools.islice((
+        f'{c}{family:02d}{child:02d}'
+        for c in categories for family in range(1, 100) for child in range(99)
+    ), N_QUESTIONS))
+    if len(names) < N_QUESTIONS:
+        sys.exit(f'The categories of {DB_NAME} hold {len(names)} questions at '
+                 'most. Use fewer questions or a new database.')
+    if config.QUESTIONS.count_documents({'name': {'$in': names}}, limit=1):
+        sys.exit(f'{DB_NAME} already contains questions with the generated names. '
+                 'Use a new database.')
+
+    return names
+
+
+NAMES = question_names()
+COUNTERS = list(config.COUNTERS.find())
+
+
+def setup() -> None:
+    # Written one question at a time to keep this process small
+    with open(JSON_FILE, 'w') as wf:
+        wf.write('[\n')
+        for i, name in enumerate(NAMES):
+            if i:
+                wf.write(',\n')
+            json.dump({
+                'name': name, 'question': 'x' * TEXT_SIZE,
+                'family_type': 'parent' if name.endswith('00') else 'child',
+                'moodle_type': 'multichoice',
+                'points': 1.0, 'in_exams': {}, 'time_est': 1, 'difficulty': 1,
+                'correct_answers': ['a'], 'false_answers': ['b', 'c'],
+                'single': 1
+            }, wf)
+        wf.write('\n]\n')
+
+
+def clear() -> None:
+    config.QUESTIONS.delete_many({'name': {'$in': NAMES}})
+    config.COUNTERS.delete_many({})
+    if COUNTERS:
+        config.COUNTERS.insert_many(COUNTERS)
+
+
+def teardown() -> None:
+    clear()
+    for path in (JSON_FILE, ERROR_FILE):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def legacy() -> None:
+    with open(JSON_FILE, 'r') as rf:
+        question_list = json.load(rf)
+    for q in question_list:
+        if not question.check_question(json.dumps(q)):
+            config.QUESTIONS.insert_one(q)
+
+
+def streaming() -> None:
+    question.add_json(JSON_FILE)
+
+
+def run(function, queue) -> None:
+    baseline = vm_rss()
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    added = config.QUESTIONS.count_documents({'name': {'$in': NAMES}})
+    clear()
+    queue.put((baseline, peak, duration, added))
+
+
+if __name__ == '__main__':
+    setup()
+    ctx = multiprocessing.get_context('fork')
+    results = {}
+    try:
+        for function in (legacy, streaming):
+            queue = ctx.Queue()
+            p = ctx.Process(target=run, args=(function, queue))
+            p.start()
+            *results[function.__name__], added = queue.get()
+            p.join()
+            # Both have to import every question, otherwise the error path
+            # was measured
+            assert added == N_QUESTIONS, f'{function.__name__} added {added} questions'
+        size = os.path.getsize(JSON_FILE)
+    finally:
+        teardown()
+
+    print(f'\n{N_QUESTIONS} questions, file size: {size / 2**20:.1f} MiB')
+    for name, (baseline, peak, duration) in results.items():
+        print(f'{name:9}  peak RSS: {peak / 1024:8.1f} MiB  '
+              f'(+{(peak - baseline) / 1024:.1f} MiB during import)  '
+              f'{duration:.1f}s')
@@ -0,0 +1,106 @@
+"""
+Compare the former overview generation, which fetched whole question documents
+and built the matrix row by row in Python, with overview_matrix(), which
+projects the needed fields server side and assembles the matrix with numpy.
+
+The database given as last argument is filled with synthetic questions and
+exams. It should be a throwaway database, all its questions and exams are
+deleted afterwards.
+
+Usage:
+    python benchmarks/bench_overview.py [N_QUESTIONS] [N_EXAMS] <CONNECTION> <DATABASE>
+"""
+import os
+import sys
+import json
+import time
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+DB_NAME = sys.argv[-1]
+N_QUESTIONS = int(sys.argv[1]) if len(sys.argv) > 4 else 20000
+N_EXAMS = int(sys.argv[2]) if len(sys.argv) > 4 else 40
+TEXT_SIZE = 2048
+
+# Avoid interactive category prompt of config.apply_config()
+os.makedirs(f'{BASE_PATH}/databases/{DB_NAME}', exist_ok=True)
+if not os.path.isfile(f'{BASE_PATH}/databases/{DB_NAME}/config.json'):
+    with open(f'{BASE_PATH}/databases/{DB_NAME}/config.json', 'w') as wf:
+        json.dump({'NAME': DB_NAME, 'Q_CATEGORIES': ['bench']}, wf)
+
+import context
+import config
+from core import overview_matrix
+import numpy as np
+import pandas as pd
+
+
+def setup() -> None:
+    rng = np.random.default_rng(0)
+    exams = [f'bench_exam{i:03d}' for i in range(N_EXAMS)]
+    config.EXAMS.insert_many([{'name': e} for e in exams])
+    batch = []
+    for i in range(N_QUESTIONS):
+        points = float(rng.integers(1, 5))
+        taken = rng.random(N_EXAMS) < 0.2
+        batch.append({
+            'name': f'bench{i:06d}99', 'question': 'x' * TEXT_SIZE,
+            'family_type': 'single', 'moodle_type': 'multichoice',
+            'points': points, 'time_est': 1, 'difficulty': 1, 'child_no': 99,
+            'in_exams': {e: float(rng.integers(0, points + 1))
+                         for e, t in zip(exams, taken) if t},
+            'correct_answers': ['a'], 'false_answers': ['b', 'c'], 'single': 1
+        })
+        if len(batch) == 1000:
+            config.QUESTIONS.insert_many(batch)
+            batch = []
+    if batch:
+        config.QUESTIONS.insert_many(batch)
+
+
+def teardown() -> None:
+    config.QUESTIONS.delete_many({'name': {'$regex': '^bench'}})
+    config.EXAMS.delete_many({'name': {'$regex': '^bench_exam'}})
+
+
+def legacy() -> pd.DataFrame:
+    exam_list = sorted([e['name'] for e in config.EXAMS.find()])
+    return pd.DataFrame(sorted(
+        [
+            [q['name'], q['difficulty'], q['time_est']] +
+            [np.round(q['in_exams'][e] / q['points'], 2)
+             if e in q['in_exams'] else '.' for e in exam_list
+            ]
+            for q in config.QUESTIONS.find({'child_no': {'$ne': 0}})
+        ]),
+        columns = ['question', 'difficulty', 'time'] + exam_list
+    )
+
+
+def aggregated() -> pd.DataFrame:
+    names, difficulty, time_est, exam_list, cells = overview_matrix()
+    return pd.concat([
+        pd.DataFrame({'question': names, 'difficulty': difficulty, 'time': time_est}),
+        pd.DataFrame(cells, columns=exam_list)
+    ], axis=1)
+
+
+def main():
+    teardown()
+    setup()
+    try:
+        results = {}
+        for label, func in [('legacy', legacy), ('aggregated', aggregated)]:
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                results[label] = func()
+                times.append(time.perf_counter() - start)
+            print(f'{label:>10} {min(times):>8.3f}s')
+        # Both implementations must produce the same table
+        assert results['legacy'].astype(str).equals(results['aggregated'].astype(str))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
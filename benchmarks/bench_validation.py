@@ -0,0 +1,77 @@
+"""
+Measure the cost of check_question() per question for each moodle_type,
+for valid questions and for questions with errors. Duplicate names are
+checked against an in-memory set, so the database is not queried.
+
+The database is only needed to import poodle, it is not modified.
+
+Usage:
+    python benchmarks/bench_validation.py <CONNECTION> <DATABASE>
+"""
+import os
+import sys
+import json
+import copy
+import timeit
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+DB_NAME = sys.argv[-1]
+NUMBER = 2000
+
+# Avoid interactive category prompt of config.apply_config()
+os.makedirs(f'{BASE_PATH}/databases/{DB_NAME}', exist_ok=True)
+if not os.path.isfile(f'{BASE_PATH}/databases/{DB_NAME}/config.json'):
+    with open(f'{BASE_PATH}/databases/{DB_NAME}/config.json', 'w') as wf:
+        json.dump({'NAME': DB_NAME, 'Q_CATEGORIES': ['bench']}, wf)
+
+import context
+import config
+from question import check_question
+
+# Valid questions have to pass the naming scheme check of the database
+CATEGORY = (config.Q_CATEGORIES or ['bench'])[0]
+GENERAL = {
+    'name': f'{CATEGORY}0199', 'question': 'Question text', 'family_type': 'single',
+    'points': 1.0, 'in_exams': {}, 'time_est': 1, 'difficulty': 1,
+    'img_files': [], 'tables': {}
+}
+QUESTIONS = {
+    'multichoice': {'correct_answers': ['a'], 'false_answers': ['b', 'c'],
+                    'single': 1},
+    'numerical': {'correct_answers': ['1'], 'tolerance': 0.1},
+    'shortanswer': {'correct_answers': ['a'], 'usecase': 0},
+    'essay': {'answer_files': [0, 1]},
+    'matching': {'correct_answers': {'a': 'b', 'c': 'd'}, 'false_answers': []},
+    'gapselect': {'correct_answers': {'1': ['a']}, 'false_answers': {'1': ['b']}},
+    'ddimageortext': {'correct_answers': ['a', 'b'], 'img_files': ['x.png'],
+                      'drops': {'1': [1, 2], '2': [3, 4]}},
+    'calculated': {'correct_answers': ['{a}'], 'tolerance': [0.1, 'relative', 2],
+                   'vars': ['a']}
+}
+# Faulty fields added to every question type
+ERRORS = {'points': 0., 'question': ' ', 'time_est': '1', 'family_type': 'x'}
+
+
+def main():
+    existing_names = {f'{CATEGORY}{i:04d}' for i in range(2000, 3000)}
+    print(f'{"moodle_type":>14} {"valid":>10} {"errors":>10}')
+    total = {'valid': 0., 'errors': 0.}
+    for moodle_type, fields in QUESTIONS.items():
+        valid = dict(copy.deepcopy(GENERAL), moodle_type=moodle_type, **fields)
+        faulty = dict(valid, **ERRORS)
+        assert not check_question(valid, existing_names=existing_names)
+        times = {}
+        for kind, q in [('valid', valid), ('errors', faulty)]:
+            times[kind] = min(timeit.repeat(
+                lambda: check_question(q, existing_names=existing_names),
+                number=NUMBER, repeat=5
+            )) / NUMBER
+            total[kind] += times[kind] / len(QUESTIONS)
+        print(f'{moodle_type:>14} {times["valid"] * 1e6:>8.1f}us '
+              f'{times["errors"] * 1e6:>8.1f}us')
+    print(f'{"mean":>14} {total["valid"] * 1e6:>8.1f}us '
+          f'{total["errors"] * 1e6:>8.1f}us')
+
+
+if __name__ == '__main__':
+    main()
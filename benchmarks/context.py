@@ -0,0 +1,5 @@
+import os
+import sys
+
+IMPORT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'poodle'))
+sys.path.append(os.path.abspath(IMPORT_PATH))
@@ -2,6 +2,10 @@ import pymongo
 import os
 import sys
 import json
+import copy
+import datetime
+import threading
+from collections import OrderedDict
 
 BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 
@@ -20,6 +24,9 @@ def setup_db(db) -> None:
             'Q_CATEGORIES': [],
             'SHUFFLE': 1,
             'RANDOM_ARR_SIZE': 100,
+            'IMG_CACHE_SIZE': 100,
+            'IMG_MAX_DIM': 0,
+            'IMG_QUALITY': 85,
             'COLLECTIONS': ['questions', 'exams']
         }
         with open(DB_PATH + 'config.json', 'w') as wf:
@@ -36,6 +43,9 @@ def apply_config():
         'Q_CATEGORIES': [],
         'SHUFFLE': 1,
         'RANDOM_ARR_SIZE': 100,
+        'IMG_CACHE_SIZE': 100,
+        'IMG_MAX_DIM': 0,
+        'IMG_QUALITY': 85,
         'COLLECTIONS': ['questions', 'exams']
     }
     for i, j in template.items():
@@ -62,8 +72,423 @@ def apply_config():
     Q_CATEGORIES = config['Q_CATEGORIES']
     SHUFFLE = config['SHUFFLE']
     RANDOM_ARR_SIZE = config['RANDOM_ARR_SIZE']
+    # Size limit of on-disk image cache in MB (0 disables it)
+    IMG_CACHE_SIZE = config['IMG_CACHE_SIZE']
+    # Maximum width/height of exported images in pixels (0 disables
+    # optimization) and JPEG quality of optimized images
+    IMG_MAX_DIM = config['IMG_MAX_DIM']
+    IMG_QUALITY = config['IMG_QUALITY']
 
-    return Q_CATEGORIES, SHUFFLE, RANDOM_ARR_SIZE
+    return (Q_CATEGORIES, SHUFFLE, RANDOM_ARR_SIZE, IMG_CACHE_SIZE,
+            IMG_MAX_DIM, IMG_QUALITY)
+
+
+class QuestionCache:
+    """
+    Bounded LRU cache of question documents keyed by question name. Every
+    function writing to the questions collection has to invalidate the names it
+    touched, otherwise stale documents will be served.
+
+    Arguments:
+    ----------
+    collection (pymongo.collection.Collection):
+      Collection the documents are read from.
+    maxsize (int):
+      Maximum number of cached documents.
+
+    -------------------------------------------
+    Dependencies: copy, threading, OrderedDict
+    """
+
+    def __init__(self, collection, maxsize=2048):
+        self.collection = collection
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._docs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, name, doc):
+        self._docs[name] = doc
+        self._docs.move_to_end(name)
+        while len(self._docs) > self.maxsize:
+            self._docs.popitem(last=False)
+
+    def get(self, name):
+        """
+        Return a copy of the question document or None if it doesn't exist.
+        """
+        with self._lock:
+            if name in self._docs:
+                self.hits += 1
+                self._docs.move_to_end(name)
+                return copy.deepcopy(self._docs[name])
+            self.misses += 1
+        doc = self.collection.find_one({'name': name})
+        # Missing questions are not cached so that inserts need no invalidation
+        if doc is not None:
+            with self._lock:
+                self._store(name, doc)
+        return copy.deepcopy(doc)
+
+    def get_many(self, names):
+        """
+        Return dict of name: document for all existing names. Names missing
+        from the cache are fetched with a single query.
+        """
+        result = {}
+        missing = []
+        with self._lock:
+            for n in names:
+                if n in self._docs:
+                    self.hits += 1
+                    self._docs.move_to_end(n)
+                    result[n] = copy.deepcopy(self._docs[n])
+                elif n not in missing:
+                    self.misses += 1
+                    missing.append(n)
+        if missing:
+            for doc in self.collection.find({'name': {'$in': missing}}):
+                with self._lock:
+                    self._store(doc['name'], doc)
+                result[doc['name']] = copy.deepcopy(doc)
+        return result
+
+    def invalidate(self, *names):
+        with self._lock:
+            for n in names:
+                self._docs.pop(n, None)
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'size': len(self._docs), 'maxsize': self.maxsize
+        }
+
+
+# Question names consist of category, two digit family number and two digit
+# child number ('00' for parents, '99' for single questions). These parts are
+# stored as indexed fields of every question document.
+NAME_FIELDS = ('category', 'family_no', 'child_no')
+
+
+def split_name(name) -> dict:
+    """
+    Decompose a question name into the fields of NAME_FIELDS, e.g. 'AB0102'
+    into {'category': 'AB', 'family_no': 1, 'child_no': 2}. All parts are None
+    for names that don't follow the naming scheme. Every write of a question
+    name has to set these fields as well.
+
+    Arguments:
+    ----------
+    name (str):
+      Question name.
+    """
+    if type(name) == str and len(name) > 4 and name[-4:].isdigit():
+        return {
+            'category': name[:-4], 'family_no': int(name[-4:-2]),
+            'child_no': int(name[-2:])
+        }
+    return dict.fromkeys(NAME_FIELDS)
+
+
+# The last used
+# numbers are kept in the counters collection as {'_id': key, 'seq': n} with
+# keys 'family:<category>' and 'child:<family>', e.g. 'child:AB01'.
+def update_counters(names) -> None:
+    """
+    Raise counters to the numbers used by the given question names. Needed
+    whenever questions are inserted with names that weren't allocated by
+    new_question_name(), e.g. by importers. Counters never decrease.
+
+    Arguments:
+    ----------
+    names (iterable):
+      Question names.
+
+    ----------------------
+    Dependencies: pymongo
+    """
+    seqs = {}
+    for name in names:
+        parts = split_name(name)
+        if parts['category'] is None:
+            continue
+        key = f'family:{parts["category"]}'
+        seqs[key] = max(seqs.get(key, 0), parts['family_no'])
+        if parts['child_no'] not in (0, 99):
+            key = f'child:{name[:-2]}'
+            seqs[key] = max(seqs.get(key, 0), parts['child_no'])
+    for k, v in seqs.items():
+        COUNTERS.update_one({'_id': k}, {'$max': {'seq': v}}, upsert=True)
+
+
+def new_question_name(category: str, family_type: str, parent: str = None) -> str:
+    """
+    Allocate the name of a new question with one atomic update of the
+    counters collection, so concurrent users never get the same name.
+    Allocated names stay used even if the question is never saved.
+
+    Arguments:
+    ----------
+    category (str):
+      Question category. Ignored for child questions.
+    family_type (str):
+      'single', 'parent' or 'child'.
+    parent (str):
+      Name of the parent question if family_type is 'child'.
+
+    ----------------------
+    Dependencies: pymongo
+    """
+    if family_type == 'child':
+        prefix, key, limit = parent[:-2], f'child:{parent[:-2]}', 98
+    else:
+        prefix, key, limit = category, f'family:{category}', 99
+    seq = COUNTERS.find_one_and_update(
+        {'_id': key}, {'$inc': {'seq': 1}}, upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )['seq']
+    if seq > limit:
+        raise Exception(f'No question numbers left for {prefix}')
+    if family_type == 'child':
+        return prefix + '%02d' % seq
+    return prefix + '%02d' % seq + ('00' if family_type == 'parent' else '99')
+
+
+## Question statistics
+# One document per question that appeared in an exam: {'question',
+# 'appearances', 'score_mean', 'score_min', 'score_max', 'last_exam',
+# 'last_used'}. Scores are relative to the question's points and None until
+# an exam is evaluated. Documents are recomputed from exam_questions for
+# every question an update touches, so they never drift from it.
+def _exam_date(exam) -> datetime.datetime:
+    # Exams created before their date was stored fall back to the ObjectId
+    date = exam.get('date') or exam['_id'].generation_time
+    if date.tzinfo:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return date
+
+
+def update_question_stats(names=None) -> int:
+    """
+    Recompute the statistics of questions from the exam_questions collection.
+    Called whenever exams are registered, removed or evaluated and whenever
+    questions are renamed or edited. Rebuilds all statistics if no names are
+    given, e.g. after restoring a backup or editing collections by hand.
+
+    Arguments:
+    ----------
+    names (iterable):
+      Question names whose statistics are recomputed. All questions if None.
+
+    Returns number of questions that have statistics after the update.
+
+    ----------------------
+    Dependencies: pymongo
+    """
+    if names is not None:
+        names = list(names)
+    edges = {}
+    for e in EXAM_QUESTIONS.find(
+        {} if names is None else {'question': {'$in': names}},
+        {'_id': 0, 'exam': 1, 'question': 1, 'score': 1}
+    ):
+        edges.setdefault(e['question'], []).append(e)
+    points = {q['name']: q.get('points') for q in QUESTIONS.find(
+        {} if names is None else {'name': {'$in': list(edges)}},
+        {'_id': 0, 'name': 1, 'points': 1}
+    )}
+    dates = {e['name']: _exam_date(e) for e in EXAMS.find(
+        {'name': {'$in': list({e['exam'] for v in edges.values() for e in v})}},
+        {'name': 1, 'date': 1}
+    )}
+
+    for name, question_edges in edges.items():
+        scores = [
+            round(e['score'] / points[name], 2) for e in question_edges
+            if isinstance(e.get('score'), (int, float)) and e['score'] == e['score']
+            and points.get(name)
+        ]
+        # Exams missing from the exams collection count as oldest
+        last = max(question_edges, key=lambda e: (
+            dates.get(e['exam']) or datetime.datetime.min, e['exam']
+        ))
+        QUESTION_STATS.update_one({'question': name}, {'$set': {
+            'appearances': len(question_edges),
+            'score_mean': round(sum(scores) / len(scores), 2) if scores else None,
+            'score_min': min(scores) if scores else None,
+            'score_max': max(scores) if scores else None,
+            'last_exam': last['exam'],
+            'last_used': dates.get(last['exam'])
+        }}, upsert=True)
+    # Questions that are in no exam anymore
+    if names is None:
+        QUESTION_STATS.delete_many({'question': {'$nin': list(edges)}})
+    else:
+        QUESTION_STATS.delete_many(
+            {'question': {'$in': [n for n in names if n not in edges]}}
+        )
+
+    return len(edges)
+
+
+## Schema migrations
+# Applied migrations are stored by name in the meta collection instead of
+# config.json, so that restored backups are migrated again. Several clients
+# may migrate the same database at once, so every migration has to be
+# idempotent. Migrations are independent of each other unless listed in
+# MIGRATION_REQUIRES, so one that fails doesn't hold back the others.
+def _migrate_name_fields() -> None:
+    # Name parts of questions written before they were stored
+    for q in QUESTIONS.find({'category': {'$exists': False}}, {'name': 1}):
+        QUESTIONS.update_one({'_id': q['_id']}, {'$set': split_name(q.get('name'))})
+
+
+def _migrate_name_indexes() -> None:
+    # Names identify questions and exams, duplicates have to be resolved first
+    for collection in (QUESTIONS, EXAMS):
+        duplicates = [
+            f"{d['_id']!r} (_id: {', '.join(str(i) for i in d['ids'])})"
+            for d in collection.aggregate([
+                {'$group': {'_id': '$name', 'ids': {'$push': '$_id'}}},
+                {'$match': {'ids.1': {'$exists': True}}},
+                {'$sort': {'_id': 1}}
+            ])
+        ]
+        if duplicates:
+            raise Exception(
+                f'Duplicate names in collection {collection.name}: '
+                f'{"; ".join(duplicates)}\n'
+                'Rename or remove all but one document of each name, the '
+                'unique name index is created on the next launch.'
+            )
+        index = collection.index_information().get('name_1')
+        if index and not index.get('unique'):
+            collection.drop_index('name_1')
+        collection.create_index('name', unique=True)
+    # Category, family and child queries
+    QUESTIONS.create_index([('category', 1), ('family_no', 1), ('child_no', 1)])
+
+
+def _migrate_counters() -> None:
+    update_counters(q.get('name') for q in QUESTIONS.find({}, {'_id': 0, 'name': 1}))
+
+
+def _migrate_exam_questions() -> None:
+    # Edges are looked up by exam as well as by question
+    EXAM_QUESTIONS.create_index([('exam', 1), ('question', 1)], unique=True)
+    EXAM_QUESTIONS.create_index([('question', 1), ('exam', 1)])
+    for q in QUESTIONS.find({'in_exams': {'$ne': {}}}, {'name': 1, 'in_exams': 1}):
+        for exam, score in (q.get('in_exams') or {}).items():
+            EXAM_QUESTIONS.update_one(
+                {'exam': exam, 'question': q['name']},
+                {'$setOnInsert': {'score': score}}, upsert=True
+            )
+
+
+def _migrate_question_stats() -> None:
+    QUESTION_STATS.create_index('question', unique=True)
+    update_question_stats()
+
+
+MIGRATIONS = [
+    _migrate_name_fields, _migrate_name_indexes, _migrate_counters,
+    _migrate_exam_questions, _migrate_question_stats
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+# Question stats are computed from the exam_questions backfill
+MIGRATION_REQUIRES = {'_migrate_question_stats': ['_migrate_exam_questions']}
+
+
+def migrate_db() -> int:
+    """
+    Apply all migrations of MIGRATIONS the database hasn't seen yet. Called on
+    launch. A failed migration is reported and retried on the next launch,
+    only migrations requiring it are skipped meanwhile.
+
+    Returns the number of applied migrations, SCHEMA_VERSION if the database
+    is up to date.
+
+    ----------------------
+    Dependencies: pymongo
+    """
+    schema = DB.meta.find_one({'_id': 'schema'}) or {}
+    # Databases migrated before migrations were stored by name
+    applied = set(schema.get('applied', [
+        m.__name__ for m in MIGRATIONS[:schema.get('version', 0)]
+    ]))
+    for m in MIGRATIONS:
+        if m.__name__ in applied:
+            continue
+        missing = [r for r in MIGRATION_REQUIRES.get(m.__name__, []) if r not in applied]
+        if missing:
+            print(f'Migration {m.__name__} of database {DB.name} skipped, '
+                  f'it requires {", ".join(missing)}.')
+            continue
+        try:
+            m()
+        except Exception as e:
+            print(f'Migration {m.__name__} of database {DB.name} failed:\n{e}')
+            continue
+        applied.add(m.__name__)
+        DB.meta.update_one(
+            {'_id': 'schema'}, {'$addToSet': {'applied': {'$each': sorted(applied)}}},
+            upsert=True
+        )
+
+    return len([m for m in MIGRATIONS if m.__name__ in applied])
+
+
+def exam_appearances(names=None) -> dict:
+    """
+    Number of exams each question appeared in, read from the question_stats
+    collection.
+
+    Arguments:
+    ----------
+    names (list):
+      Question names to count. All questions if None.
+
+    Returns dict of question name: number of exams. Questions that never
+    appeared in an exam are left out.
+
+    ----------------------
+    Dependencies: pymongo
+    """
+    query = {} if names is None else {'question': {'$in': list(names)}}
+
+    return {
+        d['question']: d['appearances'] for d in
+        QUESTION_STATS.find(query, {'_id': 0, 'question': 1, 'appearances': 1})
+    }
+
+
+def index_usage() -> list:
+    """
+    Number of operations that used each index since the MongoDB server was
+    started, as reported by $indexStats. Collections for which the statistics
+    can't be read, e.g. due to missing privileges, are left out.
+
+    Returns list of (collection, index, operations) tuples.
+
+    ----------------------
+    Dependencies: pymongo
+    """
+    usage = []
+    for c in sorted(DB.list_collection_names()):
+        try:
+            for stats in DB[c].aggregate([{'$indexStats': {}}]):
+                usage.append((c, stats['name'], stats['accesses']['ops']))
+        except pymongo.errors.OperationFailure:
+            continue
+
+    return usage
 
 
 ## Global variables
@@ -77,9 +502,22 @@ CLIENT = pymongo.MongoClient(f'{CONNECTION}')
 DB = eval(f'CLIENT.{sys.argv[-1]}')
 QUESTIONS = DB.questions
 EXAMS = DB.exams
+COUNTERS = DB.counters
+# One document {'exam', 'question', 'score'} per question of every exam. The
+# in_exams field of questions mirrors it as {exam: score}.
+EXAM_QUESTIONS = DB.exam_questions
+# Appearances and relative scores per question, see update_question_stats()
+QUESTION_STATS = DB.question_stats
+# This module is imported as both 'config' and 'poodle.config' (GUI),
+# so both have to share one cache
+try:
+    QUESTION_CACHE = sys.modules['config'].QUESTION_CACHE
+except (KeyError, AttributeError):
+    QUESTION_CACHE = QuestionCache(QUESTIONS)
 
 setup_db(DB.name)
-Q_CATEGORIES, SHUFFLE, RANDOM_ARR_SIZE = apply_config()
+(Q_CATEGORIES, SHUFFLE, RANDOM_ARR_SIZE, IMG_CACHE_SIZE,
+ IMG_MAX_DIM, IMG_QUALITY) = apply_config()
 
 # Expected value types for question keys
 KEY_TYPES = {
@@ -116,6 +554,54 @@ KEY_TYPES = {
         'correct_answers': list, 'tolerance': list, 'vars': list
     }
 }
+# Value rules for question keys checked after their types, in this order:
+#   ('options', key, options): value has to be one of options
+#   ('length', key, required, mode): length is fixed or has a minimum ('min')
+#   ('entry_length', key, required, mode): same for every entry of a dict
+#   ('equal_length', key, other): key has as many entries as other
+#   ('item_options', key, index, label, options): value[index] is one of options
+KEY_RULES = {
+    'general': [
+        ('options', 'family_type', ['single', 'parent', 'child'])
+    ],
+    # Moodle types
+    'multichoice': [
+        ('options', 'single', [0, 1]),
+        ('length', 'correct_answers', 1, 'min')
+    ],
+    'numerical': [
+        ('length', 'correct_answers', 1, 'min')
+    ],
+    'shortanswer': [
+        ('options', 'usecase', [0, 1]),
+        ('length', 'correct_answers', 1, 'min')
+    ],
+    'essay': [
+        ('length', 'answer_files', 2, 'fixed')
+    ],
+    'matching': [
+        ('length', 'correct_answers', 2, 'min')
+    ],
+    'gapselect': [
+        ('length', 'correct_answers', 1, 'min'),
+        ('length', 'false_answers', 1, 'min')
+    ],
+    'ddimageortext': [
+        ('length', 'correct_answers', 2, 'min'),
+        ('length', 'drops', 2, 'min'),
+        # Drops always have X and Y value
+        ('entry_length', 'drops', 2, 'fixed'),
+        ('length', 'img_files', 1, 'fixed'),
+        ('equal_length', 'drops', 'correct_answers')
+    ],
+    'calculated': [
+        ('length', 'correct_answers', 1, 'fixed'),
+        ('length', 'tolerance', 3, 'fixed'),
+        ('item_options', 'tolerance', 1, 'tolerance.type',
+         ['relative', 'nominal', 'geometric']),
+        ('length', 'vars', 1, 'min')
+    ]
+}
 # Expected value types for exam keys
 EXAM_TYPES = {
     'name': str, 'points_max': float, 'points_avg': float, 'n_questions': int,
@@ -9,9 +9,20 @@ import subprocess
 import re
 import pyperclip
 from lxml import etree as ET
+from PIL import Image, ImageOps
 import base64
 import numpy as np
 import copy
+import functools
+import hashlib
+import importlib.util
+import shutil
+import threading
+import zipfile
+import urllib.parse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pprint import pprint
 
 
@@ -255,9 +266,8 @@ def inspect_properties(dictionary, mode = 'standard', inspect = True, add = Fals
                         if k == 'name' and Q_CATEGORIES:
                             # Check for correct question naming scheme
                             # and duplicates
-                            collection_names = [q['name'] for q in QUESTIONS.find()]
-                            while (dictionary[k][:-4] not in Q_CATEGORIES or
-                                   dictionary[k] in collection_names):
+                            while (split_name(dictionary[k])['category'] not in Q_CATEGORIES or
+                                   QUESTIONS.count_documents({'name': dictionary[k]}, limit=1)):
                                 dictionary[k] = input('Please input a valid ' +
                                                       'question name: ')
                         print('New value has been set.')
@@ -321,9 +331,8 @@ def inspect_properties(dictionary, mode = 'standard', inspect = True, add = Fals
                     if k == 'name' and Q_CATEGORIES:
                         # Check for correct question naming scheme
                         # and duplicates
-                        collection_names = [q['name'] for q in QUESTIONS.find()]
-                        while (dictionary[k][:-4] not in Q_CATEGORIES or
-                               dictionary[k] in collection_names):
+                        while (split_name(dictionary[k])['category'] not in Q_CATEGORIES or
+                               QUESTIONS.count_documents({'name': dictionary[k]}, limit=1)):
                             dictionary[k] = input('Please input a valid ' +
                                                   'question name: ')
                     print('New value has been set.')
@@ -340,6 +349,661 @@ def inspect_properties(dictionary, mode = 'standard', inspect = True, add = Fals
 
 ## Exam creation
 
+def evict_lru(directory, max_bytes) -> None:
+    """
+    Delete least recently modified files from directory until it is smaller
+    than max_bytes. Used by the on-disk caches.
+
+    ----------------
+    Dependencies: os
+    """
+    if not os.path.isdir(directory):
+        return None
+    entries = []
+    for f in os.scandir(directory):
+        # Concurrent exports may evict the same files
+        try:
+            stat = f.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, f.path))
+    total = sum(e[1] for e in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def pool_context():
+    """
+    Multiprocessing context for worker pools. Forked workers inherit loaded
+    modules and caches of the parent; platforms without fork fall back to
+    their default start method.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _optimize_image(src, dst, max_dim, quality):
+    # Executed in a worker process
+    with Image.open(src) as im:
+        fmt = im.format
+        if fmt not in ('PNG', 'JPEG'):
+            shutil.copyfile(src, dst)
+            return None
+        # Apply EXIF orientation before the metadata is dropped
+        im = ImageOps.exif_transpose(im)
+        resized = max(im.size) > max_dim
+        if resized:
+            im.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        tmp_path = f'{dst}.{os.getpid()}.tmp'
+        if fmt == 'JPEG':
+            if im.mode not in ('RGB', 'L'):
+                im = im.convert('RGB')
+            im.save(tmp_path, 'JPEG', quality=quality, optimize=True,
+                    progressive=True)
+        else:
+            im.save(tmp_path, 'PNG', optimize=True)
+    # Recompression doesn't always pay off for images that weren't resized,
+    # resized ones have to stay within max_dim regardless
+    if not resized and os.path.getsize(tmp_path) >= os.path.getsize(src):
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class ImageOptimizer:
+    """
+    Creates export derivatives of images: downsized to max_dim pixels,
+    recompressed and stripped of metadata. Derivatives are stored in cache_dir
+    keyed by the hash of the source file and the settings, and are created in
+    a pool of worker processes by prefetch(). Formats other than PNG and JPEG
+    are passed through unchanged.
+
+    Arguments:
+    ----------
+    cache_dir (str):
+      Directory for derivatives.
+    max_dim (int):
+      Maximum width and height in pixels. 0 disables optimization.
+    quality (int):
+      JPEG quality.
+    max_bytes (int):
+      Size limit of cache_dir.
+    workers (int):
+      Number of worker processes used by prefetch().
+
+    ------------------------------------------------------------
+    Dependencies: os, shutil, hashlib, PIL, ProcessPoolExecutor
+    """
+
+    def __init__(self, cache_dir, max_dim=0, quality=85, max_bytes=100 * 2**20,
+                 workers=None):
+        self.cache_dir = cache_dir
+        self.max_dim = max_dim
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        return ('optimized', self.max_dim, self.quality)
+
+    def derivative_path(self, path):
+        key = ImageCache.key(path)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = file_digest(path)
+            with self._lock:
+                self._digests[key] = digest
+        ext = os.path.splitext(path)[1]
+        return f'{self.cache_dir}/{digest[:32]}-{self.max_dim}-{self.quality}{ext}'
+
+    def get(self, path):
+        """
+        Return path of the derivative of the image at path, creating it if
+        necessary. Returns path itself if optimization is disabled.
+        """
+        if not self.max_dim:
+            return path
+        dst = self.derivative_path(path)
+        if not os.path.isfile(dst):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            _optimize_image(path, dst, self.max_dim, self.quality)
+        else:
+            os.utime(dst)
+        return dst
+
+    def prefetch(self, paths):
+        """
+        Create all missing derivatives of the given images in parallel.
+        """
+        if not self.max_dim:
+            return None
+        jobs = {}
+        for p in set(paths):
+            if os.path.isfile(p):
+                dst = self.derivative_path(p)
+                if not os.path.isfile(dst):
+                    jobs[dst] = p
+        if not jobs:
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if len(jobs) == 1:
+            for dst, src in jobs.items():
+                try:
+                    _optimize_image(src, dst, self.max_dim, self.quality)
+                except Exception:
+                    pass
+            return None
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=pool_context()) as pool:
+            futures = [
+                pool.submit(_optimize_image, src, dst, self.max_dim, self.quality)
+                for dst, src in jobs.items()
+            ]
+        for f in futures:
+            # Failing images are reported when the question is rendered
+            f.exception()
+
+    def savings(self, paths):
+        """
+        Total size of the given source images and of their derivatives in bytes.
+        """
+        original = optimized = 0
+        for p in set(paths):
+            if not os.path.isfile(p):
+                continue
+            size = os.path.getsize(p)
+            original += size
+            dst = self.derivative_path(p) if self.max_dim else p
+            optimized += os.path.getsize(dst) if os.path.isfile(dst) else size
+        return original, optimized
+
+    def evict(self):
+        evict_lru(self.cache_dir, self.max_bytes)
+
+
+IMAGE_OPTIMIZER = ImageOptimizer(
+    f'{BASE_PATH}/databases/{DB.name}/img/.optimized',
+    max_dim=IMG_MAX_DIM, quality=IMG_QUALITY,
+    max_bytes=(IMG_CACHE_SIZE or 100) * 2**20
+)
+
+
+class ImageCache:
+    """
+    Cache of base64-encoded image files keyed by path, modification time and
+    size, so that changed files are re-encoded automatically. Encodings are
+    held in memory for the duration of an export and optionally persisted on
+    disk, where the least recently used files are evicted once the directory
+    exceeds max_bytes.
+
+    Arguments:
+    ----------
+    cache_dir (str):
+      Directory for persisted encodings. Pass None to disable persistence.
+    max_bytes (int):
+      Size limit of cache_dir.
+    workers (int):
+      Number of threads used by prefetch().
+    optimizer (ImageOptimizer):
+      If given, derivatives created by the optimizer are encoded instead of
+      the original files.
+
+    ----------------------------------------------------------
+    Dependencies: os, base64, hashlib, threading, ThreadPoolExecutor
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=100 * 2**20, workers=8,
+                 optimizer=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.optimizer = optimizer
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._holds = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path):
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def _cache_key(self, path, optimize):
+        key = self.key(path)
+        if optimize and self.optimizer is not None and self.optimizer.max_dim:
+            key += self.optimizer.settings
+        return key
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return f'{self.cache_dir}/{digest}.b64'
+
+    def _encode(self, key):
+        # Persisted encoding
+        if self.cache_dir:
+            disk_path = self._disk_path(key)
+            try:
+                with open(disk_path, 'r') as rf:
+                    b64 = rf.read()
+                os.utime(disk_path)
+                return b64
+            except FileNotFoundError:
+                pass
+        # Keys of optimized images carry the optimizer settings
+        source = self.optimizer.get(key[0]) if len(key) > 3 else key[0]
+        with open(source, 'rb') as rf:
+            b64 = base64.b64encode(rf.read()).decode('utf-8')
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to temporary file first so that readers never see partial files
+            tmp_path = disk_path + f'.{os.getpid()}.{threading.get_ident()}'
+            with open(tmp_path, 'w') as wf:
+                wf.write(b64)
+            os.replace(tmp_path, disk_path)
+        return b64
+
+    def get(self, path, optimize=True):
+        """
+        Return base64 encoding of the file at path. If optimize is False, the
+        original file is encoded even if an optimizer is set.
+        """
+        key = self._cache_key(path, optimize)
+        with self._lock:
+            if key in self._memory:
+                self.hits += 1
+                return self._memory[key]
+            self.misses += 1
+        b64 = self._encode(key)
+        with self._lock:
+            self._memory[key] = b64
+        return b64
+
+    def prefetch(self, paths):
+        """
+        Encode all given files that are not in memory yet in parallel.
+        """
+        keys = {self._cache_key(p, True) for p in set(paths) if os.path.isfile(p)}
+        with self._lock:
+            keys = [k for k in keys if k not in self._memory]
+            self.misses += len(keys)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {key: pool.submit(self._encode, key) for key in keys}
+        for key, f in futures.items():
+            # Failing images stay uncached and are reported when the
+            # question is rendered
+            if f.exception() is None:
+                with self._lock:
+                    self._memory[key] = f.result()
+
+    def evict(self):
+        if self.cache_dir:
+            evict_lru(self.cache_dir, self.max_bytes)
+
+    def retain(self):
+        """
+        Keep in-memory encodings until the matching release(). Exports retain
+        the cache while running, so concurrent or batched exports share it.
+        """
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        """
+        Drop in-memory encodings once no export retains them anymore and
+        enforce the disk limit. Called at the end of each export.
+        """
+        with self._lock:
+            self._holds = max(self._holds - 1, 0)
+            if self._holds == 0:
+                self._memory.clear()
+        self.evict()
+
+
+IMAGE_CACHE = ImageCache(
+    f'{BASE_PATH}/databases/{DB.name}/img/.cache' if IMG_CACHE_SIZE else None,
+    max_bytes=IMG_CACHE_SIZE * 2**20,
+    optimizer=IMAGE_OPTIMIZER
+)
+
+
+def _run_random_vars(path, variables):
+    # Executed in a worker process; the module is never registered in
+    # sys.modules, so every run sees the current file
+    spec = importlib.util.spec_from_file_location('random_vars', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return {v: np.asarray(getattr(module, v)) for v in variables}
+
+
+class RandomVars:
+    """
+    Evaluates random_vars modules of calculated questions in a pool of worker
+    processes and caches the resulting arrays as .npy files. The cache is
+    keyed by the hash of the module source and RANDOM_ARR_SIZE, so unchanged
+    modules are never run twice.
+
+    Arguments:
+    ----------
+    rv_dir (str):
+      Directory containing the rv_<question name>.py modules.
+    timeout (float):
+      Seconds a module may run before its worker is killed.
+    workers (int):
+      Number of worker processes.
+
+    -------------------------------------------------------------
+    Dependencies: config, os, hashlib, importlib, multiprocessing, numpy
+    """
+
+    def __init__(self, rv_dir, timeout=60, workers=2):
+        self.rv_dir = rv_dir
+        self.cache_dir = f'{rv_dir}/.cache'
+        self.timeout = timeout
+        self.workers = workers
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def source(self, name):
+        return f'{self.rv_dir}/rv_{name}.py'
+
+    def key(self, name):
+        h = hashlib.sha256()
+        h.update(f'RANDOM_ARR_SIZE={RANDOM_ARR_SIZE}'.encode('utf-8'))
+        h.update(file_digest(self.source(name)).encode('utf-8'))
+        return f'{name}-{h.hexdigest()[:16]}'
+
+    def _cached(self, key, variables):
+        try:
+            return {v: np.load(f'{self.cache_dir}/{key}/{v}.npy')
+                    for v in variables}
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _store(self, name, key, values):
+        # Drop results of previous versions of the module
+        if os.path.isdir(self.cache_dir):
+            for d in os.listdir(self.cache_dir):
+                if d.startswith(f'{name}-') and d != key:
+                    shutil.rmtree(f'{self.cache_dir}/{d}', ignore_errors=True)
+        os.makedirs(f'{self.cache_dir}/{key}', exist_ok=True)
+        for v, arr in values.items():
+            tmp_path = f'{self.cache_dir}/{key}/.{v}.{os.getpid()}.npy'
+            np.save(tmp_path, arr)
+            os.replace(tmp_path, f'{self.cache_dir}/{key}/{v}.npy')
+
+    def _submit(self, name, variables):
+        with self._lock:
+            # A forked process can't use the pool of its parent
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = pool_context().Pool(self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool, self._pool.apply_async(
+                _run_random_vars, (self.source(name), list(variables))
+            )
+
+    def _result(self, name, key, variables, submitted):
+        pool, task = submitted
+        deadline = time.monotonic() + self.timeout
+        while not task.ready():
+            if pool is not self._pool:
+                # The pool was killed because another module timed out
+                pool, task = self._submit(name, variables)
+                deadline = time.monotonic() + self.timeout
+            elif time.monotonic() >= deadline:
+                # A hanging module blocks its worker for good
+                self.close(pool)
+                raise TimeoutError(
+                    f'{self.source(name)} did not finish within {self.timeout}s'
+                )
+            task.wait(min(0.1, max(deadline - time.monotonic(), 0)))
+        values = task.get()
+        self._store(name, key, values)
+        return values
+
+    def get(self, name, variables) -> dict:
+        """
+        Return the arrays of the given variables of a question's module.
+        Errors raised by the module are re-raised.
+        """
+        key = self.key(name)
+        values = self._cached(key, variables)
+        if values is None:
+            values = self._result(name, key, variables, self._submit(name, variables))
+        return values
+
+    def prefetch(self, items):
+        """
+        Evaluate all uncached modules of items, given as pairs of question
+        name and variables, in parallel. Errors are left for get() to raise.
+        """
+        tasks = []
+        for name, variables in items:
+            try:
+                key = self.key(name)
+            except FileNotFoundError:
+                continue
+            if self._cached(key, variables) is None:
+                tasks.append([name, key, variables, self._submit(name, variables)])
+        for i, (name, key, variables, submitted) in enumerate(tasks):
+            try:
+                self._result(name, key, variables, submitted)
+            except TimeoutError:
+                # Run the modules that were pending on the killed pool again
+                # at once instead of one by one
+                for t in tasks[i + 1:]:
+                    pool, task = t[3]
+                    if pool is not self._pool and not task.ready():
+                        t[3] = self._submit(t[0], t[2])
+            except Exception:
+                pass
+
+    def close(self, pool=None):
+        """
+        Terminate the worker pool, or only the given pool if it is still the
+        current one.
+        """
+        with self._lock:
+            if pool is not None and pool is not self._pool:
+                return
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.terminate()
+            self._pool = None
+
+
+RANDOM_VARS = RandomVars(f'{BASE_PATH}/databases/{DB.name}/random_vars')
+
+
+# Fields that are never needed to render questions
+EXPORT_PROJECTION = {
+    '_id': 0, 'in_exams': 0, 'history': 0, **{f: 0 for f in NAME_FIELDS}
+}
+
+
+def fetch_questions(names, projection=EXPORT_PROJECTION) -> dict:
+    """
+    Fetch all questions in names with a single query.
+
+    Arguments:
+    ----------
+    names (list):
+      Names of the questions to fetch.
+    projection (dict):
+      MongoDB projection applied to the documents.
+
+    Returns dict of name: document for every question found in the database.
+
+    --------------------
+    Dependencies: config
+    """
+
+    return {
+        q['name']: q for q in
+        QUESTIONS.find({'name': {'$in': list(names)}}, projection)
+    }
+
+
+def overview_matrix() -> tuple:
+    """
+    Data of the question overview: difficulty, estimated time and the score
+    relative to points of every question in every exam. Parent questions are
+    left out. The database only returns the needed fields of each question
+    with its in_exams entries as array; the matrix is assembled with numpy.
+
+    Returns tuple of question names, difficulties, estimated times (sorted by
+    name), sorted exam names and an object array of shape (questions, exams)
+    containing the rounded relative score or '.' if the question wasn't part
+    of the exam.
+
+    ---------------------------
+    Dependencies: config, numpy
+    """
+
+    exam_list = sorted(e['name'] for e in EXAMS.find({}, {'_id': 0, 'name': 1}))
+    docs = list(QUESTIONS.aggregate([
+        {'$match': {'child_no': {'$ne': 0}}},
+        {'$project': {
+            '_id': 0, 'name': 1, 'difficulty': 1, 'time_est': 1, 'points': 1,
+            'in_exams': {'$objectToArray': {'$ifNull': ['$in_exams', {}]}}
+        }},
+        {'$sort': {'name': 1}}
+    ]))
+
+    # Scatter the returned cells into the matrix
+    exam_index = {e: j for j, e in enumerate(exam_list)}
+    rows, cols, scores = [], [], []
+    for i, d in enumerate(docs):
+        for cell in d['in_exams']:
+            if cell['k'] in exam_index:
+                rows.append(i)
+                cols.append(exam_index[cell['k']])
+                scores.append(cell['v'])
+    values = np.full((len(docs), len(exam_list)), np.nan)
+    values[rows, cols] = scores
+    points = np.array([d.get('points', np.nan) for d in docs], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.round(values / points[:, None], 2)
+    cells = np.full(values.shape, '.', dtype=object)
+    cells[rows, cols] = values[rows, cols].tolist()
+
+    return (
+        [d['name'] for d in docs], [d.get('difficulty') for d in docs],
+        [d.get('time_est') for d in docs], exam_list, cells
+    )
+
+
+# Any [[...]] token; nested openings are excluded so '[[a [[tbl1]]' still
+# resolves the table
+PLACEHOLDER = re.compile(r'\[\[((?:(?!\[\[).)+?)\]\]', re.S)
+TABLE_KEY = re.compile(r'^tbl\d+$')
+FILE_KEY = re.compile(r'^file(\d+)$')
+FILE_FORMAT = re.compile(r'(?<=\.)\D+$')
+
+
+@functools.lru_cache(maxsize=256)
+def table_html(rows) -> str:
+    """
+    Render a table given as tuple of row tuples (first row is the head) to
+    HTML. Results are cached since the same tables recur across exports.
+    """
+    root = ET.Element('table')
+    # Table head
+    thead = ET.SubElement(root, 'thead')
+    tr = ET.SubElement(thead, 'tr')
+    for i in rows[0]:
+        th = ET.SubElement(
+            tr, 'th',
+            attrib={
+                'scope': 'col',
+                'style': 'border-width: 1px; border-style: solid;'
+            }
+        )
+        th.text = i
+    # Table body
+    tbody = ET.SubElement(root, 'tbody')
+    for i in rows[1:]:
+        tr = ET.SubElement(tbody, 'tr')
+        for j in i:
+            td = ET.SubElement(
+                tr, 'td',
+                attrib={
+                    'style': 'border-width: 1px; border-style: solid;'
+                }
+            )
+            td.text = j
+
+    return ET.tostring(root, pretty_print=True).decode('utf-8')
+
+
+def image_html(path) -> str:
+    file_format = re.search(FILE_FORMAT, path).group()
+    b64 = IMAGE_CACHE.get(path)
+
+    return f'<img src="data:image/{file_format};base64,{b64}" alt="" />'
+
+
+def resolve_placeholders(q, text, tables=True, images=True, gaps=None,
+                         attachments=None) -> str:
+    """
+    Resolve all placeholders within text in a single pass.
+
+    Arguments:
+    ----------
+    q (dict):
+      Question document providing 'tables' and 'img_files'.
+    text (str):
+      Question or answer text.
+    tables (bool):
+      Replace [[tblN]] with the HTML of table tblN. Placeholders within table
+      cells are resolved as well.
+    images (bool):
+      Replace [[fileN]] with the N-th image of 'img_files' as base64 <img>.
+    gaps (dict):
+      Maps gap contents to gap indices, i.e. [[answer]] becomes [[index]].
+      Table and file placeholders take precedence.
+    attachments (list):
+      If given, images are referenced as @@PLUGINFILE@@ files instead of
+      being inlined, and their file names are appended to this list once.
+
+    Unknown placeholders are left untouched.
+
+    -------------------------------------------
+    Dependencies: config, re, lxml
+    """
+    def resolve(m):
+        key = m.group(1)
+        if tables and TABLE_KEY.match(key):
+            rows = tuple(tuple(str(c) for c in r) for r in q['tables'][key])
+            return resolve_placeholders(q, table_html(rows), False, images, gaps,
+                                        attachments)
+        file_match = FILE_KEY.match(key) if images else None
+        if file_match:
+            current_file = q['img_files'][int(file_match.group(1)) - 1]
+            if attachments is not None:
+                if current_file not in attachments:
+                    attachments.append(current_file)
+                src = urllib.parse.quote(current_file)
+                return f'<img src="@@PLUGINFILE@@/{src}" alt="" />'
+            return image_html(f'{BASE_PATH}/databases/{DB.name}/img/' + current_file)
+        if gaps and key in gaps:
+            return f'[[{gaps[key]}]]'
+        return m.group()
+
+    return PLACEHOLDER.sub(resolve, text)
+
+
 class MoodleQuestion(ET.ElementBase):
 
     def _init(self):
@@ -360,57 +1024,37 @@ class MoodleQuestion(ET.ElementBase):
         self.idnumber.text = ''
 
     @staticmethod
-    def make_tables(q, el):
-        for m in re.finditer(r'(?<=\[\[)tbl\d+(?=\]\])', el.text):
-            tbl = q['tables'][m.group()]
-
-            root = ET.Element('table')
-            # Table head
-            thead = ET.SubElement(root, 'thead')
-            tr = ET.SubElement(thead, 'tr')
-            for i in tbl[0]:
-                th = ET.SubElement(
-                    tr, 'th',
-                    attrib={
-                        'scope': 'col',
-                        'style': 'border-width: 1px; border-style: solid;'
-                    }
-                )
-                th.text = str(i)
-            # Table body
-            tbody = ET.SubElement(root, 'tbody')
-            for i in tbl[1:]:
-                tr = ET.SubElement(tbody, 'tr')
-                for j in i:
-                    td = ET.SubElement(
-                        tr, 'td',
-                        attrib={
-                            'style': 'border-width: 1px; border-style: solid;'
-                        }
-                    )
-                    td.text = str(j)
-
-            # Replace in question text
-            repl = ET.tostring(root, pretty_print=True).decode('utf-8')
-            el.text = ET.CDATA(re.sub(r'\[\[%s\]\]' % (m.group()), repl, el.text))
+    def fill_text(q, el, text, tables=False, gaps=None):
+        """
+        Set text with resolved placeholders as CDATA of el. If the question is
+        exported with attached images ('_attach_images' set by create_xml()),
+        each referenced image is added once as <file> after el.
+        """
+        attachments = [] if q.get('_attach_images') else None
+        el.text = ET.CDATA(resolve_placeholders(
+            q, text, tables=tables, gaps=gaps, attachments=attachments
+        ))
+        for i, f in enumerate(attachments or []):
+            file_el = ET.Element('file', attrib={
+                'name': os.path.basename(f),
+                'path': f'/{os.path.dirname(f)}/'.replace('//', '/'),
+                'encoding': 'base64'
+            })
+            file_el.text = IMAGE_CACHE.get(f'{BASE_PATH}/databases/{DB.name}/img/' + f)
+            el.getparent().insert(el.getparent().index(el) + 1 + i, file_el)
 
     @staticmethod
     def encode_images(q, el):
-        for m in re.finditer(r'(?<=\[\[file)\d+(?=\]\])', el.text):
-            file_index = int(m.group()) - 1
-            current_file = q['img_files'][file_index]
-            file_format = re.search(r'(?<=\.)\D+$', current_file)
-            file_format = file_format.group()
-            with open(f'{BASE_PATH}/databases/{DB.name}/img/' + current_file, 'rb') as rf:
-                b64 = base64.b64encode(rf.read()).decode('utf-8')
-            repl = f'<img src="data:image/{file_format};base64,{b64}" alt="" />'
-            el.text = ET.CDATA(re.sub(r'\[\[file%s\]\]' % (m.group()), repl, el.text))
+        MoodleQuestion.fill_text(q, el, el.text)
+
+    @staticmethod
+    def gap_indices(q):
+        return None
 
     def set_defaults(self, q):
         self.name_text.text = q['name']
-        self.qt_text.text = ET.CDATA(q['question'])
-        self.__class__.make_tables(q, self.qt_text)
-        self.__class__.encode_images(q, self.qt_text)
+        self.__class__.fill_text(q, self.qt_text, q['question'], tables=True,
+                                 gaps=self.__class__.gap_indices(q))
         self.dg.text = str(q['points'])
         self.loc = self.find('idnumber')
 
@@ -626,10 +1270,12 @@ class MatchingQuestion(MoodleQuestion):
 class GapselectQuestion(MoodleQuestion):
 
     @staticmethod
-    def insert_indices(q, el):
+    def gap_indices(q):
+        # Map correct answers to their gap index; first gap wins on duplicates
+        indices = {}
         for k, v in q['correct_answers'].items():
-            pattern = r'(?<=\[\[){value}(?=\]\])'.format(value=re.escape(str(v[0])))
-            el.text = re.sub(pattern, str(k), el.text)
+            indices.setdefault(str(v[0]), str(k))
+        return indices
 
     def set_option(self, a, g):
         self.loc.addnext(ET.SubElement(self, 'selectoption'))
@@ -649,9 +1295,6 @@ class GapselectQuestion(MoodleQuestion):
         self.loc.addnext(ET.SubElement(self, 'shownumcorrect'))
         self.loc = self.loc.getnext()
 
-        # Modify question text indices
-        self.__class__.insert_indices(q, self.qt_text)
-
         # Add options
         for k, v in q['correct_answers'].items():
             self.set_option(str(v[0]), str(k))
@@ -676,9 +1319,11 @@ class DdimageortextQuestion(MoodleQuestion):
         self.loc.addnext(ET.SubElement(self, 'file', attrib={'name': q['img_files'][0], 'encoding': 'base64'}))
         self.loc = self.loc.getnext()
 
-        with open(f'{BASE_PATH}/databases/{DB.name}/img/' + q['img_files'][0], 'rb') as rf:
-            b64 = base64.b64encode(rf.read())
-        self.loc.text = b64.decode('utf-8')
+        # Drop zone coordinates refer to the original background image
+        self.loc.text = IMAGE_CACHE.get(
+            f'{BASE_PATH}/databases/{DB.name}/img/' + q['img_files'][0],
+            optimize=False
+        )
 
         for a in q['correct_answers']:
             self.loc.addnext(ET.SubElement(self, 'drag'))
@@ -709,23 +1354,50 @@ class CalculatedQuestion(MoodleQuestion):
 
     @staticmethod
     def count_decimals(arr):
-        pattern = r'(?<=\.)[0-9e+-]*'
-        
-        def get_len(n):
-            if np.int0(n) == n:
-                return 0
-            elif not re.search(r'e', str(n)):
-                return len(re.search(pattern, str(n)).group())
-            elif re.search(r'e\+', str(n)):
-                return 0
-            elif re.search(r'e\-', str(n)):
-                return int(re.search(r'(?<=e\-)[0-9]+', str(n)).group()) - 1
-            else:
-                raise ValueError
-        get_lens = np.vectorize(get_len)
-    
-        lens = get_lens(arr)
-        return np.max(lens)
+        """
+        Maximum number of decimals of the values in arr, computed on the
+        string representations of all non-integral values at once. For values
+        in scientific notation 'xe-n' counts as n - 1 decimals.
+        """
+        arr = np.asarray(arr)
+        if arr.dtype.kind in 'biu':
+            return 0
+        arr = arr[np.trunc(arr) != arr]
+        if arr.size == 0:
+            return 0
+        strs = arr.astype(str)
+        exp_pos = np.char.find(strs, 'e')
+        # Plain notation: digits after the decimal point
+        plain = strs[exp_pos < 0]
+        lens = np.char.str_len(plain) - np.char.find(plain, '.') - 1
+        # Scientific notation: only negative exponents add decimals
+        sci = strs[exp_pos >= 0]
+        if sci.size:
+            exps = np.char.partition(sci, 'e')[:, 2].astype(int)
+            lens = np.concatenate([lens, np.maximum(-exps - 1, 0)])
+
+        return int(np.max(lens))
+
+    @staticmethod
+    def dataset_items(values, decimals):
+        """
+        Build the dataset_items element of a var. All values are formatted in
+        one vectorized pass and parsed as a whole instead of creating every
+        dataset_item element separately.
+        """
+        if decimals == 0:
+            strs = np.asarray(values).astype(np.int64).astype(str)
+        elif isinstance(values, np.ndarray):
+            strs = values.astype(str)
+        else:
+            # Plain lists may mix ints and floats, keep their own formatting
+            strs = np.array([str(i) for i in values])
+        items = ''.join([
+            f'<dataset_item><number>{n}</number><value>{i}</value></dataset_item>'
+            for n, i in enumerate(strs.tolist(), 1)
+        ])
+
+        return ET.fromstring(f'<dataset_items>{items}</dataset_items>')
 
     def set_additional(self, q):
         self.loc.addnext(ET.SubElement(self, 'synchronize'))
@@ -792,15 +1464,15 @@ class CalculatedQuestion(MoodleQuestion):
         self.loc = self.loc.getnext()
         
         # Create all vars
-        code = f'from databases.{DB.name}.random_vars.rv_{q["name"]} import *'
-        rvn = {}
-        exec(code, rvn)
+        rvn = RANDOM_VARS.get(q['name'], q['vars'])
+        # Set by create_xml() in shared_datasets mode
+        shared = q.get('_shared_datasets', {})
         for v in q['vars']:
             datadef = ET.SubElement(self.loc, 'dataset_definition')
 
             child = ET.SubElement(datadef, 'status')
             subchild = ET.SubElement(child, 'text')
-            subchild.text = 'private'
+            subchild.text = 'shared' if v in shared else 'private'
 
             child = ET.SubElement(datadef, 'name')
             subchild = ET.SubElement(child, 'text')
@@ -829,23 +1501,477 @@ class CalculatedQuestion(MoodleQuestion):
             child = ET.SubElement(datadef, 'itemcount')
             child.text = str(len(rvn[v]))
 
-            d_items = ET.SubElement(datadef, 'dataset_items')
-
-            for i, n in zip(rvn[v], range(len(rvn[v]))):
-                child = ET.SubElement(d_items, 'dataset_item')
-                subchild = ET.SubElement(child, 'number')
-                subchild.text = str(n+1)
-                subchild = ET.SubElement(child, 'value')
-                if decimals == 0:
-                    subchild.text = str(np.int0(i))
-                else:
-                    subchild.text = str(i)
+            # Items of shared datasets are only imported once
+            if shared.get(v, True):
+                datadef.append(self.__class__.dataset_items(rvn[v], decimals))
+            else:
+                ET.SubElement(datadef, 'dataset_items')
 
             child = ET.SubElement(datadef, 'number_of_items')
             child.text = str(len(rvn[v]))
 
 
-def create_xml(exam, filename='import.xml', mode='terminal', questions=None):
+def plan_shared_datasets(q_dicts) -> dict:
+    """
+    Find vars of calculated questions which have the same name and identical
+    values in more than one question. Moodle identifies shared datasets of a
+    category by name, so vars with equal values but different names can't be
+    shared, and a name used by several such groups with different values
+    stays private in all of them.
+
+    Returns a dictionary mapping question names to dictionaries of their
+    shared vars, where only the first question using a dataset gets True
+    (i.e. emits the dataset items).
+
+    -------------------------------------------
+    Dependencies: config, hashlib, numpy
+    """
+    users = {}
+    for q in q_dicts:
+        if q.get('moodle_type') != 'calculated':
+            continue
+        try:
+            rvn = RANDOM_VARS.get(q['name'], q['vars'])
+        except Exception:
+            # Reported when the question is rendered
+            continue
+        for v in q['vars']:
+            arr = np.asarray(rvn[v])
+            h = hashlib.sha256(f'{arr.dtype.str}{arr.shape}'.encode('utf-8'))
+            h.update(np.ascontiguousarray(arr).tobytes())
+            users.setdefault((v, h.hexdigest()), []).append(q['name'])
+
+    groups = {}
+    for (v, _), names in users.items():
+        if len(names) > 1:
+            groups.setdefault(v, []).append(names)
+
+    plan = {}
+    for v, v_groups in groups.items():
+        if len(v_groups) > 1:
+            continue
+        for i, name in enumerate(v_groups[0]):
+            plan.setdefault(name, {})[v] = (i == 0)
+
+    return plan
+
+
+def prepare_snapshot(snapshot, questionlist, shared_datasets=False,
+                     images='inline', message=False) -> dict:
+    """
+    Add the export options of an exam to its question documents. The options
+    change the rendered XML, so they have to be part of the documents passed
+    to render_key() and render_fragment(). Used by create_xml() and by
+    create_exams() to prerender exactly the fragments the exports need.
+
+    Arguments:
+    ----------
+    snapshot (dict):
+      Question documents by name. Left unchanged.
+    questionlist (list):
+      Names of the exam's questions.
+    shared_datasets, images:
+      See 'create_xml()'.
+    message (bool):
+      If set to True, the number of shared datasets is printed.
+
+    Returns dict of name: document for every question in questionlist.
+
+    --------------------
+    Dependencies: config
+    """
+    snapshot = {q: snapshot[q] for q in questionlist}
+    if shared_datasets:
+        calculated = [
+            q for q in questionlist
+            if snapshot[q].get('moodle_type') == 'calculated' and 'vars' in snapshot[q]
+        ]
+        # Values of all calculated questions are needed to compare datasets
+        RANDOM_VARS.prefetch([(q, snapshot[q]['vars']) for q in calculated])
+        plan = plan_shared_datasets([snapshot[q] for q in calculated])
+        for q, shared in plan.items():
+            snapshot[q] = dict(snapshot[q], _shared_datasets=shared)
+        if plan and message:
+            n_vars = sum(len(s) for s in plan.values())
+            print(f'Shared datasets: {n_vars} var(s) of {len(plan)} '
+                  'question(s) are shared.')
+    if images == 'attach':
+        for q in questionlist:
+            snapshot[q] = dict(snapshot[q], _attach_images=True)
+
+    return snapshot
+
+
+def claim_shared_datasets(snapshot, questionlist) -> list:
+    """
+    Let the first question of questionlist using a shared dataset write its
+    items, e.g. when a delta export leaves out the first user planned by
+    plan_shared_datasets(). Updates snapshot in place.
+
+    Returns the names of the questions whose documents changed.
+
+    --------------------
+    Dependencies: config
+    """
+    changed = []
+    claimed = set()
+    for q in questionlist:
+        shared = snapshot[q].get('_shared_datasets')
+        if not shared:
+            continue
+        new = {v: v not in claimed for v in shared}
+        claimed.update(shared)
+        if new != shared:
+            snapshot[q] = dict(snapshot[q], _shared_datasets=new)
+            changed.append(q)
+
+    return changed
+
+
+def make_question(q_dict):
+    """
+    Build the MoodleQuestion element matching the question's moodle_type.
+    """
+    q_el = eval((
+        f'{q_dict["moodle_type"].capitalize()}'
+        f'Question(attrib={{"type": "{q_dict["moodle_type"]}"}})'
+                ))
+    q_el.set_defaults(q_dict)
+    q_el.set_additional(q_dict)
+
+    return q_el
+
+
+def file_digest(path) -> str:
+    """
+    Dependencies: hashlib
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as rf:
+        for chunk in iter(lambda: rf.read(2**16), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+# Bump whenever the rendered XML of unchanged questions changes, so that
+# cached fragments and delta manifests of earlier versions are not reused
+RENDER_VERSION = 1
+
+
+def render_key(q_dict) -> str:
+    """
+    Hash of everything a question's rendered XML depends on: RENDER_VERSION,
+    the document itself, SHUFFLE, referenced image files and, for calculated
+    questions, the random_vars file.
+
+    ------------------------------------
+    Dependencies: config, json, hashlib, os
+    """
+    h = hashlib.sha256()
+    h.update(f'RENDER_VERSION={RENDER_VERSION}'.encode('utf-8'))
+    h.update(json.dumps(q_dict, sort_keys=True, default=str).encode('utf-8'))
+    h.update(f'SHUFFLE={SHUFFLE}'.encode('utf-8'))
+    h.update(repr(IMAGE_OPTIMIZER.settings if IMAGE_OPTIMIZER.max_dim else None)
+             .encode('utf-8'))
+    img_files = q_dict.get('img_files', [])
+    for f in img_files if type(img_files) == list else []:
+        try:
+            key = ImageCache.key(f'{BASE_PATH}/databases/{DB.name}/img/{f}')
+        except (FileNotFoundError, TypeError):
+            key = (f, None)
+        h.update(repr(key).encode('utf-8'))
+    if q_dict.get('moodle_type') == 'calculated':
+        h.update(f'RANDOM_ARR_SIZE={RANDOM_ARR_SIZE}'.encode('utf-8'))
+        try:
+            h.update(file_digest(
+                f'{BASE_PATH}/databases/{DB.name}/random_vars/rv_{q_dict["name"]}.py'
+            ).encode('utf-8'))
+        except FileNotFoundError:
+            pass
+
+    return h.hexdigest()
+
+
+def render_fragment(q_dict) -> bytes:
+    """
+    Serialized <question> element of a question.
+    """
+    return ET.tostring(make_question(q_dict), pretty_print=True, encoding='utf-8')
+
+
+class FragmentCache:
+    """
+    On-disk cache of serialized question fragments keyed by render_key().
+    Allows re-exports to only render questions that changed since the last
+    export. Least recently used fragments are evicted once the directory
+    exceeds max_bytes. Fragments live on disk so that streaming exports keep
+    their flat memory profile.
+
+    Arguments:
+    ----------
+    cache_dir (str):
+      Directory the fragments are stored in.
+    max_bytes (int):
+      Size limit of cache_dir.
+
+    ------------------------
+    Dependencies: os, threading
+    """
+
+    def __init__(self, cache_dir, max_bytes=500 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return f'{self.cache_dir}/{key}.xml'
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as rf:
+                fragment = rf.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return fragment
+
+    def put(self, key, fragment):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to temporary file first so that readers never see partial files
+        tmp_path = self._path(key) + f'.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'wb') as wf:
+            wf.write(fragment)
+        os.replace(tmp_path, self._path(key))
+
+    def evict(self):
+        evict_lru(self.cache_dir, self.max_bytes)
+
+    def clear(self):
+        evict_lru(self.cache_dir, 0)
+
+
+FRAGMENT_CACHE = FragmentCache(f'{BASE_PATH}/databases/{DB.name}/exams/.cache')
+
+
+def _render_worker(q_dict):
+    # Errors are reported by the parent so that messages keep question order
+    try:
+        return render_fragment(q_dict)
+    except:
+        return None
+
+
+def render_parallel(q_dicts, workers):
+    """
+    Render question documents in a process pool and yield their fragments in
+    input order (None for questions with errors). At most a few questions per
+    worker are in flight, so consuming the generator lazily keeps memory flat.
+    """
+    q_dicts = iter(q_dicts)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+        in_flight = deque()
+        for q_dict in q_dicts:
+            in_flight.append(pool.submit(_render_worker, q_dict))
+            if len(in_flight) >= workers * 4:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def prerender(q_dicts, workers=None) -> dict:
+    """
+    Render all question documents of q_dicts that have no cached fragment
+    into FRAGMENT_CACHE, e.g. the union of several exams before writing them.
+    Questions with errors are skipped; create_xml() reports them.
+
+    Returns the numbers of reused and rendered fragments.
+
+    -------------------------------------------
+    Dependencies: config, os
+    """
+    keys = [render_key(q) for q in q_dicts]
+    pending = [(k, q) for k, q in zip(keys, q_dicts) if k not in FRAGMENT_CACHE]
+    IMAGE_CACHE.retain()
+    try:
+        img_paths = [
+            f'{BASE_PATH}/databases/{DB.name}/img/' + f
+            for k, q in pending for f in (q.get('img_files') or [])
+            if q.get('moodle_type') != 'ddimageortext'
+        ]
+        IMAGE_OPTIMIZER.prefetch(img_paths)
+        IMAGE_CACHE.prefetch(img_paths)
+        RANDOM_VARS.prefetch([
+            (q['name'], q['vars']) for k, q in pending
+            if q.get('moodle_type') == 'calculated' and 'vars' in q
+        ])
+        if workers and workers > 1 and len(pending) > 1:
+            fragments = render_parallel((q for k, q in pending), workers)
+        else:
+            fragments = (_render_worker(q) for k, q in pending)
+        rendered = 0
+        for (k, q), fragment in zip(pending, fragments):
+            if fragment is not None:
+                FRAGMENT_CACHE.put(k, fragment)
+                rendered += 1
+    finally:
+        IMAGE_CACHE.release()
+
+    return {'reused': len(keys) - len(pending), 'rendered': rendered}
+
+
+def category_fragment(exam) -> bytes:
+    return (
+        '<!-- question: 0  -->\n'
+        '  <question type="category">\n'
+        '    <category>\n'
+        f'      <text>$course$/top/{exam}</text>\n'
+        '    </category>\n'
+        '    <info format="moodle_auto_format">\n'
+        '      <text></text>\n'
+        '    </info>\n'
+        '    <idnumber></idnumber>\n'
+        '  </question>\n\n'
+    ).encode('utf-8')
+
+
+QUIZ_FOOTER = b'</quiz>\n'
+
+
+def quiz_header(exam, info) -> bytes:
+    """
+    XML declaration, exam info comment, opening <quiz> and category question.
+    """
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<!-- Estimated time: {info[0]}, '
+        f'average difficulty: {info[1]}, '
+        f'maximum possible points: {info[2]} -->\n'
+        '<quiz>\n\n'
+    ).encode('utf-8') + category_fragment(exam)
+
+
+def write_quiz(wf, exam, info, fragments) -> None:
+    """
+    Write a complete import file from serialized question fragments to the
+    binary file object wf. Fragments are written as they are consumed, so
+    passing a generator keeps only one question in memory at a time.
+    """
+    wf.write(quiz_header(exam, info))
+    for fragment in fragments:
+        wf.write(fragment)
+    wf.write(QUIZ_FOOTER)
+
+
+def write_parts(directory, stem, exam, info, fragments, max_bytes) -> list:
+    """
+    Write (question name, fragment) pairs to import files <stem>-1.xml,
+    <stem>-2.xml, ... in directory, each a complete import file into the exam
+    category of at most max_bytes. Sizes are taken from the serialized
+    fragments, so nothing is parsed again. A question larger than the budget
+    on its own gets a part of its own.
+
+    Returns a list with file name, size and question names of each part.
+
+    -------------------
+    Dependencies: os
+    """
+    header = quiz_header(exam, info)
+    parts = []
+    wf = None
+
+    def close_part():
+        wf.write(QUIZ_FOOTER)
+        wf.close()
+        parts[-1]['bytes'] += len(QUIZ_FOOTER)
+
+    try:
+        for q, fragment in fragments:
+            if (wf is not None and parts[-1]['questions'] and
+                    parts[-1]['bytes'] + len(fragment) + len(QUIZ_FOOTER) > max_bytes):
+                close_part()
+                wf = None
+            if wf is None:
+                name = f'{stem}-{len(parts) + 1}.xml'
+                wf = open(os.path.join(directory, name), 'wb')
+                wf.write(header)
+                parts.append({'file': name, 'bytes': len(header), 'questions': []})
+            if len(header) + len(fragment) + len(QUIZ_FOOTER) > max_bytes:
+                print(f'Question {q} alone exceeds the maximum file size!')
+            wf.write(fragment)
+            parts[-1]['bytes'] += len(fragment)
+            parts[-1]['questions'].append(q)
+        if wf is None:
+            # Exam without questions
+            wf = open(os.path.join(directory, f'{stem}-1.xml'), 'wb')
+            wf.write(header)
+            parts.append({'file': f'{stem}-1.xml', 'bytes': len(header),
+                          'questions': []})
+        close_part()
+    finally:
+        if wf is not None and not wf.closed:
+            wf.close()
+
+    return parts
+
+
+def create_xml(exam, filename='import.xml', mode='terminal', questions=None,
+               stream=False, workers=None, shared_datasets=False,
+               images='inline', bundle=False, max_bytes=None, delta=False,
+               q_dicts=None, message=True):
+    """
+    Write the Moodle import file of an exam. Used by create_exam() and
+    create_testexam().
+
+    Arguments:
+    ----------
+    stream (bool):
+      If set to True, each question is written and released as soon as it is
+      serialized instead of serializing all questions before writing. Keeps
+      peak memory flat for large, image-heavy exams.
+    workers (int):
+      If set to a number greater than 1, questions are rendered in a pool of
+      that many processes. Output is identical to sequential rendering.
+    shared_datasets (bool):
+      If set to True, vars of calculated questions with the same name and
+      identical values are exported as shared datasets of the exam category
+      whose items are only written once, by the first question written.
+    images (str):
+      'inline' embeds images as base64 data URIs wherever they are referenced.
+      'attach' writes each image once per text as Moodle <file> attachment
+      referenced via @@PLUGINFILE@@.
+    bundle (bool):
+      If set to True, additionally writes a zip file containing the import
+      file and all images of the exam.
+    max_bytes (int):
+      If given, questions are split into import files <name>-1.xml,
+      <name>-2.xml, ... of at most max_bytes each (e.g. the upload limit of
+      Moodle). A manifest <name>-manifest.json lists the questions per file.
+    delta (bool):
+      If set to True, only questions that changed since the last export of
+      the exam are written. Every export records its files and the content
+      hashes of its questions in .delta.json within the exam directory.
+    q_dicts (dict):
+      Question documents by name which were fetched before, e.g. by
+      create_exams(). Questions are only read from the database otherwise.
+    message (bool):
+      If set to False, only errors are printed.
+
+    Questions are rendered to serialized fragments which are cached by
+    render_key(), so re-exports only render questions that changed.
+
+    -------------------------------------------
+    Dependencies: config, os, re, lxml, numpy
+    """
     # Create directory
     try:
         os.mkdir(f'{BASE_PATH}/databases/{DB.name}/exams/{exam}')
@@ -855,37 +1981,25 @@ def create_xml(exam, filename='import.xml', mode='terminal', questions=None):
     if filename[-4:] != '.xml':
         filename += '.xml'
     # Don't overwrite existing files
+    def taken(name):
+        # Split exports write parts instead of the file itself
+        if max_bytes:
+            name = name[:-4] + '-1.xml'
+        return name in os.listdir(f'{BASE_PATH}/databases/{DB.name}/exams/{exam}')
     version = 0
     pattern = re.compile(r'^.+?(?=[-0-9]*\.xml)')
-    while filename in os.listdir(f'{BASE_PATH}/databases/{DB.name}/exams/{exam}'):
+    while taken(filename):
         version += 1
         m = re.match(pattern, filename)
         filename = m.group() + f'-{version}.xml'
 
-    # Create XML base document
-    xml_string = (
-        '<?xml version="1.0"?>\n'
-        '<quiz>\n\n'
-        '<!-- question: 0  -->\n'
-        '  <question type="category">\n'
-        '    <category>\n'
-        f'      <text>$course$/top/{exam}</text>\n'
-        '    </category>\n'
-        '    <info format="moodle_auto_format">\n'
-        '      <text></text>\n'
-        '    </info>\n'
-        '    <idnumber></idnumber>\n'
-        '  </question>\n\n'
-        '</quiz>'
-    )
-    root = ET.XML(xml_string)
-
-    def gather_info(ql):
-        time_est_total = sum([QUESTIONS.find_one({'name': q})['time_est']
-                    for q in ql])
+    def gather_info(ql, q_dicts=None):
+        if q_dicts is None:
+            q_dicts = QUESTION_CACHE.get_many(ql)
+        time_est_total = sum([q_dicts[q]['time_est'] for q in ql])
         difficulty_avg = np.round(np.mean(
-            [QUESTIONS.find_one({'name': q})['difficulty'] for q in ql]), 2)
-        max_points = sum([QUESTIONS.find_one({'name': q})['points'] for q in ql])
+            [q_dicts[q]['difficulty'] for q in ql]), 2)
+        max_points = sum([q_dicts[q]['points'] for q in ql])
 
         return (time_est_total, difficulty_avg, max_points)
 
@@ -923,11 +2037,16 @@ def create_xml(exam, filename='import.xml', mode='terminal', questions=None):
                 questionlist = rf.read().split()
         else:
             questionlist = questions
+        # Everything after this point works on this single snapshot
+        if q_dicts is None:
+            snapshot.update(fetch_questions(questionlist))
+        else:
+            snapshot.update({q: q_dicts[q] for q in questionlist if q in q_dicts})
 
         # Clean question list
         questionlist_copy = copy.copy(questionlist)
         for q in questionlist_copy:
-            if QUESTIONS.find_one({'name': q}) == None:
+            if q not in snapshot:
                 questionlist.remove(q)
                 print(
                     (f'Question {q} not in database! '
@@ -935,17 +2054,11 @@ def create_xml(exam, filename='import.xml', mode='terminal', questions=None):
                 )
 
         # Get exam info
-        info = gather_info(questionlist)
+        info = gather_info(questionlist, snapshot)
 
         return questionlist, info
 
     def questionlist_manual():
-        # Category patterns for separated output
-        if Q_CATEGORIES:
-            cat_patterns = []
-            for c in Q_CATEGORIES:
-                cat_patterns.append(re.compile(r'%s\d+' % (c)))
-
         # Create question list
         questionlist = []
         info = ()
@@ -960,16 +2073,17 @@ def create_xml(exam, filename='import.xml', mode='terminal', questions=None):
                 print(f'Question {q_choice} already in question list!')
             elif q_choice.lower() == 'delete' or q_choice.lower() == 'del':
                 questionlist_delete(questionlist)
-            elif (QUESTIONS.find_one({'name': q_choice}) == None and
+            elif (QUESTION_CACHE.get(q_choice) == None and
                   q_choice.lower() != 'done' and q_choice.lower() != 'd'):
                 print(f'Question {q_choice} not in database!')
-            elif QUESTIONS.find_one({'name': q_choice}) != None:
+            elif QUESTION_CACHE.get(q_choice) != None:
                 questionlist.append(q_choice)
 
                 # Question list status
                 if Q_CATEGORIES:
-                    for r in cat_patterns:
-                        print(list(filter(r.match, questionlist)))
+                    for c in Q_CATEGORIES:
+                        print([q for q in questionlist
+                               if split_name(q)['category'] == c])
                 else:
                     pprint(questionlist)
 
@@ -981,6 +2095,7 @@ def create_xml(exam, filename='import.xml', mode='terminal', questions=None):
             
         return questionlist, info
 
+    snapshot = {}
     # Choose question list creation mode
     if mode == 'terminal':
         mode_choice = fast_input(['auto', 'manual'],
@@ -991,31 +2106,171 @@ def create_xml(exam, filename='import.xml', mode='terminal', questions=None):
             questionlist, info = questionlist_auto()
         elif mode_choice == 'manual':
             questionlist, info = questionlist_manual()
+            snapshot = fetch_questions(questionlist)
     elif mode == 'gui':
         questionlist, info = questionlist_auto(questions)
 
-    # Append XML
-    for q in questionlist:
-        q_dict = QUESTIONS.find_one({'name': q})
-        try:
-            q_el = eval((
-                f'{q_dict["moodle_type"].capitalize()}'
-                f'Question(attrib={{"type": "{q_dict["moodle_type"]}"}})'
-                        ))
-            q_el.set_defaults(q_dict)
-            q_el.set_additional(q_dict)
-            root.append(q_el)
-        except:
-            print(f'Question {q} has errors!')
-
-    with open(f'{BASE_PATH}/databases/{DB.name}/exams/{exam}/{filename}', 'w') as wf:
-        wf.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        wf.write((f'<!-- Estimated time: {info[0]}, '
-                  f'average difficulty: {info[1]}, '
-                  f'maximum possible points: {info[2]} -->\n')
-                 )
-        wf.write(ET.tostring(root, pretty_print=True).decode('utf-8'))
-
-    print('Import file successfully created.')
+    snapshot = prepare_snapshot(snapshot, questionlist, shared_datasets, images,
+                                message)
+    calculated = [
+        q for q in questionlist
+        if snapshot[q].get('moodle_type') == 'calculated' and 'vars' in snapshot[q]
+    ]
+
+    # Only questions without cached fragment need to be rendered
+    keys = {q: render_key(snapshot[q]) for q in questionlist}
+
+    # Content hashes of the questions of the last export of this exam. Split
+    # manifests end in -manifest.json, so the names can't collide
+    directory = f'{BASE_PATH}/databases/{DB.name}/exams/{exam}'
+    manifest_path = f'{directory}/.delta.json'
+    try:
+        with open(manifest_path, 'r') as rf:
+            previous = json.load(rf)['questions']
+    except FileNotFoundError:
+        previous = None
+    if delta and previous is None and message:
+        print(f'No previous export of {exam} found. Exporting all questions.')
+    if delta and previous is not None:
+        exported = [q for q in questionlist if previous.get(q) != keys[q]]
+        if message:
+            print(f'Delta export: {len(exported)} of {len(questionlist)} '
+                  'question(s) changed since the last export.')
+        if not exported:
+            return questionlist, info
+    else:
+        exported = questionlist
+    # Fragments are cached by the documents actually rendered, while the
+    # manifest keeps the keys of the planned documents
+    render_keys = dict(keys)
+    if shared_datasets:
+        for q in claim_shared_datasets(snapshot, exported):
+            render_keys[q] = render_key(snapshot[q])
+
+    pending = [q for q in exported if render_keys[q] not in FRAGMENT_CACHE]
+    # Optimize and encode all referenced images in parallel before rendering
+    img_paths = [
+        f'{BASE_PATH}/databases/{DB.name}/img/' + f
+        for q in pending for f in snapshot[q].get('img_files', [])
+        if snapshot[q].get('moodle_type') != 'ddimageortext'
+    ]
+    IMAGE_OPTIMIZER.prefetch(img_paths)
+    IMAGE_CACHE.prefetch(img_paths)
+    # Run modified random_vars modules in parallel before rendering
+    RANDOM_VARS.prefetch([
+        (q, snapshot[q]['vars']) for q in calculated if q in pending
+    ])
+
+    counts = {'reused': 0, 'rendered': 0}
+    written = []
+    def build_fragments():
+        if workers and workers > 1 and len(pending) > 1:
+            rendered = render_parallel((snapshot[q] for q in pending), workers)
+        else:
+            rendered = None
+        pending_set = set(pending)
+        # Shared datasets whose items were to be written by a question with
+        # errors
+        orphaned = set()
+        for q in exported:
+            if rendered is not None and q in pending_set:
+                # Consumed in any case to stay in step with the pool
+                fragment = next(rendered)
+            shared = snapshot[q].get('_shared_datasets', {})
+            claimed = {v for v in orphaned if shared.get(v) is False}
+            if claimed:
+                # The next user writes the items instead
+                snapshot[q] = dict(snapshot[q], _shared_datasets={
+                    **shared, **dict.fromkeys(claimed, True)
+                })
+                render_keys[q] = render_key(snapshot[q])
+                orphaned -= claimed
+            if q not in pending_set or claimed:
+                fragment = FRAGMENT_CACHE.get(render_keys[q])
+                if fragment is not None:
+                    counts['reused'] += 1
+                    written.append(q)
+                    yield q, fragment
+                    continue
+                fragment = _render_worker(snapshot[q])
+            elif rendered is None:
+                fragment = _render_worker(snapshot[q])
+            if fragment is None:
+                print(f'Question {q} has errors!')
+                orphaned.update(
+                    v for v, items in snapshot[q].get('_shared_datasets', {}).items()
+                    if items
+                )
+                continue
+            FRAGMENT_CACHE.put(render_keys[q], fragment)
+            counts['rendered'] += 1
+            written.append(q)
+            yield q, fragment
+
+    IMAGE_CACHE.retain()
+    try:
+        fragments = build_fragments()
+        if not stream:
+            fragments = list(fragments)
+        if max_bytes:
+            parts = write_parts(directory, filename[:-4], exam, info,
+                                fragments, max_bytes)
+            with open(f'{directory}/{filename[:-4]}-manifest.json', 'w') as wf:
+                json.dump({'exam': exam, 'max_bytes': max_bytes, 'parts': parts},
+                          wf, indent=2)
+            files = [p['file'] for p in parts]
+        else:
+            with open(f'{directory}/{filename}', 'wb') as wf:
+                write_quiz(wf, exam, info, (f for q, f in fragments))
+            files = [filename]
+    finally:
+        IMAGE_CACHE.release()
+        IMAGE_OPTIMIZER.evict()
+        FRAGMENT_CACHE.evict()
+
+    # Record hashes for the next delta export; questions with errors keep their
+    # previous hash, so they are exported again
+    hashes = {q: (previous or {}).get(q) for q in questionlist}
+    hashes.update({q: keys[q] for q in written})
+    with open(manifest_path, 'w') as wf:
+        json.dump({
+            'exam': exam,
+            'files': files,
+            'questions': {q: h for q, h in hashes.items() if h is not None}
+        }, wf, indent=2)
+
+    if bundle:
+        img_path = f'{BASE_PATH}/databases/{DB.name}/img/'
+        img_files = {
+            f for q in exported
+            for f in (snapshot[q].get('img_files') or [])
+            if os.path.isfile(img_path + f)
+        }
+        with zipfile.ZipFile(f'{directory}/{filename[:-4]}.zip', 'w',
+                             zipfile.ZIP_DEFLATED) as zf:
+            for f in files:
+                zf.write(f'{directory}/{f}', f)
+            for f in sorted(img_files):
+                zf.write(img_path + f, f'img/{f}')
+        if message:
+            print(f'Bundle {filename[:-4]}.zip successfully created.')
+
+    if not message:
+        return questionlist, info
+    if max_bytes:
+        print(f'Import file successfully split into {len(files)} parts.')
+    else:
+        print('Import file successfully created.')
+    print(f'Fragment cache: {counts["reused"]} question(s) reused, '
+          f'{counts["rendered"]} rendered.')
+    if IMAGE_OPTIMIZER.max_dim:
+        original, optimized = IMAGE_OPTIMIZER.savings([
+            f'{BASE_PATH}/databases/{DB.name}/img/' + f
+            for q in exported for f in (snapshot[q].get('img_files') or [])
+            if snapshot[q].get('moodle_type') != 'ddimageortext'
+        ])
+        print(f'Image optimization: {original / 2**20:.2f} MiB -> '
+              f'{optimized / 2**20:.2f} MiB '
+              f'({(original - optimized) / 2**20:.2f} MiB saved).')
 
     return questionlist, info
@@ -3,12 +3,18 @@ from core import *
 
 import os
 import re
+import time
+import datetime
 from PIL import Image
 import numpy as np
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
-def create_exam(exam, filename='import.xml', mode='terminal', questions=None, message=True):
+def create_exam(exam, filename='import.xml', mode='terminal', questions=None, message=True,
+                stream=False, workers=None, shared_datasets=False,
+                images='inline', bundle=False, max_bytes=None):
     """
     Creates an xml file out of questions within the database. While using this
     function the user will be asked whether they want to use automatic or manual
@@ -31,38 +37,205 @@ def create_exam(exam, filename='import.xml', mode='terminal', questions=None, me
     questions (list):
       If used in GUI, a list of question names will be passed to this argument.
       The argument isn't used otherwise.
+    stream (bool):
+      If set to True, questions are written to the xml file one by one. Use for
+      large exams with many images.
+    workers (int):
+      Number of processes used to render questions. Use for large exams with
+      many calculated questions.
+    shared_datasets (bool):
+      If set to True, identical vars of calculated questions are exported as
+      shared datasets. Shrinks exams with many calculated child questions.
+    images (str):
+      'inline' embeds images as base64 data URIs. 'attach' writes each image
+      once per question text or answer as Moodle file attachment, which
+      shrinks exams that reference the same images repeatedly.
+    bundle (bool):
+      If set to True, a zip file containing the xml file and all images of
+      the exam is written next to the xml file.
+    max_bytes (int):
+      Maximum size of an import file in bytes. If given, the exam is split
+      into several import files '<filename>-1.xml', '<filename>-2.xml', ...
+      and a manifest listing the questions of each file.
 
     ------------------------------
     Dependencies: config, core, re
     """
 
+    # Exam names are unique, fail before any file is written
+    if EXAMS.count_documents({'name': exam}, limit=1):
+        raise Exception(f'Exam {exam} already exists in database! '
+                        'Remove it with remove_exam() first.')
+
     # Write XML
-    questionlist, info = create_xml(exam, filename, mode, questions)
+    questionlist, info = create_xml(exam, filename, mode, questions, stream,
+                                    workers, shared_datasets, images, bundle,
+                                    max_bytes)
 
     # Update database
+    register_exam(exam, questionlist, info)
+
+    # Final report
+    if message:
+        print((
+            f'\nTotal points: {info[2]}\n'
+            f'Average difficulty: {info[1]}\n'
+            f'Estimated time: {info[0]} minutes\n'
+        ))
+        print('Database updated.')
+
+
+def register_exam(exam, questionlist, info):
+    """
+    Add the exam document to the EXAMS collection and mark its questions as
+    used in the exam. Used by create_exam() and create_exams().
+
+    -------------------------------------
+    Dependencies: config, datetime, numpy
+    """
+    # Exam entries are unique per question
+    questionlist = list(dict.fromkeys(questionlist))
     EXAMS.insert_one({
         'name': exam,
+        'date': datetime.datetime.now(datetime.timezone.utc),
         'points_max': info[2],
         'time_est': info[0],
         'difficulty_avg': info[1],
         'questions': questionlist
     })
-    for q in questionlist:
-        QUESTIONS.find_one_and_update(
-            {'name': q}, {'$set': {f'in_exams.{exam}': np.nan}}
+    if questionlist:
+        EXAM_QUESTIONS.insert_many([
+            {'exam': exam, 'question': q, 'score': np.nan} for q in questionlist
+        ])
+    QUESTIONS.update_many(
+        {'name': {'$in': questionlist}}, {'$set': {f'in_exams.{exam}': np.nan}}
+    )
+    QUESTION_CACHE.invalidate(*questionlist)
+    update_question_stats(questionlist)
+
+
+def create_exams(exams, test=False, workers=None, threads=4, **options):
+    """
+    Creates the xml files of several exams at once, e.g. mock, main and resit
+    exams of a course. All questions are fetched from the database once and
+    questions shared between exams are only rendered once. The exam files are
+    then written concurrently and a single summary is printed.
+
+    Arguments:
+    ----------
+    exams (list):
+      List of dictionaries with keys 'exam' (name of the exam), 'questions'
+      (list of question names or path of a whitespace-separated file) and
+      optionally 'filename'. Exam names have to be unique.
+    test (bool):
+      If set to True, exams are created like 'create_testexam()' does, i.e.
+      without database entries.
+    workers (int):
+      Number of processes used to render the questions of all exams.
+    threads (int):
+      Number of exam files written at the same time.
+    options:
+      Further arguments of 'create_exam()', e.g. stream, images or max_bytes.
+
+    Returns a list with one summary dictionary per exam.
+
+    -------------------------------------------------------
+    Dependencies: config, core, time, threading, ThreadPoolExecutor
+    """
+    exams = [dict(e) for e in exams]
+    names = [e['exam'] for e in exams]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise Exception(f'Exam name(s) {", ".join(duplicates)} given more than once!')
+    for e in exams:
+        if type(e['questions']) == str:
+            with open(e['questions'], 'r') as rf:
+                e['questions'] = rf.read().split()
+
+    # Exam names are unique, refuse taken ones before anything is rendered
+    refused = {}
+    for i, e in enumerate(exams):
+        if not test and EXAMS.count_documents({'name': e['exam']}, limit=1):
+            error = Exception(f'Exam {e["exam"]} already exists in database!')
+            refused[i] = {'exam': e['exam'], 'error': repr(error)}
+    accepted = [e for i, e in enumerate(exams) if i not in refused]
+
+    # Fetch and render the union of all question lists once
+    union = list(dict.fromkeys(q for e in accepted for q in e['questions']))
+    q_dicts = fetch_questions(union)
+    # Prepared like create_xml() does, so that the exports reuse every
+    # fragment. Shared datasets are planned per exam, so a question may be
+    # rendered once per plan.
+    rendered = {}
+    for e in accepted:
+        snapshot = prepare_snapshot(
+            q_dicts, [q for q in e['questions'] if q in q_dicts],
+            options.get('shared_datasets', False), options.get('images', 'inline')
         )
+        for q in snapshot.values():
+            rendered.setdefault(render_key(q), q)
+    rendered = list(rendered.values())
+    IMAGE_CACHE.retain()
+    try:
+        counts = prerender(rendered, workers)
+        # Question stats are recomputed from all exam entries, so concurrent
+        # registrations could overwrite each other
+        register_lock = threading.Lock()
 
-    # Final report
-    if message:
-        print((
-            f'\nTotal points: {info[2]}\n'
-            f'Average difficulty: {info[1]}\n'
-            f'Estimated time: {info[0]} minutes\n'
-        ))
+        def export(e):
+            start = time.time()
+            try:
+                questionlist, info = create_xml(
+                    e['exam'], e.get('filename', 'import.xml'), mode='gui',
+                    questions=list(e['questions']), q_dicts=q_dicts,
+                    message=False, **options
+                )
+                if not test:
+                    with register_lock:
+                        register_exam(e['exam'], questionlist, info)
+            except Exception as error:
+                return {'exam': e['exam'], 'error': repr(error)}
+            manifest = (f'{BASE_PATH}/databases/{DB.name}/exams/{e["exam"]}/'
+                        '.delta.json')
+            with open(manifest, 'r') as rf:
+                files = json.load(rf)['files']
+            return {
+                'exam': e['exam'], 'questions': len(questionlist),
+                'points': info[2], 'time_est': info[0], 'files': files,
+                'seconds': round(time.time() - start, 2)
+            }
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = iter(pool.map(export, accepted))
+            results = [refused[i] if i in refused else next(results)
+                       for i in range(len(exams))]
+    finally:
+        IMAGE_CACHE.release()
+
+    # Summary
+    print(f'\n{len(exams)} exam(s) from {len(union)} distinct question(s), '
+          f'{counts["rendered"]} rendered, {counts["reused"]} reused.')
+    for r in results:
+        if 'error' in r:
+            print(f'{r["exam"]}: failed with {r["error"]}')
+        else:
+            print(f'{r["exam"]}: {r["questions"]} questions, '
+                  f'{r["points"]} points, {r["time_est"]} minutes '
+                  f'-> {", ".join(r["files"])} ({r["seconds"]} s)')
+    failed = [r['exam'] for r in results if 'error' in r]
+    if failed:
+        print(f'\n{len(failed)} of {len(exams)} exam(s) failed: {", ".join(failed)}')
+        if not test and len(failed) < len(exams):
+            print('Only the other exams were added to the database.')
+    elif not test:
         print('Database updated.')
 
+    return results
 
-def create_testexam(exam, filename='import.xml'):
+
+def create_testexam(exam, filename='import.xml', stream=False, workers=None,
+                    shared_datasets=False, images='inline', bundle=False,
+                    max_bytes=None, delta=False):
     """
     This function is very similar to 'create_exam()' and is intended for
     experimenting with its features. It will not create any entries within the
@@ -75,13 +248,33 @@ def create_testexam(exam, filename='import.xml'):
       Name of the exam within Moodle/Poodle.
     filename (str):
       Name of the output xml file.
+    stream (bool):
+      See 'create_exam()'.
+    workers (int):
+      See 'create_exam()'.
+    shared_datasets (bool):
+      See 'create_exam()'.
+    images (str):
+      See 'create_exam()'.
+    bundle (bool):
+      See 'create_exam()'.
+    max_bytes (int):
+      See 'create_exam()'.
+    delta (bool):
+      If set to True, only questions that changed since the last export of
+      the exam are written, e.g. to re-import corrected questions of an exam
+      that was created with 'create_exam()' before.
 
     ------------------------------
     Dependencies: config, core, re
     """
 
     # Write XML
-    questionlist, info = create_xml(exam, filename)
+    questionlist, info = create_xml(exam, filename, stream=stream,
+                                    workers=workers,
+                                    shared_datasets=shared_datasets,
+                                    images=images, bundle=bundle,
+                                    max_bytes=max_bytes, delta=delta)
 
     print((
         f'\nTotal points: {info[2]}\n'
@@ -95,7 +288,7 @@ def remove_exam(exam, message=True):
     """
     Remove an exam from the database. This will remove the exam's document from
     the exams collection, as well as all entries of this exam within the
-    questions.
+    questions. Only questions of the exam are updated.
 
     Arguments:
     ----------
@@ -106,10 +299,19 @@ def remove_exam(exam, message=True):
     Dependencies: config
     """
 
+    # Exams of databases whose exam_questions weren't backfilled yet are
+    # only known from the exam document
+    questionlist = set(EXAM_QUESTIONS.distinct('question', {'exam': exam}))
+    for e in EXAMS.find({'name': exam}, {'questions': 1}):
+        questionlist.update(e.get('questions', []))
+    questionlist = sorted(questionlist)
     deletion = EXAMS.delete_many({'name': exam})
+    EXAM_QUESTIONS.delete_many({'exam': exam})
     updates = QUESTIONS.update_many(
-        {'_id': {'$type': 7}}, {'$unset': {f'in_exams.{exam}': ''}}
+        {'name': {'$in': questionlist}}, {'$unset': {f'in_exams.{exam}': ''}}
     )
+    QUESTION_CACHE.invalidate(*questionlist)
+    update_question_stats(questionlist)
     # Final report
     if message:
         print(f'{deletion.deleted_count} document(s) have been removed ' +
@@ -176,9 +378,7 @@ def evaluate_exam(exam_name, stats_file, grades_file):
         # Ignore "clones" from rvar questions
         if '.' not in q[lang_profile['index']]:
             # Check question in database
-            question = QUESTIONS.find_one(
-                {'name': q[lang_profile['question_name']]}
-            )
+            question = QUESTION_CACHE.get(q[lang_profile['question_name']])
             if question:
                 moodle_name = lang_profile['index'] + q[lang_profile['index']] + \
                     str(question['points'] * 100)
@@ -209,9 +409,15 @@ def evaluate_exam(exam_name, stats_file, grades_file):
     ][0].replace(',', '.'))
     # Update questions in DB
     for k, v in name_pairs.items():
+        EXAM_QUESTIONS.update_one(
+            {'exam': exam_name, 'question': v[0]}, {'$set': {'score': v[2]}},
+            upsert=True
+        )
         QUESTIONS.find_one_and_update(
             {'name': v[0]}, {'$set': {f'in_exams.{exam_name}': v[2]}}
         )
+        QUESTION_CACHE.invalidate(v[0])
+    update_question_stats(v[0] for v in name_pairs.values())
     # Update exam in DB
     rel_averages = {
         v[0]: np.round(v[2] / v[1], 2) for k, v in name_pairs.items()
@@ -122,6 +122,17 @@ class NewQuestionDialog(Gtk.MessageDialog):
                 self.moodle_types.append_text(mt)
         self.moodle_types.set_active(0)
         self.box.pack_end(self.moodle_types, True, True, 10)
+        # Category and family type determine the new question's name
+        self.family_types = Gtk.ComboBoxText()
+        for ft in ['single', 'parent']:
+            self.family_types.append_text(ft)
+        self.family_types.set_active(0)
+        self.box.pack_end(self.family_types, True, True, 10)
+        self.categories = Gtk.ComboBoxText.new_with_entry()
+        for c in config.Q_CATEGORIES or []:
+            self.categories.append_text(c)
+        self.categories.set_active(0)
+        self.box.pack_end(self.categories, True, True, 10)
         self.box.show_all()
 
     def _run(self):
@@ -133,7 +144,14 @@ class NewQuestionDialog(Gtk.MessageDialog):
                 k: self.default_fill('general', k, v)
                 for k, v in config.KEY_TYPES['general'].items()
             }
-            question_content['name'] = 'New question'
+            category = self.categories.get_active_text()
+            question_content['family_type'] = self.family_types.get_active_text()
+            if category:
+                question_content['name'] = config.new_question_name(
+                    category, question_content['family_type']
+                )
+            else:
+                question_content['name'] = 'New question'
             # Set remaining fields based on moodle_type
             question_content['moodle_type'] = self.moodle_types.get_active_text()
             question_content.update({
@@ -5,13 +5,14 @@ from gi.repository import Gtk
 # Poodle modules
 import gui.windows
 from poodle import config
+from poodle import core
 # Other modules
 import numpy as np
 
 
 class GeneralQuestionGrid(Gtk.Grid):
     """
-    Dependencies: Gtk, gui.windows, config
+    Dependencies: Gtk, gui.windows, config, core
     """
 
     def __init__(self, parent: Gtk.Window, question_content: dict):
@@ -133,6 +134,11 @@ class GeneralQuestionGrid(Gtk.Grid):
             self.question_buffer.get_end_iter(),
             include_hidden_chars=True
         )
+        # Show tables and images the way they will be exported
+        try:
+            content = core.resolve_placeholders(self.content, content)
+        except (KeyError, IndexError, TypeError, AttributeError, OSError):
+            pass
 
         new_window = gui.windows.HTMLPreviewWindow(self, content)
         new_window.show_all()
@@ -1220,7 +1226,7 @@ class ExamGrid(Gtk.Grid):
 
         try:
             avg = np.round(np.nansum([
-                x[1] * config.QUESTIONS.find_one({'name': x[0]})['points']
+                x[1] * config.QUESTION_CACHE.get(x[0])['points']
                 for x in exam_content['questions_avgs'].items()
             ]), 2)
         except KeyError:
@@ -6,11 +6,12 @@ from gi.repository import Gtk
 from poodle import question
 from poodle import config
 from poodle import exam
+from poodle import core
 import gui.dialogs
 # Other modules
-import json
 import ast
 import re
+import threading
 
 
 class MainQuestionControlPanel(Gtk.ActionBar):
@@ -116,7 +117,7 @@ class MainExamControlPanel(Gtk.ActionBar):
 
 class QuestionControlPanel(Gtk.ActionBar):
     """
-    Dependencies: Gtk, json, question, config, gui.dialogs
+    Dependencies: Gtk, question, config, gui.dialogs
     """
 
     def __init__(self, parent: Gtk.Window):
@@ -136,9 +137,9 @@ class QuestionControlPanel(Gtk.ActionBar):
     # Initialized every time save button is clicked
     def check_question(self, page):
 
-        check_result = question.check_question(json.dumps(
-            page.content, ensure_ascii=False
-        ), ignore_duplicates=True)
+        check_result = question.check_question(
+            page.content, ignore_duplicates=True
+        )
         if check_result:
             dialog = gui.dialogs.CheckQuestionDialog(
                 self.parent_window, page, check_result
@@ -158,7 +159,12 @@ class QuestionControlPanel(Gtk.ActionBar):
                 check_result = self.check_question(page)
                 # Update database if question contains no errors
                 if not check_result:
+                    page.content.update(config.split_name(page.content['name']))
                     config.QUESTIONS.insert_one(page.content)
+                    config.QUESTION_CACHE.invalidate(page.content['name'])
+                    # Name might have been entered by hand
+                    config.update_counters([page.content['name']])
+                    config.update_question_stats([page.content['name']])
                     # Update questions and exams
                     self.main_window.update_tables()
 
@@ -179,6 +185,9 @@ class QuestionControlPanel(Gtk.ActionBar):
                             {'name': page.content['name']},
                             {'$set': {k: v}}
                         )
+                    config.QUESTION_CACHE.invalidate(page.content['name'])
+                    # Relative scores depend on points
+                    config.update_question_stats([page.content['name']])
                     # Update questions and exams
                     self.main_window.update_tables()
 
@@ -196,7 +205,7 @@ class QuestionControlPanel(Gtk.ActionBar):
         self.page.overwrite(new_content)
         question_name = self.page.content['name']
         # Check if any changes were made to question
-        db_question = config.QUESTIONS.find_one({'name': question_name})
+        db_question = config.QUESTION_CACHE.get(question_name)
         try:
             db_question.pop('_id')
             if self.page.content == db_question:
@@ -251,6 +260,10 @@ class QuestionControlPanel(Gtk.ActionBar):
             answered_yes = dialog._run()
             if answered_yes:
                 config.QUESTIONS.delete_one({'name': question_name})
+                config.QUESTION_CACHE.invalidate(question_name)
+                # Deleted questions don't count as exam questions anymore
+                config.EXAM_QUESTIONS.delete_many({'question': question_name})
+                config.update_question_stats([question_name])
                 # Update questions and exams
                 self.main_window.update_tables()
                 # Close question window
@@ -287,7 +300,7 @@ class TableControlPanel(Gtk.ActionBar):
 
 class VariableControlPanel(Gtk.ActionBar):
     """
-    Dependencies: Gtk, gui.dialogs, config, ast, re
+    Dependencies: Gtk, gui.dialogs, config, core, ast, re, threading
     """
 
     def __init__(self, parent: Gtk.Window):
@@ -338,6 +351,13 @@ class VariableControlPanel(Gtk.ActionBar):
         if passed:
             with open(self.path, 'w') as wf:
                 wf.write(code)
+            # Evaluate new version in the background for the next export
+            threading.Thread(
+                target=core.RANDOM_VARS.prefetch,
+                args=([(self.parent_window.question_name,
+                        self.parent_window.variables)],),
+                daemon=True
+            ).start()
             dialog = gui.dialogs.OKDialog(
                 self.parent_window,
                 'File successfully saved.'
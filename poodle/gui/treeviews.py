@@ -6,6 +6,7 @@ from gi.repository import Gtk, Gdk
 from poodle import config
 from poodle import question
 from poodle import exam
+from poodle import core
 import gui.windows
 # Other modules
 import re
@@ -15,7 +16,7 @@ import pandas as pd
 
 class QuestionTreeview(Gtk.TreeView):
     """
-    Dependencies: Gtk, Gdk, config, question, gui.windows, gui.dialogs, re, numpy, pandas
+    Dependencies: Gtk, Gdk, config, core, question, gui.windows, gui.dialogs, re, numpy, pandas
     """
 
     def __init__(self, parent: Gtk.Window):
@@ -51,22 +52,16 @@ class QuestionTreeview(Gtk.TreeView):
                 yield [x for x in row[:4]] + [str(x) for x in row[4:]]
 
         # Generate dataframe
-        exam_list = sorted([e['name'] for e in config.EXAMS.find()])
-        df = pd.DataFrame(
-            sorted(
-            [
-             [q['name'], q['difficulty'], q['time_est']] +
-             [round(q['in_exams'][e] / q['points'], 2)
-              if e in q['in_exams'] else '.' for e in exam_list
-             ]
-             for q in config.QUESTIONS.find() if q['name'][-2:] != '00'
-            ]),
-            columns = ['question', 'difficulty', 'time_est'] + exam_list
-        )
+        names, difficulty, time_est, exam_list, cells = core.overview_matrix()
+        df = pd.concat([
+            pd.DataFrame({'question': names, 'difficulty': difficulty,
+                          'time_est': time_est}),
+            pd.DataFrame(cells, columns=exam_list)
+        ], axis=1)
         # Make exam appearance counter
-        transform = lambda x: int(type(x) == float)
-        appearances = df[exam_list].map(transform).sum(axis=1)
-        df.insert(1, 'appearances', appearances.astype('int64'))
+        appeared = config.exam_appearances()
+        appearances = pd.Series([appeared.get(q, 0) for q in df['question']], dtype='int64')
+        df.insert(1, 'appearances', appearances)
 
         data = row_to_list(df)
         # Empty QUESTIONS collection would raise TypeError in numpy_to_native_types
@@ -115,7 +110,7 @@ class QuestionTreeview(Gtk.TreeView):
         selected_row = self.get_selection()
         model, treeiter = selected_row.get_selected()
         question_name = model[treeiter][0]
-        question_content = config.QUESTIONS.find_one({'name': question_name})
+        question_content = config.QUESTION_CACHE.get(question_name)
         question_content.pop('_id')
 
         new_window = gui.windows.QuestionWindow(
@@ -186,7 +181,7 @@ class QuestionTreeview(Gtk.TreeView):
             field == 'moodle_type' or
             field == 'family_type'
         ):
-            question = config.QUESTIONS.find_one({'name': model[iterator][0]})
+            question = config.QUESTION_CACHE.get(model[iterator][0])
             return bool(re.search(search, question[field]))
         elif field in numeric:
             # Check for allowed math expressions
@@ -292,7 +287,7 @@ class ExamTreeview(Gtk.TreeView):
                 exam = config.EXAMS.find_one({'name': e})
                 # Get actual average instead of relative average score
                 exam_avg = np.round(np.nansum([
-                    x[1] * config.QUESTIONS.find_one({'name': x[0]})['points']
+                    x[1] * config.QUESTION_CACHE.get(x[0])['points']
                     for x in exam['questions_avgs'].items()
                 ]), 2)
                 points_avg.append(exam_avg)
@@ -256,9 +256,9 @@ class ExamCreationWindow(Gtk.Window):
             include_hidden_chars=True
         ).split()
         # Check if all questions are in database
+        q_dicts = config.QUESTION_CACHE.get_many(question_list)
         wrong_questions = [
-            q for q in question_list if
-            config.QUESTIONS.find_one({'name': q}) == None
+            q for q in question_list if q not in q_dicts
         ]
         if wrong_questions:
             # Color wrong questions red
@@ -285,8 +285,7 @@ class ExamCreationWindow(Gtk.Window):
             lambda x: (x.get_property('name') == 'time'),
             self.right_grid.get_children()
         ))[0]
-        time_est = sum([config.QUESTIONS.find_one({'name': q})['time_est']
-                        for q in question_list])
+        time_est = sum([q_dicts[q]['time_est'] for q in question_list])
         time_value.set_label(str(time_est))
         # Calculate average difficulty
         difficulty_value = list(filter(
@@ -294,7 +293,7 @@ class ExamCreationWindow(Gtk.Window):
             self.right_grid.get_children()
         ))[0]
         difficulty_avg = np.round(np.mean(
-            [config.QUESTIONS.find_one({'name': q})['difficulty'] for q in question_list]
+            [q_dicts[q]['difficulty'] for q in question_list]
         ), 2)
         difficulty_value.set_label(str(difficulty_avg))
         # Calculate max points
@@ -302,9 +301,7 @@ class ExamCreationWindow(Gtk.Window):
             lambda x: (x.get_property('name') == 'points'),
             self.right_grid.get_children()
         ))[0]
-        max_points = sum(
-            [config.QUESTIONS.find_one({'name': q})['points'] for q in question_list]
-        )
+        max_points = sum([q_dicts[q]['points'] for q in question_list])
         points_value.set_label(str(max_points))
 
     def create_exam(self, button) -> None:
@@ -42,7 +42,12 @@ if __name__ == "__main__":
             print('\n\n')
     else:
         print('No backups found.')
+    # Bring indexes and documents to the current schema
+    schema_version = migrate_db()
     # Report status
     print(f'Current database: {DB.name}\n')
     for c in DB.list_collection_names():
         print('Documents in collection %s: %d' % (c, DB.get_collection(c).count_documents({})))
+    print('\nSchema version: %d of %d' % (schema_version, SCHEMA_VERSION))
+    for c, index, ops in index_usage():
+        print('Operations using index %s.%s: %d' % (c, index, ops))
@@ -9,364 +9,613 @@ import pandas as pd
 import numpy as np
 import re
 import json
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 
-def check_question(json_string: str, ignore_duplicates: bool = False) -> dict:
+def compile_rule(rule: tuple):
     """
-    Used by add_json() to check for correct question formatting.
+    Turn a rule of config.KEY_RULES into a function that checks a question
+    dictionary and adds an error message to the output dictionary if the
+    rule is broken. Rules are skipped for keys that already have an error.
 
     Arguments:
     ----------
-    json_string (str):
-      String that will be interpreted as JSON.
-    ignore_duplicates (bool):
-      If set to True, duplicate question names in database won't be classified
-      as formatting errors. Used specifically for overwriting questions in GUI.
+    rule (tuple):
+      Rule as described in config.KEY_RULES.
 
-    ------------------
-    Dependencies: json
+    Returns function(question: dict, output: dict) -> None.
+    """
+
+    # Error message if list or dict doesn't have required length
+    def length_error(input_obj, required: int, mode: str):
+        if mode == 'fixed' and len(input_obj) != required:
+            return f'Wrong number of entries. (Required: {required})'
+        elif mode == 'min' and len(input_obj) < required:
+            return f'Wrong number of entries. (Required: {required} or more)'
+
+    match rule:
+        case ('options', key, options):
+            def check(question: dict, output: dict) -> None:
+                if key not in output and question[key] not in options:
+                    output[key] = f'{question[key]} not in  possible options: {options}'
+        case ('length' | 'entry_length', key, required, mode):
+            if mode not in ('fixed', 'min'):
+                raise Exception('Wrong mode argument')
+            if rule[0] == 'length':
+                def check(question: dict, output: dict) -> None:
+                    if key not in output:
+                        error = length_error(question[key], required, mode)
+                        if error:
+                            output[key] = error
+            else:
+                def check(question: dict, output: dict) -> None:
+                    if key not in output:
+                        for k, v in question[key].items():
+                            error = length_error(v, required, mode)
+                            if error and f'{key}.{k}' not in output:
+                                output[f'{key}.{k}'] = error
+        case ('equal_length', key, other):
+            def check(question: dict, output: dict) -> None:
+                if key not in output and other not in output:
+                    error = length_error(
+                        question[key], len(question[other]), 'fixed'
+                    )
+                    if error:
+                        output[key] = error
+        case ('item_options', key, index, label, options):
+            def check(question: dict, output: dict) -> None:
+                if key not in output and label not in output:
+                    value = question[key][index]
+                    if value not in options:
+                        output[label] = f'{value} not in  possible options: {options}'
+        case _:
+            raise Exception(f'Unknown rule: {rule}')
+
+    return check
+
+
+def compile_validator(moodle_type: str):
     """
+    Build the formatting check for one moodle_type from config.KEY_TYPES and
+    config.KEY_RULES. Duplicate question names are not checked here, see
+    check_question().
+
+    Arguments:
+    ----------
+    moodle_type (str):
+      Key of config.KEY_TYPES other than 'general' and 'optional'.
 
-    question_dict = json.loads(json_string)
-    result_dict = {}
+    Returns function(question: dict) -> dict with the error message for each
+    faulty key.
+    """
 
-    # Function for missing question keys
-    def check_missing(question: dict, keys: dict, output: dict) -> None:
-        for k in keys.keys():
-            if k not in question.keys():
+    general_keys = tuple(KEY_TYPES['general'].items())
+    optional_keys = tuple(KEY_TYPES['optional'].items())
+    type_keys = tuple(KEY_TYPES[moodle_type].items())
+    general_rules = tuple(compile_rule(r) for r in KEY_RULES['general'])
+    type_rules = tuple(compile_rule(r) for r in KEY_RULES.get(moodle_type, []))
+    zero_keys = ('points', 'time_est', 'difficulty')
+
+    # Check for missing and empty keys and correct data type
+    def check_keys(question: dict, keys: tuple, output: dict) -> None:
+        for k, v in keys:
+            if k not in question:
                 output[k] = 'Missing'
-    # Check if values are empty strings
-    def check_empty(question: dict, keys: dict, output: dict) -> None:
-        for k in keys.keys():
-            if k not in output.keys() and k in question.keys():
-                try:
-                    if re.match(r'^$|^\s+$', question[k]):
-                        output[k] = 'Empty value'
-                except TypeError:
-                    pass
-    # Check if values have correct data type
-    def check_type(question: dict, keys: dict, output: dict) -> None:
-        for k, v in keys.items():
-            if k not in output.keys() and k in question.keys():
-                if type(question[k]) != v:
+            elif k not in output:
+                value = question[k]
+                if isinstance(value, str) and not value.strip():
+                    output[k] = 'Empty value'
+                elif type(value) != v:
                     output[k] = f'Wrong data type. Expected: {v}'
-    # Check if certain values are zero
-    def check_zero(question: dict, keys: list, output: dict) -> None:
-        for k in keys:
-            if k not in output.keys() and k in question.keys():
-                if (
-                    (type(question[k]) == int or type(question[k]) == float)
-                    and question[k] <= 0
-                ):
-                    output[f] = 'Value needs to be > 0'
-    # Check if value is in possible set of limited options
-    def check_in_options(input_obj, input_key: str, options: list, output: dict) -> None:
-        if input_key not in output.keys():
-            if input_obj not in options:
-                output[input_key] = f'{input_obj} not in  possible options: {options}'
-    # Check if list or dict has required length
-    def check_length(input_obj, input_key: str, required: int, mode: str, output: dict) -> None:
-        if input_key not in output.keys():
-            if mode == 'fixed':
-                if len(input_obj) != required:
-                    output[input_key] = f'Wrong number of entries. (Required: {required})'
-            elif mode == 'min':
-                if len(input_obj) < required:
-                    output[input_key] = f'Wrong number of entries. (Required: {required} or more)'
-            else:
-                raise Exception('Wrong mode argument')
 
-    # Functions for each moodle_type and general fields
-    def check_general(question: dict) -> None:
+    def validator(question: dict) -> dict:
+        output = {}
         # Keys that are always present
-        check_missing(question, KEY_TYPES['general'], result_dict)
-        check_empty(question, KEY_TYPES['general'], result_dict)
-        check_type(question, KEY_TYPES['general'], result_dict)
-        check_zero(question, ['points', 'time_est', 'difficulty'], result_dict)
+        check_keys(question, general_keys, output)
+        # Check if certain values are zero
+        for k in zero_keys:
+            if k not in output:
+                value = question[k]
+                if (type(value) == int or type(value) == float) and value <= 0:
+                    output[k] = 'Value needs to be > 0'
         # Check for correct naming scheme
-        if Q_CATEGORIES and 'name' not in result_dict:
+        if Q_CATEGORIES and 'name' not in output:
             if question['name'][:-4] not in Q_CATEGORIES:
-                result_dict['name'] = 'Wrong naming scheme'
-        # Check for duplicate question name
-        if not ignore_duplicates:
-            if QUESTIONS.find_one({'name': question['name']}):
-                result_dict['name'] = 'Name already exists in database.'
-        # Make sure family_type is one of three possibilities
-        if 'family_type' not in result_dict.keys():
-            check_in_options(
-                question['family_type'], 'family_type',
-                ['single', 'parent', 'child'], result_dict
-            )
-
+                output['name'] = 'Wrong naming scheme'
+        for rule in general_rules:
+            rule(question, output)
         # Optional keys
-        check_type(question, KEY_TYPES['optional'], result_dict)
-
-    def check_multichoice(question: dict) -> dict:
-
-        check_general(question)
-        check_missing(question, KEY_TYPES['multichoice'], result_dict)
-        check_empty(question, KEY_TYPES['multichoice'], result_dict)
-        check_type(question, KEY_TYPES['multichoice'], result_dict)
-        # Make sure single is 0 or 1
-        if 'single' not in result_dict.keys():
-            check_in_options(
-                question['single'], 'single',
-                [0, 1], result_dict
-            )
-        # Needs at least one correct answer
-        if 'correct_answers' not in result_dict.keys():
-            check_length(
-                question['correct_answers'], 'correct_answers',
-                1, 'min', result_dict
-            )
+        for k, v in optional_keys:
+            if k not in output and k in question and type(question[k]) != v:
+                output[k] = f'Wrong data type. Expected: {v}'
+        # Keys and rules of moodle_type
+        check_keys(question, type_keys, output)
+        for rule in type_rules:
+            rule(question, output)
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
+        return output
 
-        return result_dict
+    return validator
 
-    def check_numerical(question: dict) -> dict:
 
-        check_general(question)
-        check_missing(question, KEY_TYPES['numerical'], result_dict)
-        check_empty(question, KEY_TYPES['numerical'], result_dict)
-        check_type(question, KEY_TYPES['numerical'], result_dict)
-        # Needs at least one correct answer
-        if 'correct_answers' not in result_dict.keys():
-            check_length(
-                question['correct_answers'], 'correct_answers',
-                1, 'min', result_dict
-            )
+# Formatting checks are built only once for every moodle_type
+VALIDATORS = {
+    k: compile_validator(k) for k in KEY_TYPES.keys()
+    if k not in ('general', 'optional')
+}
+
+
+def check_question(question, ignore_duplicates: bool = False,
+                   existing_names: set = None) -> dict:
+    """
+    Used by add_json() and the GUI to check for correct question formatting.
+
+    Arguments:
+    ----------
+    question (dict or str):
+      Question dictionary or string that will be interpreted as JSON.
+    ignore_duplicates (bool):
+      If set to True, duplicate question names in database won't be classified
+      as formatting errors. Used specifically for overwriting questions in GUI.
+    existing_names (set):
+      Names known to exist in the database. If given, the database isn't
+      queried for duplicates. Used by check_questions().
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
+    Returns a dictionary with the error message for each faulty key, sorted
+    by key, plus the question name under '__question_name__'. Empty if the
+    question is correct.
 
-        return result_dict
+    ------------------
+    Dependencies: json
+    """
 
-    def check_shortanswer(question: dict) -> dict:
+    if type(question) == str:
+        question_dict = json.loads(question)
+    else:
+        question_dict = question
+
+    moodle_type = question_dict.get('moodle_type')
+    if type(moodle_type) != str or moodle_type not in VALIDATORS:
+        return {'__question_name__': question_dict.get('name'), 'moodle_type': 'Unknown'}
+    result_dict = VALIDATORS[moodle_type](question_dict)
+
+    # Check for duplicate question name
+    name = question_dict.get('name')
+    if not ignore_duplicates and type(name) == str:
+        if existing_names is not None:
+            exists = name in existing_names
+        else:
+            exists = QUESTIONS.find_one({'name': name})
+        if exists:
+            result_dict['name'] = 'Name already exists in database.'
 
-        check_general(question)
-        check_missing(question, KEY_TYPES['shortanswer'], result_dict)
-        check_empty(question, KEY_TYPES['shortanswer'], result_dict)
-        check_type(question, KEY_TYPES['shortanswer'], result_dict)
-        # Make sure usecase is 0 or 1
-        if 'usecase' not in result_dict.keys():
-            check_in_options(
-                question['usecase'], 'usecase',
-                [0, 1], result_dict
-            )
-        # Needs at least one correct answer
-        if 'correct_answers' not in result_dict.keys():
-            check_length(
-                question['correct_answers'], 'correct_answers',
-                1, 'min', result_dict
-            )
+    if result_dict:
+        result_dict['__question_name__'] = name
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
-
-        return result_dict
-
-    def check_essay(question: dict):
-        
-        check_general(question)
-        check_missing(question, KEY_TYPES['essay'], result_dict)
-        check_empty(question, KEY_TYPES['essay'], result_dict)
-        check_type(question, KEY_TYPES['essay'], result_dict)
-        # answer_files has fixed length of 2
-        if 'answer_files' not in result_dict.keys():
-            check_length(
-                question['answer_files'], 'answer_files',
-                2, 'fixed', result_dict
-            )
+    return dict(sorted(result_dict.items()))
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
-
-        return result_dict
-        
-    def check_matching(question: dict):
-
-        check_general(question)
-        check_missing(question, KEY_TYPES['matching'], result_dict)
-        check_empty(question, KEY_TYPES['matching'], result_dict)
-        check_type(question, KEY_TYPES['matching'], result_dict)
-        # Needs at least 2 correct answers to make sense
-        if 'correct_answers' not in result_dict.keys():
-            check_length(
-                question['correct_answers'], 'correct_answers',
-                2, 'min', result_dict
-            )
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
-
-        return result_dict
-        
-    def check_gapselect(question: dict):
-
-        check_general(question)
-        check_missing(question, KEY_TYPES['gapselect'], result_dict)
-        check_empty(question, KEY_TYPES['gapselect'], result_dict)
-        check_type(question, KEY_TYPES['gapselect'], result_dict)
-        # Needs at least one correct and false answer
-        if 'correct_answers' not in result_dict.keys():
-            check_length(
-                question['correct_answers'], 'correct_answers',
-                1, 'min', result_dict
-            )
-        if 'false_answers' not in result_dict.keys():
-            check_length(
-                question['false_answers'], 'false_answers',
-                1, 'min', result_dict
-            )
+def _validate_batch(questions: list) -> list:
+    # May be executed in a worker process, so duplicates are not checked
+    return [
+        check_question(q, ignore_duplicates=True) if type(q) == dict
+        else {'__question_name__': None, 'question': 'Not a JSON object'}
+        for q in questions
+    ]
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
-
-        return result_dict
-        
-    def check_ddimageortext(question: dict):
-
-        check_general(question)
-        check_missing(question, KEY_TYPES['ddimageortext'], result_dict)
-        check_empty(question, KEY_TYPES['ddimageortext'], result_dict)
-        check_type(question, KEY_TYPES['ddimageortext'], result_dict)
-        # Needs at least two correct answers
-        if 'correct_answers' not in result_dict.keys():
-            check_length(
-                question['correct_answers'], 'correct_answers',
-                2, 'min', result_dict
-            )
-        # Needs at least two drops
-        if 'drops' not in result_dict.keys():
-            check_length(
-                question['drops'], 'drops',
-                2, 'min', result_dict
-            )
-        # Drops always have X and Y value
-        if 'drops' not in result_dict.keys():
-            for k, v in question['drops'].items():
-                check_length(
-                    question['drops'][k], f'drops.{k}',
-                    2, 'fixed', result_dict
-                )
-        # Image file needs to be supplied
-        if 'img_files' not in result_dict.keys():
-            check_length(
-                question['img_files'], 'img_files',
-                1, 'fixed', result_dict
-            )
-        # Correct answers needs to be equal to drops
-        if not any(k in result_dict.keys() for k in ('correct_answers', 'drops')):
-            check_length(
-                question['drops'], 'drops',
-                len(question['correct_answers']), 'fixed', result_dict
-            )
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
-
-        return result_dict
-        
-    def check_calculated(question: dict):
-
-        check_general(question)
-        check_missing(question, KEY_TYPES['calculated'], result_dict)
-        check_empty(question, KEY_TYPES['calculated'], result_dict)
-        check_type(question, KEY_TYPES['calculated'], result_dict)
-        # Needs one correct answer
-        if 'correct_answers' not in result_dict.keys():
-            check_length(
-                question['correct_answers'], 'correct_answers',
-                1, 'fixed', result_dict
-            )
-        # Tolerance needs to be 3 long
-        if 'tolerance' not in result_dict.keys():
-            check_length(
-                question['tolerance'], 'tolerance',
-                3, 'fixed', result_dict
-            )
-        # Make sure tolerance type is correct
-        if 'tolerance' not in result_dict.keys():
-            check_in_options(
-                question['tolerance'][1], 'tolerance.type',
-                ['relative', 'nominal', 'geometric'], result_dict
-            )
-        # Must have at least one variable defined
-        if 'vars' not in result_dict.keys():
-            check_length(
-                question['vars'], 'vars',
-                1, 'min', result_dict
+def _check_duplicates(questions: list, results: list, ignore_duplicates: bool,
+                      seen_names: set) -> list:
+    # Add duplicate name errors to results of _validate_batch()
+    names = [q.get('name') if type(q) == dict else None for q in questions]
+    str_names = list({n for n in names if type(n) == str})
+    existing_names = set()
+    if not ignore_duplicates and str_names:
+        existing_names = {
+            q['name'] for q in QUESTIONS.find(
+                {'name': {'$in': str_names}}, {'_id': 0, 'name': 1}
             )
+        }
 
-        if result_dict:
-            result_dict['__question_name__'] = question['name']
-
-        return result_dict
-
-    # Operate according to moodle_type
-    match question_dict['moodle_type']:
-        case 'multichoice':
-            result = check_multichoice(question_dict)
-            return dict(sorted(result.items()))
-        case 'numerical':
-            result = check_numerical(question_dict)
-            return dict(sorted(result.items()))
-        case 'shortanswer':
-            result = check_shortanswer(question_dict)
-            return dict(sorted(result.items()))
-        case 'essay':
-            result = check_essay(question_dict)
-            return dict(sorted(result.items()))
-        case 'matching':
-            result = check_matching(question_dict)
-            return dict(sorted(result.items()))
-        case 'gapselect':
-            result = check_gapselect(question_dict)
-            return dict(sorted(result.items()))
-        case 'ddimageortext':
-            result = check_ddimageortext(question_dict)
-            return dict(sorted(result.items()))
-        case 'calculated':
-            result = check_calculated(question_dict)
-            return dict(sorted(result.items()))
-        case _:
-            return {'__question_name__': question_dict['name'], 'moodle_type': 'Unknown'}
+    for i, name in enumerate(names):
+        if type(name) != str:
+            continue
+        error = None
+        if name in existing_names:
+            error = 'Name already exists in database.'
+        if name in seen_names:
+            error = 'Name occurs more than once in batch.'
+        seen_names.add(name)
+        if error:
+            results[i]['name'] = error
+            results[i]['__question_name__'] = name
+            results[i] = dict(sorted(results[i].items()))
+
+    return results
+
+
+def check_questions(questions: list, ignore_duplicates: bool = False,
+                    seen_names: set = None) -> list:
+    """
+    Check a batch of question dictionaries for correct formatting. Names
+    already in the database are looked up with a single query and repeated
+    names within the batch are reported for every occurrence but the first.
 
+    Arguments:
+    ----------
+    questions (list):
+      List of question dictionaries.
+    ignore_duplicates (bool):
+      See 'check_question()'. Repeated names within the batch are reported
+      nevertheless.
+    seen_names (set):
+      Names of earlier batches of the same import, which count as repeated
+      names. Names of this batch are added to it.
 
-def add_json(json_file: str) -> tuple[None, str]:
-    """
-    Add questions to the database automatically by reading a JSON file.
-    Questions need to be enclosed in list brackets.
+    Returns a list with the result of check_question() for each question,
+    i.e. an empty dictionary for every correct question.
 
-    -------------------------------
-    Dependencies: re, json, pymongo
+    ----------------------
+    Dependencies: pymongo
     """
 
-    with open(json_file, 'r') as rf:
-        question_list = json.load(rf)
+    if seen_names is None:
+        seen_names = set()
+    return _check_duplicates(
+        questions, _validate_batch(questions), ignore_duplicates, seen_names
+    )
+
 
-    error_list = []
-    for q in question_list:
-        check_result = check_question(json.dumps(q))
+def _insert_checked(questions: list, results: list) -> int:
+    # Insert questions without errors and add insert errors to results
+    documents, indices = [], []
+    for i, (q, check_result) in enumerate(zip(questions, results)):
         if not check_result:
             # Check for empty img_files/tables fields
             if 'img_files' in q.keys() and q['img_files'] == []:
                 q.pop('img_files')
             if 'tables' in q.keys() and q['tables'] == {}:
                 q.pop('tables')
-            QUESTIONS.insert_one(q)
-        else:
-            error_list.append(check_result)
+            q.update(split_name(q['name']))
+            documents.append(q)
+            indices.append(i)
+    if not documents:
+        return 0
+    try:
+        QUESTIONS.insert_many(documents, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        for w in e.details['writeErrors']:
+            results[indices[w['index']]] = {
+                '__question_name__': documents[w['index']].get('name'),
+                'insert': w['errmsg']
+            }
+    # Imported names weren't allocated by new_question_name()
+    update_counters(q['name'] for q in documents)
+
+    return len(documents) - sum(bool(results[i]) for i in indices)
+
+
+def _write_errors(errors: list, wf) -> None:
+    # Errors are written as JSON list with one error per line
+    for error in errors:
+        wf.write('[\n' if wf.tell() == 0 else ',\n')
+        json.dump(error, wf, ensure_ascii=False)
+
+
+def iter_json_array(json_file: str, read_size: int = 1 << 20):
+    """
+    Parse the top-level list of a JSON file incrementally and yield its
+    entries one by one. Only the current part of the file is held in memory,
+    so large files can be processed with flat memory use.
+
+    Arguments:
+    ----------
+    json_file (str):
+      Path to JSON file containing a list.
+    read_size (int):
+      Number of characters read from the file at a time. Grows for entries
+      that don't fit.
+
+    ------------------
+    Dependencies: json
+    """
+
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'\s*')
+    number_end = re.compile(r'[\s0-9.eE+-]*')
+
+    with open(json_file, 'r') as rf:
+        buffer, pos, eof = '', 0, False
+
+        def read(size: int) -> None:
+            nonlocal buffer, pos, eof
+            chunk = rf.read(size)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            eof = not chunk
+
+        # Return next non-whitespace character or '' at end of file
+        def peek() -> str:
+            nonlocal pos
+            while True:
+                pos = whitespace.match(buffer, pos).end()
+                if pos < len(buffer) or eof:
+                    return buffer[pos:pos + 1]
+                read(read_size)
+
+        if peek() != '[':
+            raise ValueError(f'{json_file} does not contain a JSON list')
+        pos += 1
+        if peek() == ']':
+            return
+        while True:
+            peek()
+            while True:
+                try:
+                    entry, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    read(max(read_size, len(buffer) - pos))
+                    continue
+                # Numbers at the end of the buffer might continue
+                if not eof and number_end.match(buffer, end).end() == len(buffer):
+                    read(read_size)
+                    continue
+                break
+            pos = end
+            yield entry
+            match peek():
+                case ',':
+                    pos += 1
+                case ']':
+                    return
+                case _:
+                    raise json.JSONDecodeError(
+                        "Expecting ',' delimiter", buffer, pos
+                    )
 
-    if not error_list:
+
+def add_json(json_file: str, chunk_size: int = 1000, workers: int = None,
+             error_file: str = None) -> tuple[None, str]:
+    """
+    Add questions to the database automatically by reading a JSON file.
+    Questions need to be enclosed in list brackets. The file is parsed
+    incrementally and questions are checked and inserted in chunks, so memory
+    use stays flat for large files.
+
+    Arguments:
+    ----------
+    json_file (str):
+      Path to JSON file.
+    chunk_size (int):
+      Number of questions checked and inserted at a time.
+    workers (int):
+      If given, chunks are checked in a pool of this many processes while
+      earlier chunks are inserted.
+    error_file (str):
+      Path of JSON file the errors are written to. Only created if there are
+      errors. Defaults to '<json_file>-errors.json'.
+
+    Returns None if all questions were added, otherwise the path of the
+    error file.
+
+    ---------------------------------------------------------------
+    Dependencies: re, json, pymongo, itertools, ProcessPoolExecutor
+    """
+
+    if error_file is None:
+        error_file = os.path.splitext(json_file)[0] + '-errors.json'
+    entries = iter_json_array(json_file)
+    chunks = iter(lambda: list(itertools.islice(entries, chunk_size)), [])
+
+    def checked_chunks():
+        if not workers:
+            for chunk in chunks:
+                yield chunk, _validate_batch(chunk)
+            return
+        # Only a few chunks per worker are parsed ahead of insertion
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=pool_context()) as pool:
+            in_flight = deque()
+            for chunk in chunks:
+                in_flight.append((chunk, pool.submit(_validate_batch, chunk)))
+                if len(in_flight) >= workers * 2:
+                    chunk, future = in_flight.popleft()
+                    yield chunk, future.result()
+            while in_flight:
+                chunk, future = in_flight.popleft()
+                yield chunk, future.result()
+
+    n_read, n_added, n_errors = 0, 0, 0
+    first_errors = []
+    seen_names = set()
+    wf = None
+    try:
+        for chunk, results in checked_chunks():
+            results = _check_duplicates(chunk, results, False, seen_names)
+            n_added += _insert_checked(chunk, results)
+            errors = [r for r in results if r]
+            # Errors are written as they occur
+            if errors and wf is None:
+                wf = open(error_file, 'w')
+            _write_errors(errors, wf)
+            if len(first_errors) < 10:
+                first_errors += errors[:10 - len(first_errors)]
+            n_read += len(chunk)
+            n_errors += len(errors)
+            print(f'{n_read} questions read, {n_added} added, '
+                  f'{n_errors} with errors', end='\r', flush=True)
+    finally:
+        if wf is not None:
+            wf.write('\n]\n')
+            wf.close()
+    print()
+
+    return _report_errors(n_errors, first_errors, error_file)
+
+
+def _report_errors(n_errors: int, first_errors: list, error_file: str) -> tuple[None, str]:
+    # Final report of importers
+    if not n_errors:
         print('All questions added successfully!')
         return None
     else:
         print('Some questions could not be added due to errors:')
-        pprint(error_list)
-        return ''
+        pprint(first_errors)
+        if n_errors > len(first_errors):
+            print(f'... and {n_errors - len(first_errors)} more.')
+        print(f'All errors have been written to {error_file}')
+        return error_file
+
+
+# Columns of template sheets by expected value type
+TEXT_COLUMNS = [k for k, v in KEY_TYPES['general'].items() if v == str]
+JSON_COLUMNS = {
+    k for t in KEY_TYPES.values() for k, v in t.items() if v in (list, dict)
+}
+INT_COLUMNS = {k for t in KEY_TYPES.values() for k, v in t.items() if v == int}
+FLOAT_COLUMNS = {k for t in KEY_TYPES.values() for k, v in t.items() if v == float}
+
+
+def _decode_cell(value):
+    # Cells of JSON columns that can't be decoded are marked by None
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return None
+    return value
+
+
+def _add_table(df: pd.DataFrame, file_path: str, error_file: str) -> tuple[None, str]:
+    """
+    Add the rows of a sheet created from create_template() as questions.
+    JSON columns are decoded as a whole, then all questions are checked with
+    check_questions() and inserted with one insert_many().
+    Errors contain the row number of the sheet under '__row__'.
+
+    Arguments:
+    ----------
+    df (pd.DataFrame):
+      Sheet read with the template columns as header. Empty cells are NaN.
+    file_path (str):
+      Path of the sheet, used for the default error file.
+    error_file (str):
+      See 'add_json()'.
+
+    ---------------------------------------
+    Dependencies: pandas, numpy, json, os
+    """
+
+    if error_file is None:
+        error_file = os.path.splitext(file_path)[0] + '-errors.json'
+    df = df.rename(columns=str.strip).dropna(how='all')
+    # Header is row 1
+    rows = (df.index + 2).tolist()
+
+    # Decode JSON columns
+    invalid = pd.DataFrame(False, index=df.index, columns=df.columns)
+    for col in df.columns.intersection(list(JSON_COLUMNS)):
+        decoded = df[col].map(_decode_cell)
+        invalid[col] = decoded.isna() & df[col].notna()
+        df[col] = decoded
+
+    # Number columns with empty cells are read as float, so numbers are
+    # converted to the expected type. Empty cells are left out.
+    questions = []
+    for r in df.astype(object).to_dict('records'):
+        q = {'in_exams': {}}
+        for k, v in r.items():
+            if pd.api.types.is_scalar(v) and pd.isna(v):
+                continue
+            if k in INT_COLUMNS and type(v) == float and v.is_integer():
+                v = int(v)
+            elif k in FLOAT_COLUMNS and type(v) == int:
+                v = float(v)
+            q[k] = v
+        questions.append(q)
+
+    results = check_questions(questions)
+    for i, cols in enumerate(invalid.to_numpy()):
+        for col in df.columns[cols]:
+            results[i][col] = 'Invalid JSON'
+            results[i]['__question_name__'] = questions[i].get('name')
+    n_added = _insert_checked(questions, results)
+
+    errors = [
+        dict(sorted(dict(r, __row__=row).items()))
+        for r, row in zip(results, rows) if r
+    ]
+    print(f'{len(questions)} questions read, {n_added} added, '
+          f'{len(errors)} with errors')
+    if errors:
+        with open(error_file, 'w') as wf:
+            _write_errors(errors, wf)
+            wf.write('\n]\n')
+
+    return _report_errors(len(errors), errors[:10], error_file)
+
+
+def add_excel(file_path: str, sheet_name=0, error_file: str = None) -> tuple[None, str]:
+    """
+    Add questions to the database from an Excel sheet laid out like the
+    template of create_template(file_type='xls'). Cells of list and dict
+    fields contain JSON, e.g. '["X", "..."]'.
+
+    Arguments:
+    ----------
+    file_path (str):
+      Path to Excel file.
+    sheet_name (str or int):
+      Name or position of the sheet.
+    error_file (str):
+      See 'add_json()'.
+
+    Returns None if all questions were added, otherwise the path of the
+    error file.
+
+    --------------------------
+    Dependencies: pandas, json
+    """
+
+    df = pd.read_excel(
+        file_path, sheet_name=sheet_name, dtype={k: str for k in TEXT_COLUMNS},
+        keep_default_na=False, na_values=['']
+    )
+    return _add_table(df, file_path, error_file)
+
+
+def add_csv(file_path: str, sep: str = ',', error_file: str = None) -> tuple[None, str]:
+    """
+    Add questions to the database from a CSV file with the columns of the
+    template of create_template(file_type='xls'). Cells of list and dict
+    fields contain JSON, e.g. '["X", "..."]'.
+
+    Arguments:
+    ----------
+    file_path (str):
+      Path to CSV file.
+    sep (str):
+      Column separator.
+    error_file (str):
+      See 'add_json()'.
+
+    Returns None if all questions were added, otherwise the path of the
+    error file.
+
+    --------------------------
+    Dependencies: pandas, json
+    """
+
+    df = pd.read_csv(
+        file_path, sep=sep, dtype={k: str for k in TEXT_COLUMNS},
+        keep_default_na=False, na_values=['']
+    )
+    return _add_table(df, file_path, error_file)
 
 
 def create_template(file_path: str, file_type: str) -> None:
@@ -563,13 +812,10 @@ def add_question():
             i:parent_question[i] for i in parent_question if i != '_id'
         }
         # Adjust last two digits of question name
-        # --------------------------------------------
-        # Create search criterion based on parent name
-        q_name = re.compile(r'%s\d{2}' % (parent_name[:-2]))
-        # Look through collection
-        digits = [q['name'][-2:] for q in QUESTIONS.find({'name': q_name})]
-        digits.sort()
-        new_question['name'] = new_question['name'][:-2] + '%02d' % (int(digits[-1])+1)
+        new_question['name'] = new_question_name(None, 'child', parent_name)
+        new_question.update(split_name(new_question['name']))
+        # The name may have been changed while inspecting properties
+        update_counters([new_question['name']])
         result = QUESTIONS.insert_one(new_question)
     else:
         # Create general question template
@@ -591,15 +837,7 @@ def add_question():
         else:
             category = input("Please specify question's category: ")
         # Determine new question's name
-        last_question = 0
-        for q in QUESTIONS.find({'name': re.compile(category)}):
-            q_number = int(q['name'][-4:-2])
-            if q_number > last_question:
-                last_question = q_number
-        if family_type == 'parent':
-            new_question['name'] = category + '%.2d' % (last_question+1) + '00'
-        else:
-            new_question['name'] = category + '%.2d' % (last_question+1) + '99'
+        new_question['name'] = new_question_name(category, family_type)
         # Ask for moodle_type to determine needed sub-function
         available_moodle_types = [
             'multichoice', 'numerical', 'essay', 'matching',
@@ -627,6 +865,9 @@ def add_question():
             if yesno(prompt) == 'n':
                 new_question['single'] = False
         # Add question to collection
+        new_question.update(split_name(new_question['name']))
+        # The name may have been changed while inspecting properties
+        update_counters([new_question['name']])
         result = QUESTIONS.insert_one(new_question)
     # Summary
     if type(result) == pymongo.results.InsertManyResult:
@@ -662,6 +903,13 @@ def edit_question(question, edits={}, history=False):
     Dependencies: config, core, time
     """
 
+    # Name parts, exam entries and counters are updated along with the name
+    def set_field(k, v) -> dict:
+        if k == 'name':
+            EXAM_QUESTIONS.update_many({'question': question}, {'$set': {'question': v}})
+            update_counters([v])
+        return {'$set': {k: v, **(split_name(v) if k == 'name' else {})}}
+
     if edits:
         if history:
             # Get old or create new history field
@@ -691,12 +939,12 @@ def edit_question(question, edits={}, history=False):
                     {'name': question}, {'$set': {'history': history_dict}}
                 )
                 QUESTIONS.find_one_and_update(
-                    {'name': question}, {'$set': {k: v}}
+                    {'name': question}, set_field(k, v)
                 )
         else:
             for k,v in edits.items():
                 QUESTIONS.find_one_and_update(
-                    {'name': question}, {'$set': {k: v}}
+                    {'name': question}, set_field(k, v)
                 )
     # Manual editing
     else:
@@ -736,9 +984,14 @@ def edit_question(question, edits={}, history=False):
                     {'name': question}, {'$set': {'history': history_dict}}
                     )
                 QUESTIONS.find_one_and_update(
-                    {'name': question}, {'$set': {field: q_dict[field]}}
+                    {'name': question}, set_field(field, q_dict[field])
                 )
             field = input('Edit field: ')
+    QUESTION_CACHE.invalidate(question)
+    # Relative scores depend on points and stats are kept by name
+    update_question_stats(
+        {question, edits.get('name', question) if edits else q_dict['name']}
+    )
 
 
 def remove_question(question, archive=False):
@@ -764,6 +1017,10 @@ def remove_question(question, archive=False):
         q.pop('_id')
         DB.archive.insert_one(q)
         result = QUESTIONS.delete_one({'name': question})
+    QUESTION_CACHE.invalidate(question)
+    # Deleted questions don't count as exam questions anymore
+    EXAM_QUESTIONS.delete_many({'question': question})
+    update_question_stats([question])
     if result.deleted_count:
         print('Question successfully removed.')
     else:
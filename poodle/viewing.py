@@ -1,4 +1,5 @@
 from config import *
+from core import overview_matrix
 import gui.windows
 
 from pprint import pprint
@@ -103,26 +104,18 @@ def export_overview(path=BASE_PATH, filename='overview', candidates=None):
       next exam and will exclude questions that appeared in the last exam or in
       the mock exam.
 
-    ---------------------------
-    Dependencies: numpy, pandas
+    --------------------------
+    Dependencies: core, pandas
     """
 
     # Generate dataframe
-    exam_list = sorted([e['name'] for e in EXAMS.find()])
-    data = pd.DataFrame(sorted(
-        [
-            [q['name'], q['difficulty'], q['time_est']] +
-            [np.round(q['in_exams'][e] / q['points'], 2)
-             if e in q['in_exams'] else '.' for e in exam_list
-            ]
-            for q in QUESTIONS.find() if q['name'][-2:] != '00'
-        ]),
-        columns = ['question', 'difficulty', 'time'] + exam_list
-    )
-    appeared = pd.DataFrame(np.array(
-        [[int(type(e) == float) for e in data[q]] for q in exam_list]).T
-    )
-    data.insert(1, 'appearances', appeared.sum(axis=1))
+    names, difficulty, time_est, exam_list, cells = overview_matrix()
+    data = pd.concat([
+        pd.DataFrame({'question': names, 'difficulty': difficulty, 'time': time_est}),
+        pd.DataFrame(cells, columns=exam_list)
+    ], axis=1)
+    appeared = exam_appearances()
+    data.insert(1, 'appearances', [appeared.get(q, 0) for q in data['question']])
 
     if candidates:
         data = data[(data['mock'] == '.') & (data[exam_list[-2]] == '.')]
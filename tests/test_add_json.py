@@ -0,0 +1,167 @@
+import context
+import config
+import question
+from question import add_json, add_csv, iter_json_array
+
+import copy
+import json
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+import mongomock
+import pandas as pd
+
+
+VALID = {
+    'name': 'A0199', 'question': 'Text', 'family_type': 'single',
+    'moodle_type': 'multichoice', 'points': 1.0, 'in_exams': {},
+    'time_est': 1, 'difficulty': 1, 'correct_answers': ['a'],
+    'false_answers': ['b'], 'single': 1, 'img_files': [], 'tables': {}
+}
+
+
+class TestIterJsonArray(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, 'questions.json')
+
+    def parse(self, text, read_size):
+        with open(self.path, 'w') as wf:
+            wf.write(text)
+        return list(iter_json_array(self.path, read_size))
+
+    def test_small_reads(self):
+        data = [{'a': [1, 2.5e-07, 'x, ]'], 'b': None}, -123456789, 1.5, True, [], {}]
+        for text in [json.dumps(data), json.dumps(data, indent=2)]:
+            for read_size in (1, 2, 5, 1 << 20):
+                self.assertEqual(self.parse(text, read_size), data)
+
+    def test_empty(self):
+        self.assertEqual(self.parse(' [ ] ', 1), [])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.parse('{"a": 1}', 4)
+        with self.assertRaises(json.JSONDecodeError):
+            self.parse('[1, 2', 4)
+        with self.assertRaises(json.JSONDecodeError):
+            self.parse('[1 2]', 4)
+
+
+class TestAddJson(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, 'questions.json')
+        self.collection = mongomock.MongoClient().db.questions
+        self.collection.insert_one(dict(VALID, name='A0099'))
+        for target, value in [('QUESTIONS', self.collection), ('Q_CATEGORIES', ['A'])]:
+            patcher = patch.object(question, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.counters = mongomock.MongoClient().db.counters
+        patcher = patch.object(config, 'COUNTERS', self.counters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, questions):
+        with open(self.path, 'w') as wf:
+            json.dump(questions, wf)
+
+    def test_all_added(self):
+        self.write([dict(VALID, name=f'A{i:02d}99') for i in range(1, 8)])
+        self.assertIsNone(add_json(self.path, chunk_size=3))
+        self.assertEqual(self.collection.count_documents({}), 8)
+        self.assertNotIn('img_files', self.collection.find_one({'name': 'A0199'}))
+        self.assertEqual(self.counters.find_one({'_id': 'family:A'})['seq'], 7)
+
+    def test_error_file(self):
+        questions = [dict(VALID, name=f'A{i:02d}99') for i in range(1, 6)]
+        questions += [dict(VALID, name='A0099'), dict(VALID, name='A0199'),
+                      dict(VALID, name='A0999', points=0.), 'text']
+        self.write(questions)
+        for workers in (None, 2):
+            with self.subTest(workers=workers):
+                self.collection.delete_many({'name': {'$ne': 'A0099'}})
+                error_file = add_json(self.path, chunk_size=2, workers=workers)
+                self.assertEqual(error_file, os.path.join(self.dir.name, 'questions-errors.json'))
+                with open(error_file) as rf:
+                    errors = json.load(rf)
+                self.assertEqual([e['__question_name__'] for e in errors],
+                                 ['A0099', 'A0199', 'A0999', None])
+                self.assertEqual(errors[1]['name'], 'Name occurs more than once in batch.')
+                self.assertEqual(self.collection.count_documents({}), 6)
+
+
+class TestAddCsv(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, 'questions.csv')
+        self.collection = mongomock.MongoClient().db.questions
+        for target, value in [('QUESTIONS', self.collection), ('Q_CATEGORIES', ['A'])]:
+            patcher = patch.object(question, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.counters = mongomock.MongoClient().db.counters
+        patcher = patch.object(config, 'COUNTERS', self.counters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def row(self, **fields):
+        # Cells as written by create_template()
+        row = {
+            'name': 'A0199', 'moodle_type': 'multichoice', 'family_type': 'single',
+            'points': 1, 'difficulty': 1, 'time_est': 2, 'img_files': '[]',
+            'tables': '{}', 'question': 'NA', 'correct_answers': '["a"]',
+            'false_answers': '["b"]', 'single': 1, 'tolerance': '', 'vars': ''
+        }
+        row.update(fields)
+        return row
+
+    def test_types(self):
+        pd.DataFrame([
+            self.row(),
+            self.row(name='A0299', moodle_type='calculated', single='',
+                     correct_answers='["{a}"]', false_answers='',
+                     tolerance='[0.1, "relative", 2]', vars='["a"]'),
+            self.row(name='A0399', moodle_type='numerical', single='',
+                     correct_answers='["1"]', false_answers='', tolerance='0.5')
+        ]).to_csv(self.path, index=False)
+        self.assertIsNone(add_csv(self.path))
+        q = self.collection.find_one({'name': 'A0199'}, {'_id': 0})
+        self.assertEqual(q, {
+            'name': 'A0199', 'moodle_type': 'multichoice', 'family_type': 'single',
+            'points': 1.0, 'difficulty': 1, 'time_est': 2, 'question': 'NA',
+            'correct_answers': ['a'], 'false_answers': ['b'], 'single': 1,
+            'in_exams': {}, 'category': 'A', 'family_no': 1, 'child_no': 99
+        })
+        self.assertEqual(type(q['single']), int)
+        self.assertEqual(self.collection.find_one({'name': 'A0299'})['tolerance'],
+                         [0.1, 'relative', 2])
+        self.assertEqual(self.collection.find_one({'name': 'A0399'})['tolerance'], 0.5)
+
+    def test_row_numbers(self):
+        pd.DataFrame([
+            self.row(), self.row(correct_answers='[a]'), self.row(name='A0299', points=0)
+        ]).to_csv(self.path, index=False)
+        with open(add_csv(self.path)) as rf:
+            errors = json.load(rf)
+        self.assertEqual(errors, [
+            {'__question_name__': 'A0199', '__row__': 3,
+             'correct_answers': 'Invalid JSON',
+             'name': 'Name occurs more than once in batch.'},
+            {'__question_name__': 'A0299', '__row__': 4,
+             'points': 'Value needs to be > 0'}
+        ])
+        self.assertEqual(self.collection.count_documents({}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import context
+import core
+from core import CalculatedQuestion, plan_shared_datasets
+
+import numpy as np
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestCountDecimals(TestCase):
+
+    def test_integers(self):
+        self.assertEqual(CalculatedQuestion.count_decimals(np.arange(5)), 0)
+        self.assertEqual(CalculatedQuestion.count_decimals(np.array([1., 2., 1e30])), 0)
+
+    def test_plain(self):
+        self.assertEqual(CalculatedQuestion.count_decimals(np.array([1.5, -2.125, 3.])), 3)
+        self.assertEqual(CalculatedQuestion.count_decimals([0.1, 2]), 1)
+
+    def test_scientific(self):
+        self.assertEqual(CalculatedQuestion.count_decimals(np.array([1e-7, 0.5])), 6)
+
+
+class TestDatasetItems(TestCase):
+
+    def test_values(self):
+        items = CalculatedQuestion.dataset_items(np.array([1.5, 2.25]), 2)
+        self.assertEqual(items.tag, 'dataset_items')
+        self.assertEqual([i.findtext('number') for i in items], ['1', '2'])
+        self.assertEqual([i.findtext('value') for i in items], ['1.5', '2.25'])
+
+    def test_integral(self):
+        items = CalculatedQuestion.dataset_items(np.array([1., 2.]), 0)
+        self.assertEqual([i.findtext('value') for i in items], ['1', '2'])
+
+
+class TestPlanSharedDatasets(TestCase):
+
+    values = {
+        'A0100': {'a': np.arange(3), 'b': np.arange(3)},
+        'A0101': {'a': np.arange(3), 'b': np.arange(4)},
+        'A0102': {'a': np.arange(3), 'c': np.arange(3)},
+    }
+
+    def setUp(self):
+        patcher = patch.object(core.RANDOM_VARS, 'get',
+                               side_effect=lambda name, variables: self.values[name])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_plan(self):
+        q_dicts = [
+            {'name': n, 'moodle_type': 'calculated', 'vars': list(v)}
+            for n, v in self.values.items()
+        ]
+        q_dicts.append({'name': 'A0199', 'moodle_type': 'multichoice'})
+        self.assertEqual(plan_shared_datasets(q_dicts), {
+            'A0100': {'a': True},
+            'A0101': {'a': False},
+            'A0102': {'a': False}
+        })
+
+    def test_name_collision(self):
+        # Two groups of equal values under the same name
+        self.values = {
+            'X0101': {'a': np.arange(3), 'b': np.arange(2)},
+            'X0102': {'a': np.arange(3), 'b': np.arange(2)},
+            'X0103': {'a': np.arange(5)},
+            'X0104': {'a': np.arange(5)},
+        }
+        q_dicts = [
+            {'name': n, 'moodle_type': 'calculated', 'vars': list(v)}
+            for n, v in self.values.items()
+        ]
+        self.assertEqual(plan_shared_datasets(q_dicts), {
+            'X0101': {'b': True},
+            'X0102': {'b': False}
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import context
+import question
+from question import check_question, check_questions, compile_rule, VALIDATORS
+
+import copy
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+import mongomock
+
+
+VALID = {
+    'name': 'A0199', 'question': 'Text', 'family_type': 'single',
+    'moodle_type': 'multichoice', 'points': 1.0, 'in_exams': {},
+    'time_est': 1, 'difficulty': 1, 'correct_answers': ['a'],
+    'false_answers': ['b'], 'single': 1
+}
+
+
+class TestCheckQuestions(TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.questions
+        self.collection.insert_one(dict(VALID, name='A0099'))
+        for target, value in [('QUESTIONS', self.collection), ('Q_CATEGORIES', ['A'])]:
+            patcher = patch.object(question, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make(self, **fields):
+        q = copy.deepcopy(VALID)
+        q.update(fields)
+        return q
+
+    def test_valid(self):
+        self.assertEqual(check_questions([self.make(), self.make(name='A0299')]), [{}, {}])
+
+    def test_existing_name(self):
+        result = check_questions([self.make(name='A0099')])
+        self.assertEqual(result[0]['name'], 'Name already exists in database.')
+
+    def test_batch_duplicate(self):
+        result = check_questions([self.make(), self.make(), self.make()])
+        self.assertEqual(result[0], {})
+        for r in result[1:]:
+            self.assertEqual(r['name'], 'Name occurs more than once in batch.')
+
+    def test_single_query(self):
+        with patch.object(self.collection, 'find_one', side_effect=AssertionError):
+            check_questions([self.make(name=f'A{i:02d}99') for i in range(20)])
+
+    def test_errors(self):
+        result = check_questions([self.make(points=0.), self.make(name='A0299', moodle_type='x'), 'text'])
+        self.assertEqual(result[0], {'__question_name__': 'A0199', 'points': 'Value needs to be > 0'})
+        self.assertEqual(result[1]['moodle_type'], 'Unknown')
+        self.assertEqual(result[2]['question'], 'Not a JSON object')
+
+    def test_json_string(self):
+        self.assertEqual(check_question('{"name": "A0299", "moodle_type": "x"}'),
+                         {'__question_name__': 'A0299', 'moodle_type': 'Unknown'})
+
+
+class TestValidators(TestCase):
+
+    def setUp(self):
+        patcher = patch.object(question, 'Q_CATEGORIES', ['A'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make(self, **fields):
+        q = dict(copy.deepcopy(VALID), moodle_type='ddimageortext',
+                 correct_answers=['a', 'b'], img_files=['x.png'],
+                 drops={'1': [1, 2], '2': [3, 4]})
+        q.update(fields)
+        return q
+
+    def test_compiled_per_type(self):
+        self.assertEqual(set(VALIDATORS), set(question.KEY_TYPES) - {'general', 'optional'})
+        self.assertEqual(VALIDATORS['ddimageortext'](self.make()), {})
+
+    def test_type_rules(self):
+        check = VALIDATORS['ddimageortext']
+        self.assertEqual(check(self.make(drops={'1': [1, 2], '2': [3]})),
+                         {'drops.2': 'Wrong number of entries. (Required: 2)'})
+        self.assertEqual(check(self.make(correct_answers=['a', 'b', 'c'])),
+                         {'drops': 'Wrong number of entries. (Required: 3)'})
+        self.assertEqual(check(self.make(img_files='', family_type='x')), {
+            'family_type': "x not in  possible options: ['single', 'parent', 'child']",
+            'img_files': "Wrong data type. Expected: <class 'list'>"
+        })
+
+    def test_missing_name(self):
+        q = self.make()
+        del q['name']
+        self.assertEqual(check_question(q, existing_names=set()),
+                         {'__question_name__': None, 'name': 'Missing'})
+
+    def test_unknown_rule(self):
+        with self.assertRaises(Exception):
+            compile_rule(('length', 'drops', 2, 'max'))
+        with self.assertRaises(Exception):
+            compile_rule(('unknown', 'drops'))
+
+
+if __name__ == '__main__':
+    unittest.main()
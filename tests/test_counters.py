@@ -0,0 +1,73 @@
+import context
+import config
+import question
+from config import update_counters, new_question_name, split_name
+
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+import mongomock
+
+
+class TestCounters(TestCase):
+
+    def setUp(self):
+        self.counters = mongomock.MongoClient().db.counters
+        patcher = patch.object(config, 'COUNTERS', self.counters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_new_category(self):
+        self.assertEqual(new_question_name('AB', 'single'), 'AB0199')
+        self.assertEqual(new_question_name('AB', 'parent'), 'AB0200')
+        self.assertEqual(new_question_name('C', 'single'), 'C0199')
+
+    def test_children(self):
+        self.assertEqual(new_question_name(None, 'child', 'AB0300'), 'AB0301')
+        self.assertEqual(new_question_name(None, 'child', 'AB0300'), 'AB0302')
+        self.assertEqual(new_question_name(None, 'child', 'AB0400'), 'AB0401')
+
+    def test_backfill(self):
+        update_counters(['AB0199', 'AB0500', 'AB0503', 'AB0501', 'AB0299', 'X', None, 'ABCD99'])
+        self.assertEqual(new_question_name('AB', 'single'), 'AB0699')
+        self.assertEqual(new_question_name(None, 'child', 'AB0500'), 'AB0504')
+        self.assertEqual(new_question_name(None, 'child', 'AB0200'), 'AB0201')
+        # Counters never decrease
+        update_counters(['AB0199'])
+        self.assertEqual(new_question_name('AB', 'parent'), 'AB0700')
+
+    def test_limit(self):
+        update_counters(['AB9999', 'AB0198'])
+        with self.assertRaises(Exception):
+            new_question_name('AB', 'single')
+        with self.assertRaises(Exception):
+            new_question_name(None, 'child', 'AB0100')
+
+    def test_renamed(self):
+        db = mongomock.MongoClient().db
+        db.questions.insert_one({'name': 'AB0199', 'points': 1.0, 'in_exams': {}})
+        for module in (config, question):
+            for target in ['QUESTIONS', 'EXAMS', 'EXAM_QUESTIONS', 'QUESTION_STATS']:
+                patcher = patch.object(module, target, db[target.lower()])
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        question.edit_question('AB0199', {'name': 'AB0599'})
+        self.assertEqual(db.questions.find_one()['family_no'], 5)
+        self.assertEqual(new_question_name('AB', 'single'), 'AB0699')
+
+
+class TestSplitName(TestCase):
+
+    def test_parts(self):
+        self.assertEqual(split_name('AB0102'),
+                         {'category': 'AB', 'family_no': 1, 'child_no': 2})
+        self.assertEqual(split_name('A9900')['child_no'], 0)
+
+    def test_invalid(self):
+        for name in ['0102', 'AB01x2', None, 12345]:
+            self.assertEqual(split_name(name),
+                             {'category': None, 'family_no': None, 'child_no': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,392 @@
+import context
+import config
+import core
+import exam
+from core import create_xml, render_key, FragmentCache, RandomVars, ImageCache, ImageOptimizer
+
+import io
+import os
+import json
+import tempfile
+import unittest
+import zipfile
+from unittest import TestCase
+from unittest.mock import patch
+from contextlib import redirect_stdout
+from lxml import etree as ET
+from PIL import Image
+import mongomock
+
+
+class ExportTestCase(TestCase):
+
+    exam = 'exam'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = db_path = os.path.join(tmp.name, 'databases', core.DB.name)
+        self.directory = os.path.join(db_path, 'exams', self.exam)
+        for d in ['exams', 'img', 'random_vars']:
+            os.makedirs(os.path.join(db_path, d))
+        for target, value in [
+            ('BASE_PATH', tmp.name),
+            ('FRAGMENT_CACHE', FragmentCache(os.path.join(db_path, 'exams', '.cache')))
+        ]:
+            patcher = patch.object(core, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.q_dicts = {
+            f'X0{i}99': {
+                'name': f'X0{i}99', 'question': f'Question {i}', 'family_type': 'single',
+                'moodle_type': 'multichoice', 'points': 1.0, 'time_est': 1,
+                'difficulty': 1, 'correct_answers': [f'a{i}'],
+                'false_answers': ['b', 'c'], 'single': 1
+            } for i in range(1, 7)
+        }
+
+    def export(self, filename='import.xml', **options):
+        return create_xml(self.exam, filename, mode='gui', questions=list(self.q_dicts),
+                          q_dicts=self.q_dicts, message=False, **options)
+
+    def read(self, filename):
+        with open(os.path.join(self.directory, filename), 'rb') as rf:
+            return rf.read()
+
+    def question_names(self, filename):
+        root = ET.fromstring(self.read(filename))
+        return [q.findtext('name/text') for q in root.iter('question')
+                if q.get('type') != 'category']
+
+
+class TestDeltaExport(ExportTestCase):
+
+    def manifest(self):
+        with open(os.path.join(self.directory, '.delta.json'), 'r') as rf:
+            return json.load(rf)
+
+    def test_first_export(self):
+        self.export(delta=True)
+        self.assertEqual(self.question_names('import.xml'), list(self.q_dicts))
+        manifest = self.manifest()
+        self.assertEqual(manifest['files'], ['import.xml'])
+        self.assertEqual(manifest['questions'],
+                         {q: render_key(d) for q, d in self.q_dicts.items()})
+
+    def test_unchanged(self):
+        self.export(delta=True)
+        self.export(delta=True)
+        self.assertNotIn('import-1.xml', os.listdir(self.directory))
+
+    def test_changed(self):
+        self.export(delta=True)
+        previous = self.manifest()['questions']
+        self.q_dicts['X0299'] = dict(self.q_dicts['X0299'], question='Changed')
+        self.export(delta=True)
+        self.assertEqual(self.question_names('import-1.xml'), ['X0299'])
+        questions = self.manifest()['questions']
+        self.assertNotEqual(questions['X0299'], previous['X0299'])
+        self.assertEqual({q: h for q, h in questions.items() if q != 'X0299'},
+                         {q: h for q, h in previous.items() if q != 'X0299'})
+        # Nothing left to export afterwards
+        self.export(delta=True)
+        self.assertNotIn('import-2.xml', os.listdir(self.directory))
+
+    def test_render_version(self):
+        self.export(delta=True)
+        with patch.object(core, 'RENDER_VERSION', core.RENDER_VERSION + 1):
+            self.export(delta=True)
+        self.assertEqual(self.question_names('import-1.xml'), list(self.q_dicts))
+
+    def test_split_manifest(self):
+        # The split manifest of 'export.xml' is export-manifest.json
+        self.export('export.xml', max_bytes=2500, delta=True)
+        with open(os.path.join(self.directory, 'export-manifest.json'), 'r') as rf:
+            parts = json.load(rf)['parts']
+        self.assertEqual([q for p in parts for q in p['questions']], list(self.q_dicts))
+        self.assertEqual(self.manifest()['files'], [p['file'] for p in parts])
+        self.assertEqual(set(self.manifest()['questions']), set(self.q_dicts))
+
+
+class TestStreamedExport(ExportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Left out of the export by both
+        self.q_dicts['X0799'] = dict(self.q_dicts['X0199'], name='X0799')
+        del self.q_dicts['X0799']['correct_answers']
+
+    def test_identical(self):
+        with redirect_stdout(io.StringIO()):
+            self.export()
+            self.export(stream=True)
+        self.assertEqual(self.read('import.xml'), self.read('import-1.xml'))
+        self.assertEqual(self.question_names('import.xml'), list(self.q_dicts)[:-1])
+
+    def test_identical_parts(self):
+        with redirect_stdout(io.StringIO()):
+            self.export('a.xml', max_bytes=2500)
+            self.export('b.xml', max_bytes=2500, stream=True)
+        parts = sorted(f for f in os.listdir(self.directory)
+                       if f.startswith('a-') and f.endswith('.xml'))
+        self.assertGreater(len(parts), 2)
+        for part in parts:
+            self.assertEqual(self.read(part), self.read('b' + part[1:]))
+
+
+class TestParallelRendering(ExportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.q_dicts.update({
+            f'X{i}99': dict(self.q_dicts['X0199'], name=f'X{i}99', question=f'Question {i}')
+            for i in range(10, 40)
+        })
+        # Left out of the export regardless of workers
+        del self.q_dicts['X1599']['correct_answers']
+
+    def test_order(self):
+        q_dicts = list(self.q_dicts.values())
+        expected = [core._render_worker(q) for q in q_dicts]
+        self.assertIsNone(expected[list(self.q_dicts).index('X1599')])
+        for workers in (2, 3):
+            self.assertEqual(list(core.render_parallel(q_dicts, workers)), expected)
+
+    def test_identical(self):
+        files = []
+        for workers in (None, 2, 4):
+            # Every export has to render all questions
+            core.FRAGMENT_CACHE.clear()
+            with patch.object(core, 'render_parallel', wraps=core.render_parallel) as parallel, \
+                 redirect_stdout(io.StringIO()) as out:
+                self.export(f'workers-{workers or 1}.xml', workers=workers)
+            self.assertEqual(parallel.called, workers is not None)
+            self.assertEqual(out.getvalue(), 'Question X1599 has errors!\n')
+            files.append(self.read(f'workers-{workers or 1}.xml'))
+        self.assertEqual(files[1], files[0])
+        self.assertEqual(files[2], files[0])
+
+
+class TestSharedDatasets(ExportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rv_dir = os.path.join(self.db_path, 'random_vars')
+        self.q_dicts = {}
+        for i in (1, 2, 3):
+            name = f'X0{i}00'
+            self.q_dicts[name] = {
+                'name': name, 'question': f'What is {{a}} + {i}?', 'family_type': 'single',
+                'moodle_type': 'calculated', 'points': 1.0, 'time_est': 1,
+                'difficulty': 1, 'correct_answers': [f'{{a}} + {i}'],
+                'tolerance': [0.1, 'relative', 2], 'vars': ['a']
+            }
+            with open(os.path.join(rv_dir, f'rv_{name}.py'), 'w') as wf:
+                wf.write('import numpy as np\na = np.arange(5.)\n')
+        random_vars = RandomVars(rv_dir)
+        self.addCleanup(random_vars.close)
+        patcher = patch.object(core, 'RANDOM_VARS', random_vars)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def items(self, filename):
+        # Number of dataset items written per question
+        root = ET.fromstring(self.read(filename))
+        return {q.findtext('name/text'): len(q.findall('.//dataset_item'))
+                for q in root.iter('question') if q.get('type') == 'calculated'}
+
+    def test_planned(self):
+        self.export(shared_datasets=True)
+        self.assertEqual(self.items('import.xml'), {'X0100': 5, 'X0200': 0, 'X0300': 0})
+
+    def test_first_with_errors(self):
+        del self.q_dicts['X0100']['tolerance']
+        for workers in (None, 2):
+            with redirect_stdout(io.StringIO()) as out:
+                self.export(f'workers-{workers or 1}.xml', shared_datasets=True,
+                            workers=workers)
+            self.assertEqual(out.getvalue(), 'Question X0100 has errors!\n')
+            self.assertEqual(self.items(f'workers-{workers or 1}.xml'),
+                             {'X0200': 5, 'X0300': 0})
+
+    def test_delta(self):
+        self.export(shared_datasets=True, delta=True)
+        self.q_dicts['X0300'] = dict(self.q_dicts['X0300'], question='Changed {a}')
+        self.export(shared_datasets=True, delta=True)
+        self.assertEqual(self.items('import-1.xml'), {'X0300': 5})
+        # The manifest keeps the planned documents
+        self.export(shared_datasets=True, delta=True)
+        self.assertNotIn('import-2.xml', os.listdir(self.directory))
+
+
+class TestImages(ExportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        img_dir = os.path.join(self.db_path, 'img')
+        optimizer = ImageOptimizer(os.path.join(img_dir, '.optimized'), max_dim=100)
+        for target, value in [('IMAGE_OPTIMIZER', optimizer),
+                              ('IMAGE_CACHE', ImageCache(optimizer=optimizer))]:
+            patcher = patch.object(core, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        Image.new('RGB', (400, 200), 'red').save(os.path.join(img_dir, 'a.png'))
+        with open(os.path.join(img_dir, 'bad.png'), 'wb') as wf:
+            wf.write(b'not an image')
+        self.q_dicts['X0199'].update(question='[[file1]]', img_files=['a.png'])
+        self.q_dicts['X0299'].update(question='[[file1]]', img_files=['bad.png'])
+
+    def test_unreadable_image(self):
+        with redirect_stdout(io.StringIO()) as out:
+            self.export()
+        self.assertEqual(out.getvalue(), 'Question X0299 has errors!\n')
+        names = self.question_names('import.xml')
+        self.assertIn('X0199', names)
+        self.assertNotIn('X0299', names)
+
+    def test_only_unreadable_image(self):
+        del self.q_dicts['X0199']
+        with redirect_stdout(io.StringIO()) as out:
+            self.export()
+        self.assertEqual(out.getvalue(), 'Question X0299 has errors!\n')
+        self.assertEqual(self.question_names('import.xml'), list(self.q_dicts)[1:])
+
+    def test_attach(self):
+        os.makedirs(os.path.join(self.db_path, 'img', 'sub'))
+        Image.new('RGB', (50, 50), 'blue').save(os.path.join(self.db_path, 'img', 'sub', 'c.png'))
+        self.q_dicts['X0299'].update(question='[[file1]] [[file2]] [[file1]]',
+                                     img_files=['a.png', 'sub/c.png'],
+                                     correct_answers=['[[file2]]'])
+        with redirect_stdout(io.StringIO()) as out:
+            self.export(images='attach', bundle=True, max_bytes=4000)
+        self.assertEqual(out.getvalue(), '')
+        parts = sorted(f for f in os.listdir(self.directory)
+                       if f.startswith('import-') and f.endswith('.xml'))
+        self.assertGreater(len(parts), 1)
+        questions = {q.findtext('name/text'): q for p in parts
+                     for q in ET.fromstring(self.read(p)).iter('question')}
+        # One attachment per referenced image, right after each text
+        for name, text_path, expected in [
+            ('X0199', 'questiontext/text', [('a.png', '/')]),
+            ('X0299', 'questiontext/text', [('a.png', '/'), ('c.png', '/sub/')]),
+            ('X0299', 'answer/text', [('c.png', '/sub/')])
+        ]:
+            text = questions[name].find(text_path)
+            self.assertNotIn('base64,', text.text)
+            files = []
+            for el in text.itersiblings():
+                if el.tag != 'file':
+                    break
+                self.assertEqual(el.get('encoding'), 'base64')
+                self.assertEqual(el.text, core.IMAGE_CACHE.get(
+                    os.path.join(self.db_path, 'img', el.get('path')[1:] + el.get('name'))
+                ))
+                files.append((el.get('name'), el.get('path')))
+            self.assertEqual(files, expected)
+        with zipfile.ZipFile(os.path.join(self.directory, 'import.zip')) as zf:
+            self.assertEqual(zf.namelist(), parts + ['img/a.png', 'img/sub/c.png'])
+            for p in parts:
+                self.assertEqual(zf.read(p), self.read(p))
+
+
+class TestCreateExams(ExportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rv_dir = os.path.join(self.db_path, 'random_vars')
+        for i in (1, 2):
+            name = f'X0{i}00'
+            self.q_dicts[name] = {
+                'name': name, 'question': 'What is {a} + {b}?', 'family_type': 'single',
+                'moodle_type': 'calculated', 'points': 1.0, 'time_est': 1,
+                'difficulty': 1, 'correct_answers': ['{a} + {b}'],
+                'tolerance': [0.1, 'relative', 2], 'vars': ['a', 'b']
+            }
+            with open(os.path.join(rv_dir, f'rv_{name}.py'), 'w') as wf:
+                wf.write('import numpy as np\na = np.arange(5.)\nb = np.arange(5.) / 2\n')
+        random_vars = RandomVars(rv_dir)
+        self.addCleanup(random_vars.close)
+        self.db = mongomock.MongoClient().db
+        self.db.questions.insert_many([dict(q) for q in self.q_dicts.values()])
+        for module in (config, core, exam):
+            for target in ['QUESTIONS', 'EXAMS', 'EXAM_QUESTIONS', 'QUESTION_STATS']:
+                patcher = patch.object(module, target, self.db[target.lower()])
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        for module in (core, exam):
+            for target, value in [('BASE_PATH', core.BASE_PATH),
+                                  ('FRAGMENT_CACHE', core.FRAGMENT_CACHE),
+                                  ('RANDOM_VARS', random_vars)]:
+                patcher = patch.object(module, target, value)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        self.exams = [
+            {'exam': 'main', 'questions': ['X0199', 'X0299', 'X0100', 'X0200']},
+            {'exam': 'resit', 'questions': ['X0299', 'X0399', 'X0100']}
+        ]
+
+    def create_exams(self, **options):
+        prerendered = []
+
+        def prerender(*args, **kwargs):
+            counts = core.prerender(*args, **kwargs)
+            prerendered.append(render.call_count)
+            return counts
+
+        with patch.object(core, '_render_worker', wraps=core._render_worker) as render, \
+             patch.object(exam, 'prerender', side_effect=prerender), \
+             redirect_stdout(io.StringIO()) as out:
+            results = exam.create_exams(self.exams, **options)
+        # Exports only reuse prerendered fragments
+        self.assertEqual(render.call_count, prerendered[0])
+
+        return results, render.call_count, out.getvalue()
+
+    def test_exams(self):
+        results, rendered, out = self.create_exams()
+        self.assertEqual(rendered, 5)
+        self.assertEqual([r['exam'] for r in results], ['main', 'resit'])
+        self.assertEqual([r['questions'] for r in results], [4, 3])
+        self.assertTrue(out.endswith('Database updated.\n'))
+        for e in self.exams:
+            self.exam = e['exam']
+            self.directory = os.path.join(self.db_path, 'exams', e['exam'])
+            self.assertEqual(self.question_names('import.xml'), e['questions'])
+            self.assertEqual(self.db.exams.find_one({'name': e['exam']})['questions'],
+                             e['questions'])
+            self.assertEqual(sorted(self.db.exam_questions.distinct('question', {'exam': e['exam']})),
+                             sorted(e['questions']))
+        self.assertEqual(config.exam_appearances()['X0299'], 2)
+
+    def test_shared_datasets(self):
+        # The calculated questions share datasets in main but not in resit
+        results, rendered, out = self.create_exams(shared_datasets=True)
+        self.assertEqual(rendered, 6)
+        self.assertFalse(any('error' in r for r in results))
+
+    def test_test_exams(self):
+        results, rendered, out = self.create_exams(test=True)
+        self.assertEqual(self.db.exams.count_documents({}), 0)
+        self.assertNotIn('Database updated.', out)
+
+    def test_duplicate_names(self):
+        self.exams[1]['exam'] = 'main'
+        with patch.object(exam, 'fetch_questions') as fetch_questions:
+            with self.assertRaises(Exception):
+                exam.create_exams(self.exams)
+        fetch_questions.assert_not_called()
+        self.assertFalse(os.path.exists(os.path.join(self.db_path, 'exams', 'main')))
+
+    def test_failure(self):
+        self.db.exams.insert_one({'name': 'resit'})
+        results, rendered, out = self.create_exams()
+        # Only the questions of main are rendered
+        self.assertEqual(rendered, 4)
+        self.assertNotIn('error', results[0])
+        self.assertIn('already exists', results[1]['error'])
+        self.assertIn('1 of 2 exam(s) failed: resit', out)
+        self.assertNotIn('Database updated.', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import context
+import config
+import core
+import exam
+import question
+from exam import register_exam, remove_exam
+
+import io
+import math
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+from contextlib import redirect_stdout
+import mongomock
+
+
+class TestExamQuestions(TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.db.questions.insert_many([
+            {'name': f'A0{i}99', 'in_exams': {}, 'points': float(i)} for i in range(1, 5)
+        ])
+        for module in (config, core, exam, question):
+            for target in ['QUESTIONS', 'EXAMS', 'EXAM_QUESTIONS', 'QUESTION_STATS']:
+                patcher = patch.object(module, target, self.db[target.lower()])
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        register_exam('e1', ['A0199', 'A0299'], (60, 1.0, 2.0))
+        register_exam('e2', ['A0299', 'A0399'], (60, 1.0, 2.0))
+
+    def test_register(self):
+        edges = list(self.db.exam_questions.find({'question': 'A0299'}))
+        self.assertEqual(sorted(e['exam'] for e in edges), ['e1', 'e2'])
+        self.assertTrue(all(math.isnan(e['score']) for e in edges))
+        self.assertEqual(sorted(self.db.questions.find_one({'name': 'A0299'})['in_exams']),
+                         ['e1', 'e2'])
+
+    def test_register_duplicates(self):
+        self.db.exam_questions.create_index([('exam', 1), ('question', 1)], unique=True)
+        register_exam('e3', ['A0199', 'A0499', 'A0199'], (60, 1.0, 2.0))
+        self.assertEqual(self.db.exams.find_one({'name': 'e3'})['questions'], ['A0199', 'A0499'])
+        self.assertEqual(sorted(self.db.exam_questions.distinct('question', {'exam': 'e3'})),
+                         ['A0199', 'A0499'])
+        self.assertEqual(config.exam_appearances()['A0199'], 2)
+
+    def test_appearances(self):
+        self.assertEqual(config.exam_appearances(), {'A0199': 1, 'A0299': 2, 'A0399': 1})
+        self.assertEqual(config.exam_appearances(['A0299', 'A0499']), {'A0299': 2})
+
+    def test_remove(self):
+        with patch.object(self.db.questions, 'update_many',
+                          wraps=self.db.questions.update_many) as update_many:
+            remove_exam('e1', message=False)
+        # Only questions of the exam are touched
+        self.assertEqual(sorted(update_many.call_args[0][0]['name']['$in']), ['A0199', 'A0299'])
+        self.assertEqual(self.db.exam_questions.count_documents({'exam': 'e1'}), 0)
+        self.assertEqual(self.db.questions.find_one({'name': 'A0199'})['in_exams'], {})
+        self.assertEqual(list(self.db.questions.find_one({'name': 'A0299'})['in_exams']), ['e2'])
+        self.assertEqual(config.exam_appearances(), {'A0299': 1, 'A0399': 1})
+
+    def test_remove_legacy(self):
+        # Exam without exam_questions entries, e.g. a failed backfill
+        self.db.exams.insert_one({'name': 'old', 'questions': ['A0499']})
+        self.db.questions.update_one({'name': 'A0499'}, {'$set': {'in_exams.old': 1.0}})
+        remove_exam('old', message=False)
+        self.assertEqual(self.db.questions.find_one({'name': 'A0499'})['in_exams'], {})
+
+    def test_create_existing(self):
+        # Nothing is written for an exam name that is taken
+        with patch.object(exam, 'create_xml') as create_xml, \
+             patch.object(exam, 'prerender') as prerender, \
+             redirect_stdout(io.StringIO()):
+            with self.assertRaises(Exception):
+                exam.create_exam('e1', mode='gui', questions=['A0499'], message=False)
+            results = exam.create_exams([{'exam': 'e2', 'questions': ['A0499']}])
+        create_xml.assert_not_called()
+        # Refused exams render nothing
+        self.assertEqual(prerender.call_args[0][0], [])
+        self.assertIn('already exists', results[0]['error'])
+
+    def test_stats(self):
+        stats = self.db.question_stats.find_one({'question': 'A0299'})
+        self.assertEqual(stats['appearances'], 2)
+        self.assertEqual(stats['last_exam'], 'e2')
+        self.assertIsNotNone(stats['last_used'])
+        self.assertIsNone(stats['score_mean'])
+        # Evaluated scores are relative to points, unevaluated ones are skipped
+        self.db.exam_questions.update_one({'exam': 'e1', 'question': 'A0299'},
+                                          {'$set': {'score': 1.0}})
+        self.assertEqual(config.update_question_stats(['A0299']), 1)
+        stats = self.db.question_stats.find_one({'question': 'A0299'})
+        self.assertEqual((stats['score_mean'], stats['score_min'], stats['score_max']),
+                         (0.5, 0.5, 0.5))
+        remove_exam('e2', message=False)
+        stats = self.db.question_stats.find_one({'question': 'A0299'})
+        self.assertEqual((stats['appearances'], stats['last_exam']), (1, 'e1'))
+        self.assertIsNone(self.db.question_stats.find_one({'question': 'A0399'}))
+
+    def test_remove_question(self):
+        with redirect_stdout(io.StringIO()):
+            question.remove_question('A0299')
+        self.assertEqual(self.db.exam_questions.count_documents({'question': 'A0299'}), 0)
+        self.assertEqual(config.exam_appearances(), {'A0199': 1, 'A0399': 1})
+
+    def test_rebuild(self):
+        self.db.question_stats.delete_many({})
+        self.db.question_stats.insert_one({'question': 'A0499', 'appearances': 3})
+        self.assertEqual(config.update_question_stats(), 3)
+        self.assertEqual(config.exam_appearances(), {'A0199': 1, 'A0299': 2, 'A0399': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
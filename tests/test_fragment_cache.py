@@ -0,0 +1,78 @@
+import context
+from core import FragmentCache, write_parts, quiz_header, QUIZ_FOOTER
+
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+
+
+class TestFragmentCache(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = FragmentCache(os.path.join(self.tmp.name, '.cache'), max_bytes=25)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get('abc'))
+        self.assertNotIn('abc', self.cache)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_hit(self):
+        self.cache.put('abc', b'<question/>\n')
+        self.assertIn('abc', self.cache)
+        self.assertEqual(self.cache.get('abc'), b'<question/>\n')
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_eviction(self):
+        for i in range(5):
+            self.cache.put(str(i), b'<question/>\n')
+        self.cache.evict()
+        self.assertEqual(len(os.listdir(self.cache.cache_dir)), 2)
+
+    def test_clear(self):
+        self.cache.put('abc', b'<question/>\n')
+        self.cache.clear()
+        self.assertNotIn('abc', self.cache)
+
+
+class TestWriteParts(TestCase):
+
+    info = (10, 2.0, 5.0)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.overhead = len(quiz_header('exam', self.info)) + len(QUIZ_FOOTER)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, fragments, max_bytes):
+        return write_parts(self.tmp.name, 'import', 'exam', self.info,
+                           fragments, max_bytes)
+
+    def test_budget(self):
+        fragments = [(f'q{i}', b'x' * 100) for i in range(5)]
+        parts = self.write(fragments, self.overhead + 250)
+        self.assertEqual([p['questions'] for p in parts],
+                         [['q0', 'q1'], ['q2', 'q3'], ['q4']])
+        for p in parts:
+            path = os.path.join(self.tmp.name, p['file'])
+            self.assertEqual(os.path.getsize(path), p['bytes'])
+            self.assertLessEqual(p['bytes'], self.overhead + 250)
+
+    def test_oversized(self):
+        parts = self.write([('q0', b'x' * 10), ('q1', b'x' * 500), ('q2', b'x')],
+                           self.overhead + 100)
+        self.assertEqual([p['questions'] for p in parts], [['q0'], ['q1'], ['q2']])
+
+    def test_empty(self):
+        parts = self.write([], 1)
+        self.assertEqual(parts[0]['file'], 'import-1.xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
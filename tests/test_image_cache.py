@@ -0,0 +1,138 @@
+import context
+from core import ImageCache, ImageOptimizer
+from PIL import Image
+
+import os
+import time
+import base64
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestImageCache(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.img = os.path.join(self.tmp.name, 'a.png')
+        with open(self.img, 'wb') as wf:
+            wf.write(b'first')
+        self.cache_dir = os.path.join(self.tmp.name, '.cache')
+        self.cache = ImageCache(self.cache_dir, max_bytes=2**20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_encoding(self):
+        self.assertEqual(self.cache.get(self.img), base64.b64encode(b'first').decode())
+
+    def test_memory_hit(self):
+        self.cache.get(self.img)
+        self.cache.get(self.img)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_changed_file(self):
+        self.cache.get(self.img)
+        time.sleep(0.01)
+        with open(self.img, 'wb') as wf:
+            wf.write(b'second file')
+        self.assertEqual(self.cache.get(self.img), base64.b64encode(b'second file').decode())
+
+    def test_persistence(self):
+        self.cache.get(self.img)
+        self.cache.release()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        other = ImageCache(self.cache_dir)
+        expected = base64.b64encode(b'first').decode()
+        # Served from disk without encoding again
+        with patch('core.base64.b64encode', side_effect=AssertionError):
+            self.assertEqual(other.get(self.img), expected)
+
+    def test_atomic_write(self):
+        # Concurrent exports must never read a partially written encoding
+        with patch('core.os.replace', wraps=os.replace) as replace:
+            self.cache.get(self.img)
+        tmp_path, disk_path = replace.call_args[0]
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(disk_path)])
+        self.assertFalse(os.path.exists(tmp_path))
+        with open(disk_path, 'r') as rf:
+            self.assertEqual(rf.read(), base64.b64encode(b'first').decode())
+
+    def test_prefetch(self):
+        paths = []
+        for i in range(5):
+            paths.append(os.path.join(self.tmp.name, f'{i}.png'))
+            with open(paths[-1], 'wb') as wf:
+                wf.write(bytes([i]) * 10)
+        self.cache.prefetch(paths + [paths[0]])
+        self.assertEqual(self.cache.misses, 5)
+        for p in paths:
+            self.cache.get(p)
+        self.assertEqual(self.cache.hits, 5)
+
+    def test_eviction(self):
+        self.cache.max_bytes = 30
+        for i in range(5):
+            path = os.path.join(self.tmp.name, f'{i}.png')
+            with open(path, 'wb') as wf:
+                wf.write(bytes([i]) * 10)
+            self.cache.get(path)
+        self.cache.release()
+        sizes = [os.path.getsize(f.path) for f in os.scandir(self.cache_dir)]
+        self.assertLessEqual(sum(sizes), 30)
+
+
+class TestImageOptimizer(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.img = os.path.join(self.tmp.name, 'a.jpg')
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        Image.new('RGB', (400, 200), 'red').save(self.img, exif=exif)
+        self.optimizer = ImageOptimizer(os.path.join(self.tmp.name, '.optimized'),
+                                        max_dim=100)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_derivative(self):
+        with Image.open(self.optimizer.get(self.img)) as im:
+            self.assertEqual(im.size, (100, 50))
+            self.assertEqual(im.format, 'JPEG')
+            self.assertEqual(len(im.getexif()), 0)
+
+    def test_resized_larger(self):
+        # Re-encoding at the default quality outgrows a low quality original
+        noise = Image.effect_noise((120, 60), 100).convert('RGB')
+        noise.save(self.img, quality=5)
+        with Image.open(self.optimizer.get(self.img)) as im:
+            self.assertEqual(im.size, (100, 50))
+
+    def test_kept_original(self):
+        # Not resized and not smaller after re-encoding
+        noise = Image.effect_noise((80, 40), 100).convert('RGB')
+        noise.save(self.img, quality=5)
+        with open(self.optimizer.get(self.img), 'rb') as rf, open(self.img, 'rb') as orig:
+            self.assertEqual(rf.read(), orig.read())
+
+    def test_disabled(self):
+        self.optimizer.max_dim = 0
+        self.assertEqual(self.optimizer.get(self.img), self.img)
+
+    def test_settings_key(self):
+        first = self.optimizer.get(self.img)
+        self.optimizer.max_dim = 50
+        self.assertNotEqual(self.optimizer.get(self.img), first)
+
+    def test_cache_encodes_derivative(self):
+        cache = ImageCache(optimizer=self.optimizer)
+        with open(self.optimizer.get(self.img), 'rb') as rf:
+            expected = base64.b64encode(rf.read()).decode()
+        self.assertEqual(cache.get(self.img), expected)
+        self.assertNotEqual(cache.get(self.img, optimize=False), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
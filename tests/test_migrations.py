@@ -0,0 +1,89 @@
+import context
+import config
+from config import migrate_db, SCHEMA_VERSION
+
+import io
+import unittest
+from unittest import TestCase
+from unittest.mock import patch, Mock
+from contextlib import redirect_stdout
+import mongomock
+
+
+class TestMigrations(TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.db.questions.insert_many([
+            {'name': 'A0199', 'in_exams': {'e1': 0.5, 'e2': float('nan')}},
+            {'name': 'A0200', 'in_exams': {}}, {'name': 'A0203', 'in_exams': {'e1': 1.0}}
+        ])
+        self.db.exams.insert_one({'name': 'exam'})
+        for target in ['DB', 'QUESTIONS', 'EXAMS', 'COUNTERS', 'EXAM_QUESTIONS',
+                       'QUESTION_STATS']:
+            value = self.db if target == 'DB' else self.db[target.lower()]
+            patcher = patch.object(config, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_migrate(self):
+        self.assertEqual(migrate_db(), SCHEMA_VERSION)
+        self.assertEqual(sorted(self.db.meta.find_one({'_id': 'schema'})['applied']),
+                         sorted(m.__name__ for m in config.MIGRATIONS))
+        q = self.db.questions.find_one({'name': 'A0203'})
+        self.assertEqual((q['category'], q['family_no'], q['child_no']), ('A', 2, 3))
+        self.assertTrue(self.db.questions.index_information()['name_1'].get('unique'))
+        self.assertTrue(self.db.exams.index_information()['name_1'].get('unique'))
+        self.assertEqual(config.new_question_name(None, 'child', 'A0200'), 'A0204')
+        self.assertEqual(config.exam_appearances(), {'A0199': 2, 'A0203': 1})
+        self.assertEqual(self.db.exam_questions.find_one({'exam': 'e1', 'question': 'A0199'})['score'], 0.5)
+
+    def test_idempotent(self):
+        migrate_db()
+        with patch.object(config, 'MIGRATIONS', [
+            Mock(side_effect=AssertionError, __name__=m.__name__) for m in config.MIGRATIONS
+        ]):
+            # Nothing left to run
+            self.assertEqual(migrate_db(), SCHEMA_VERSION)
+        self.db.meta.delete_many({})
+        self.assertEqual(migrate_db(), SCHEMA_VERSION)
+
+    def test_replaces_index(self):
+        self.db.questions.create_index('name')
+        migrate_db()
+        self.assertTrue(self.db.questions.index_information()['name_1'].get('unique'))
+
+    def test_legacy_version(self):
+        # Databases migrated before migrations were stored by name
+        self.db.meta.insert_one({'_id': 'schema', 'version': 2})
+        with patch.object(config, '_migrate_name_fields') as name_fields:
+            self.assertEqual(migrate_db(), SCHEMA_VERSION)
+        name_fields.assert_not_called()
+        self.assertFalse(self.db.questions.find_one({'name': 'A0203'}).get('category'))
+
+    def test_failure(self):
+        duplicate = self.db.exams.insert_one({'name': 'exam'}).inserted_id
+        with redirect_stdout(io.StringIO()) as out:
+            version = migrate_db()
+        self.assertEqual(version, SCHEMA_VERSION - 1)
+        self.assertIn("Duplicate names in collection exams: 'exam' (_id: ", out.getvalue())
+        self.assertIn(str(duplicate), out.getvalue())
+        # Later migrations don't depend on it
+        self.assertEqual(config.exam_appearances(), {'A0199': 2, 'A0203': 1})
+        # Retried on next launch
+        self.db.exams.delete_one({'_id': duplicate})
+        self.assertEqual(migrate_db(), SCHEMA_VERSION)
+        self.assertTrue(self.db.exams.index_information()['name_1'].get('unique'))
+
+    def test_requires(self):
+        with patch.object(config, 'MIGRATIONS', list(config.MIGRATIONS)) as migrations, \
+             redirect_stdout(io.StringIO()) as out:
+            i = migrations.index(config._migrate_exam_questions)
+            migrations[i] = Mock(side_effect=Exception('down'), __name__='_migrate_exam_questions')
+            self.assertEqual(migrate_db(), SCHEMA_VERSION - 2)
+        self.assertIn('_migrate_question_stats of database db skipped', out.getvalue())
+        self.assertEqual(migrate_db(), SCHEMA_VERSION)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import context
+import core
+from core import overview_matrix
+
+import math
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+import mongomock
+
+
+class TestOverviewMatrix(TestCase):
+
+    def setUp(self):
+        db = mongomock.MongoClient().db
+        db.exams.insert_many([{'name': 'e2'}, {'name': 'e1'}])
+        db.questions.insert_many([
+            {'name': 'B0199', 'difficulty': 2, 'time_est': 3, 'points': 2.0,
+             'in_exams': {'e1': 1.0, 'e2': float('nan'), 'gone': 1.0}, 'child_no': 99},
+            {'name': 'A0100', 'difficulty': 1, 'time_est': 1, 'points': 1.0,
+             'in_exams': {'e1': 1.0}, 'child_no': 0},
+            {'name': 'A0101', 'difficulty': 1, 'time_est': 2, 'points': 3.0,
+             'in_exams': {'e2': 1.0}, 'child_no': 1},
+            {'name': 'A0299', 'difficulty': 3, 'time_est': 4, 'points': 1.0,
+             'in_exams': {}, 'child_no': 99}
+        ])
+        for target in ['QUESTIONS', 'EXAMS']:
+            patcher = patch.object(core, target, db[target.lower()])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_matrix(self):
+        names, difficulty, time_est, exam_list, cells = overview_matrix()
+        self.assertEqual(names, ['A0101', 'A0299', 'B0199'])
+        self.assertEqual(difficulty, [1, 3, 2])
+        self.assertEqual(time_est, [2, 4, 3])
+        self.assertEqual(exam_list, ['e1', 'e2'])
+        self.assertEqual(cells.shape, (3, 2))
+        self.assertEqual(cells[0].tolist(), ['.', 0.33])
+        self.assertEqual(cells[1].tolist(), ['.', '.'])
+        self.assertEqual(cells[2, 0], 0.5)
+        self.assertIs(type(cells[2, 0]), float)
+        self.assertTrue(math.isnan(cells[2, 1]))
+
+    def test_empty(self):
+        core.QUESTIONS.delete_many({})
+        names, difficulty, time_est, exam_list, cells = overview_matrix()
+        self.assertEqual(names, [])
+        self.assertEqual(cells.shape, (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import context
+import core
+from core import resolve_placeholders
+
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestResolvePlaceholders(TestCase):
+
+    q = {
+        'tables': {'tbl1': [['h'], ['[[file1]]']]},
+        'img_files': ['a.png', 'b.jpg']
+    }
+
+    def setUp(self):
+        patcher = patch.object(core.IMAGE_CACHE, 'get', side_effect=lambda p: p[-5:])
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_table(self):
+        text = resolve_placeholders(self.q, 'A [[tbl1]] B', images=False)
+        self.assertTrue(text.startswith('A <table>'))
+        self.assertIn('<th scope="col"', text)
+        self.assertIn('<td style="border-width: 1px; border-style: solid;">[[file1]]</td>', text)
+
+    def test_image(self):
+        text = resolve_placeholders(self.q, '[[file2]]')
+        self.assertEqual(text, '<img src="data:image/jpg;base64,b.jpg" alt="" />')
+
+    def test_image_in_table(self):
+        text = resolve_placeholders(self.q, '[[tbl1]]')
+        self.assertIn('base64,a.png', text)
+
+    def test_tables_disabled(self):
+        self.assertEqual(resolve_placeholders(self.q, '[[tbl1]]', tables=False), '[[tbl1]]')
+
+    def test_gaps(self):
+        gaps = {'x': '1', '1': '2'}
+        # Replacements are not applied to each other's results
+        self.assertEqual(resolve_placeholders(self.q, '[[x]] [[1]]', gaps=gaps), '[[1]] [[2]]')
+
+    def test_unknown(self):
+        self.assertEqual(resolve_placeholders(self.q, '[[a [[y]] b]]'), '[[a [[y]] b]]')
+
+    def test_attachments(self):
+        attachments = []
+        text = resolve_placeholders(self.q, '[[file1]] [[tbl1]] [[file2]]',
+                                    attachments=attachments)
+        self.assertTrue(text.startswith('<img src="@@PLUGINFILE@@/a.png" alt="" />'))
+        self.assertEqual(attachments, ['a.png', 'b.jpg'])
+        self.get.assert_not_called()
+
+    def test_missing_table(self):
+        with self.assertRaises(KeyError):
+            resolve_placeholders(self.q, '[[tbl2]]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import context
+from config import QuestionCache
+
+import unittest
+from unittest import TestCase
+import mongomock
+
+
+class TestQuestionCache(TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.questions
+        self.collection.insert_many([
+            {'name': f'test{i:02d}99', 'points': float(i)} for i in range(5)
+        ])
+        self.cache = QuestionCache(self.collection, maxsize=3)
+
+    def test_hit_and_miss(self):
+        self.cache.get('test0099')
+        self.cache.get('test0099')
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_missing_question(self):
+        self.assertIsNone(self.cache.get('unknown'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_returns_copy(self):
+        self.cache.get('test0099').pop('_id')
+        self.assertIn('_id', self.cache.get('test0099'))
+
+    def test_lru_eviction(self):
+        for i in [0, 1, 2, 0, 3]:
+            self.cache.get(f'test{i:02d}99')
+        self.assertEqual(self.cache.stats()['size'], 3)
+        self.cache.get('test0199')
+        self.assertEqual(self.cache.misses, 5)
+
+    def test_invalidate(self):
+        self.cache.get('test0099')
+        self.collection.update_one({'name': 'test0099'}, {'$set': {'points': 9.}})
+        self.assertEqual(self.cache.get('test0099')['points'], 0.)
+        self.cache.invalidate('test0099')
+        self.assertEqual(self.cache.get('test0099')['points'], 9.)
+
+    def test_get_many(self):
+        self.cache.get('test0099')
+        result = self.cache.get_many(['test0099', 'test0199', 'unknown'])
+        self.assertEqual(sorted(result), ['test0099', 'test0199'])
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
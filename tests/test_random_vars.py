@@ -0,0 +1,107 @@
+import context
+import core
+from core import RandomVars
+
+import os
+import time
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+import numpy as np
+
+
+class TestRandomVars(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.rv = RandomVars(self.tmp.name, timeout=5)
+        self.addCleanup(self.rv.close)
+        self.write('X0100', 'a = np.arange(3)\nb = a * 2\n')
+
+    def write(self, name, source):
+        with open(os.path.join(self.tmp.name, f'rv_{name}.py'), 'w') as wf:
+            wf.write('import numpy as np\n' + source)
+
+    def get(self, rv=None):
+        rv = rv or self.rv
+        with patch.object(rv, '_submit', wraps=rv._submit) as submit:
+            values = rv.get('X0100', ['a', 'b'])
+        return values, submit.call_count
+
+    def test_values(self):
+        values, runs = self.get()
+        self.assertEqual(runs, 1)
+        np.testing.assert_array_equal(values['a'], [0, 1, 2])
+        np.testing.assert_array_equal(values['b'], [0, 2, 4])
+
+    def test_cache_hit(self):
+        self.get()
+        values, runs = self.get()
+        self.assertEqual(runs, 0)
+        np.testing.assert_array_equal(values['b'], [0, 2, 4])
+        # Persisted for other processes and later launches
+        other = RandomVars(self.tmp.name)
+        self.addCleanup(other.close)
+        self.assertEqual(self.get(other)[1], 0)
+
+    def test_changed_module(self):
+        self.get()
+        self.write('X0100', 'a = np.arange(4)\nb = a * 3\n')
+        values, runs = self.get()
+        self.assertEqual(runs, 1)
+        np.testing.assert_array_equal(values['b'], [0, 3, 6, 9])
+        # Results of the previous version are dropped
+        self.assertEqual(len(os.listdir(self.rv.cache_dir)), 1)
+
+    def test_changed_array_size(self):
+        self.get()
+        with patch.object(core, 'RANDOM_ARR_SIZE', core.RANDOM_ARR_SIZE + 1):
+            self.assertEqual(self.get()[1], 1)
+
+    def test_prefetch(self):
+        self.write('X0200', 'a = np.ones(2)\n')
+        self.rv.prefetch([('X0100', ['a', 'b']), ('X0200', ['a']), ('X0300', ['a'])])
+        self.assertEqual(self.get()[1], 0)
+        with patch.object(self.rv, '_submit', side_effect=AssertionError):
+            np.testing.assert_array_equal(self.rv.get('X0200', ['a'])['a'], [1., 1.])
+
+    def test_error(self):
+        self.write('X0100', 'raise ValueError("broken")\n')
+        with self.assertRaises(ValueError):
+            self.rv.get('X0100', ['a'])
+        self.assertFalse(os.path.isdir(self.rv.cache_dir) and os.listdir(self.rv.cache_dir))
+
+    def test_timeout(self):
+        self.rv.timeout = 0.5
+        self.write('X0100', 'import time\ntime.sleep(30)\na = np.arange(3)\n')
+        start = time.time()
+        with self.assertRaises(TimeoutError):
+            self.rv.get('X0100', ['a'])
+        self.assertLess(time.time() - start, 10)
+        # The hanging worker is gone, later modules get a new pool
+        self.assertIsNone(self.rv._pool)
+        self.write('X0100', 'a = np.arange(3)\n')
+        np.testing.assert_array_equal(self.rv.get('X0100', ['a'])['a'], [0, 1, 2])
+
+    def test_prefetch_timeout(self):
+        # As many hanging modules as workers
+        self.rv.timeout = 1
+        items = []
+        for i in range(self.rv.workers):
+            self.write(f'X09{i:02d}', 'import time\ntime.sleep(30)\na = np.arange(3)\n')
+            items.append((f'X09{i:02d}', ['a']))
+        for i in range(6):
+            self.write(f'X02{i:02d}', f'a = np.arange({i + 1})\n')
+            items.append((f'X02{i:02d}', ['a']))
+        start = time.time()
+        self.rv.prefetch(items)
+        # Healthy modules don't wait for the pool of the hanging ones
+        self.assertLess(time.time() - start, self.rv.workers * self.rv.timeout + 2)
+        for name, variables in items[self.rv.workers:]:
+            self.assertIsNotNone(self.rv._cached(self.rv.key(name), variables))
+
+
+if __name__ == '__main__':
+    unittest.main()